@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 import os
 
@@ -7,4 +8,6 @@ sys.path.insert(0, os.path.dirname(__file__))
 from lcsx import main
 
 if __name__ == "__main__":
+    # Worker processes of a frozen (PyInstaller) build re-run this binary; this hands them to multiprocessing
+    multiprocessing.freeze_support()
     main()
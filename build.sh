@@ -32,6 +32,7 @@ echo "[*] Running PyInstaller..."
   --add-data "config:config" \
   --add-data "core:core" \
   --add-data "ui:ui" \
+  --add-data "libs:libs" \
   --hidden-import psutil \
   __main__.py
 
@@ -0,0 +1,131 @@
+"""
+Artifact catalog for LCSX.
+Download URLs for the supported distributions and tools, with pinned checksums.
+"""
+
+import platform
+from lcsx.config.constants import (
+    PROOT_DISTRO_VERSION, PROOT_DISTRO_BASE_URL, ALPINE_DISTRO_BASE_URL,
+    PROOT_X86_64_URL, PROOT_ARM64_URL, ALPINE_PACKAGES_BASE_URL, ALPINE_PACKAGES_BRANCH,
+    ALPINE_APK_TOOLS_STATIC, GOTTY_BASE_URL, SSHX_X86_64_URL, SSHX_ARM64_URL
+)
+
+# Architectures lcsx can set up
+ARCHITECTURES = ('x86_64', 'aarch64')
+
+# Pinned sha256 digests keyed by URL. Downloads of a pinned URL are hashed
+# while they stream in and rejected on mismatch. The proot entries are the
+# binaries shipped in libs/ at the commit PROOT_BASE_URL points to. Every
+# versioned catalog URL (rootfs tarballs, gotty, apk-tools-static) belongs
+# here: `lcsx cache pins` downloads the catalog and prints the entries to
+# paste, so run it whenever a release URL is bumped.
+ARTIFACT_SHA256 = {
+    PROOT_X86_64_URL: '0e0e4804466b366f64ea9ad646eb07bf44597029c0707d16529d3e1d6d7c32c3',
+    PROOT_ARM64_URL: 'fa10b1a7818c2f5b1dcb5834450570c368c9ecf66d31521509621b95c4538a45',
+}
+
+# The only catalog URLs that are never pinned: sshx publishes its latest
+# build under a fixed, unversioned name, so its digest changes with every
+# release. These are revalidated upstream instead (ETag/Last-Modified).
+UNPINNED_URLS = frozenset((SSHX_X86_64_URL, SSHX_ARM64_URL))
+
+
+# Artifacts the repository ships in libs/, keyed by URL. They match the
+# pinned digests above, so they can stand in for a download.
+SHIPPED_LIBS = {
+    PROOT_X86_64_URL: 'proot',
+    PROOT_ARM64_URL: 'prootarm64',
+}
+
+
+# Built-in mirrors keyed by origin URL prefix. Mirrors from the user's
+# mirrors.json are tried before these; the origin itself is always last.
+MIRRORS = {
+    ALPINE_PACKAGES_BASE_URL: ['https://mirrors.edge.kernel.org/alpine'],
+}
+
+
+def get_distros(arch):
+    """Return the available distros for an architecture with compatibility levels and shells."""
+    return {
+        'Debian': {
+            'url': f"{PROOT_DISTRO_BASE_URL}/debian-trixie-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
+            'compat': 'Stable',
+            'shell': '/bin/bash'
+        },
+        'Arch Linux': {
+            'url': f"{PROOT_DISTRO_BASE_URL}/archlinux-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
+            'compat': 'Bleeding',
+            'shell': '/bin/bash'
+        },
+        'Void': {
+            'url': f"{PROOT_DISTRO_BASE_URL}/void-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
+            'compat': 'Balanced',
+            'shell': '/bin/bash'
+        },
+        'Alpine': {
+            'url': f"{ALPINE_DISTRO_BASE_URL}/alpine-{arch}-pd-v4.30.1.tar.xz",
+            'compat': 'Balanced',
+            'shell': '/bin/sh'
+        },
+    }
+
+
+def get_artifacts(arch):
+    """Return every artifact a setup on arch may download, as {name: url}."""
+    artifacts = {f"{name} rootfs": distro['url'] for name, distro in get_distros(arch).items()}
+    artifacts['proot'] = PROOT_X86_64_URL if arch == 'x86_64' else PROOT_ARM64_URL
+    artifacts['gotty'] = f"{GOTTY_BASE_URL}/gotty_linux_{'amd64' if arch == 'x86_64' else 'arm64'}.tar.gz"
+    artifacts['sshx'] = SSHX_X86_64_URL if arch == 'x86_64' else SSHX_ARM64_URL
+    # The Alpine setup always bootstraps with the x86_64 apk-tools-static
+    artifacts['apk-tools-static'] = (f"{ALPINE_PACKAGES_BASE_URL}/{ALPINE_PACKAGES_BRANCH}/main/x86_64/"
+                                     f"{ALPINE_APK_TOOLS_STATIC}")
+    return artifacts
+
+
+def select_artifacts(arches=None, distros=None):
+    """
+    Return [(name, url), ...] for proot, gotty, sshx and the chosen rootfs tarballs.
+
+    Args:
+        arches: Architectures to include; defaults to the host's.
+        distros: Distribution names (e.g. 'Debian', 'arch'); defaults to all.
+            Names match case-insensitively on the full name or its first word.
+
+    Raises:
+        ValueError: If a distribution name is unknown.
+    """
+    arches = arches or [platform.machine()]
+    selected = []
+    for arch in arches:
+        artifacts = get_artifacts(arch)
+        names = [name[:-len(' rootfs')] for name in artifacts if name.endswith(' rootfs')]
+        if distros:
+            wanted = []
+            for requested in distros:
+                matches = [n for n in names if requested.lower() in (n.lower(), n.split()[0].lower())]
+                if not matches:
+                    raise ValueError(f"Unknown distribution '{requested}' (available: {', '.join(names)})")
+                wanted += matches
+        else:
+            wanted = names
+        selected += [(f"{arch} {name}", artifacts[name]) for name in ('proot', 'gotty', 'sshx')]
+        selected += [(f"{arch} {name} rootfs", artifacts[f"{name} rootfs"]) for name in wanted]
+        if 'Alpine' in wanted:
+            selected.append(('apk-tools-static', artifacts['apk-tools-static']))
+    unique = []
+    for name, url in selected:
+        if url not in [u for _, u in unique]:
+            unique.append((name, url))
+    return unique
+
+
+def get_pinned_sha256(url):
+    """Return the pinned sha256 for url, or None if it is not pinned."""
+    return ARTIFACT_SHA256.get(url)
+
+
+def missing_pins(arches=ARCHITECTURES):
+    """Return [(name, url), ...] for catalog artifacts that should be pinned but are not."""
+    return [(name, url) for name, url in select_artifacts(list(arches))
+            if url not in ARTIFACT_SHA256 and url not in UNPINNED_URLS]
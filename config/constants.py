@@ -3,6 +3,8 @@ Constants for LCSX configuration.
 Centralized configuration values to improve maintainability.
 """
 
+import os
+
 # Default values
 DEFAULT_PORT = 6040
 DEFAULT_SHELL = '/bin/bash'
@@ -37,11 +39,94 @@ GOTTY_BASE_URL = f"https://github.com/yudai/gotty/releases/download/{GOTTY_VERSI
 SSHX_X86_64_URL = "https://sshx.s3.amazonaws.com/sshx-x86_64-unknown-linux-musl.tar.gz"
 SSHX_ARM64_URL = "https://sshx.s3.amazonaws.com/sshx-aarch64-unknown-linux-musl.tar.gz"
 
+# Alpine package repository (apk-tools-static and base packages)
+ALPINE_PACKAGES_BASE_URL = "https://dl-cdn.alpinelinux.org/alpine"
+ALPINE_PACKAGES_BRANCH = "v3.9"
+ALPINE_APK_TOOLS_STATIC = "apk-tools-static-2.10.6-r0.apk"
+
 # Network timeouts (in seconds)
 DOWNLOAD_TIMEOUT = 300  # 5 minutes
 CONNECTION_TIMEOUT = 30  # 30 seconds
 
+# Stall watchdog: abort a transfer slower than STALL_MIN_RATE for STALL_WINDOW seconds
+STALL_MIN_RATE = 10 * 1024  # 10 KB/s
+STALL_WINDOW = 30  # seconds
+
+# Bandwidth limit, split evenly between the lcsx processes downloading on the host
+RATE_LIMIT = 0  # bytes per second, 0 = unlimited
+RATE_LIMIT_DIR = os.path.join(os.path.expanduser("~"), ".lcsx", "ratelimit")
+RATE_LIMIT_HEARTBEAT = 1  # seconds between share recomputations
+RATE_LIMIT_PEER_TIMEOUT = 5  # seconds without a heartbeat before a peer no longer counts
+
+# Segmented downloads (parallel byte ranges for large files)
+DOWNLOAD_SEGMENTS = 4
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024  # 4 MB
+
+# Pipe the rootfs download straight into the extractor (no temporary rootfs.tar.xz)
+ROOTFS_STREAM_EXTRACT = True
+
+# Archive extraction: 'auto' pipes archives through GNU tar/bsdtar (with xz -T0, pixz or pigz)
+# when installed, 'python' always uses the in-process extractor
+EXTRACT_BACKEND = 'auto'
+
+# In-process extraction: parallel xz block decoding and a bounded pool writing file contents
+EXTRACT_DECODE_THREADS = 0  # 0 = one per CPU, 1 = serial decoding
+EXTRACT_DECODE_BUFFER = 512 * 1024 * 1024  # 512 MB of decoded blocks held ahead of the tar reader
+EXTRACT_WRITE_THREADS = 4
+EXTRACT_WRITE_BUFFER = 64 * 1024 * 1024  # 64 MB of file contents queued for the writers
+EXTRACT_WRITE_MAX_FILE = 8 * 1024 * 1024  # larger files are written by the reader itself
+
+# Progress display
+PROGRESS_REFRESH_RATE = 10  # redraws per second on a terminal
+PROGRESS_LOG_INTERVAL = 10  # seconds between progress lines when not on a terminal
+
 # Retry configuration
 MAX_DOWNLOAD_RETRIES = 3
 RETRY_DELAY = 5  # seconds
 
+# Artifact cache (shared by all data directories on the host)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lcsx")
+CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024  # 10 GB
+CACHE_REVALIDATE_INTERVAL = 24 * 60 * 60  # check cached URLs upstream once a day
+CACHE_WARM_JOBS = 4  # artifacts fetched at once by lcsx cache warm
+# Fast copy of cached rootfs tarballs: 'off', 'auto' (zstd when installed, else tar), 'zstd' or 'tar'
+CACHE_TRANSCODE = 'off'
+# Member index of cached rootfs tarballs, for extracting single files (lcsx cache index / extract)
+CACHE_SEEK_INDEX = False  # build it in the background after the first download
+SEEK_BLOCK_SIZE = 1024 * 1024  # uncompressed bytes per xz block when a tarball has to be re-chunked
+SEEK_MAX_BLOCK = 8 * 1024 * 1024  # tarballs whose xz blocks are no larger are indexed in place
+SEEK_PRESET = 6  # xz preset of re-chunked copies
+
+# Rootfs templates: one pristine extracted tree per rootfs tarball, cloned into new data directories
+DEFAULT_TEMPLATE_DIR = os.path.join(DEFAULT_CACHE_DIR, "templates")
+# 'auto' (reflink; no template where the filesystem cannot reflink), 'reflink', 'copy' or 'hardlink'
+# (opt-in only), or 'off'
+TEMPLATE_CLONE = 'auto'
+TEMPLATE_MAX_SIZE = 8 * 1024 * 1024 * 1024  # 8 GB; least recently cloned templates are evicted beyond it
+TEMPLATE_CLONE_THREADS = 8
+# Copied rather than hard linked, since instances edit files there in place
+TEMPLATE_COPY_PATHS = ('etc', 'root', 'home', 'var', 'tmp', 'run')
+
+# Layered rootfs: one sealed base tree per distribution release shared by all instances,
+# with the LAYER_PATHS of each instance kept in its data directory and bound over the base
+ROOTFS_LAYOUT = 'copy'  # 'copy' (a full rootfs per instance) or 'layered'
+DEFAULT_BASE_DIR = os.path.join(DEFAULT_CACHE_DIR, "bases")
+LAYER_PATHS = ('etc', 'root', 'home', 'var', 'tmp')
+
+# Rootfs manifests (<rootfs dir>.manifest): size, mode, mtime and hash of every extracted entry
+MANIFEST_WORKERS = 0  # processes hashing and verifying (0 = one per CPU)
+VERIFY_SAMPLE_RATE = 0.02  # fraction of files re-hashed by a sampled verify
+# Modified files under these hold an instance's own state: verify reports them apart from damage
+# and repair only restores them when missing
+REPAIR_KEEP_MODIFIED = ('etc', 'root', 'home', 'var', 'tmp', 'run')
+
+# LAN cache server (lcsx cache serve)
+CACHE_SERVER_HOST = "0.0.0.0"
+CACHE_SERVER_PORT = 8730
+
+# Mirrors (origin URL prefix -> ordered mirror list) and probe results
+MIRRORS_FILE = os.path.join(os.path.expanduser("~"), ".lcsx", "mirrors.json")
+MIRROR_PROBE_FILE = os.path.join(os.path.expanduser("~"), ".lcsx", "mirror-probes.json")
+MIRROR_PROBE_TTL = 6 * 60 * 60  # 6 hours
+MIRROR_PROBE_TIMEOUT = 5  # seconds
+MIRROR_PROBE_BYTES = 256 * 1024  # 256 KB
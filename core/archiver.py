@@ -0,0 +1,223 @@
+"""
+Native archivers for LCSX.
+Detects GNU tar, bsdtar and parallel decompressors (xz -T0, pixz, pigz) and pipes archives through them.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from lcsx.core.logger import get_logger
+
+FEED_CHUNK_SIZE = 1024 * 1024
+
+# Members skipped on extraction, matching extract.is_excluded_member for dev/*
+# ('dev/*' would make bsdtar drop the dev directory itself, which the other extractors keep)
+DEV_EXCLUDES = ('dev/?*', './dev/?*')
+# Device nodes elsewhere cannot be excluded by type: an unprivileged tar fails to create
+# them, which is what the in-process extractor's skip amounts to. Errors like these
+# (GNU tar, bsdtar), with nothing else wrong, do not fail the extraction.
+_DEVICE_ERRORS = (re.compile(r': Cannot mknod: '), re.compile(r": Can't create '.*': Operation not permitted$"))
+_SUMMARY_ERRORS = re.compile(r'Exiting with failure status due to previous errors|Error exit delayed from previous errors')
+
+# Decompressors tried in order for each tarfile compression suffix: (tool, label, arguments)
+_DECOMPRESSORS = {
+    'xz': (('pixz', 'pixz', ['-d']), ('xz', 'xz -T0', ['-d', '-c', '-T0'])),
+    'gz': (('pigz', 'pigz', ['-d', '-c']), ('gzip', 'gzip', ['-d', '-c'])),
+    'zst': (('zstd', 'zstd', ['-d', '-c']),),
+}
+
+_detected = None
+_detect_lock = threading.Lock()
+
+
+class NativeExtractError(OSError):
+    """A native archiver exited with an error."""
+
+
+def _version_output(command):
+    """Return the --version output of command, or None if it cannot run."""
+    try:
+        result = subprocess.run([command, '--version'], capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout + result.stderr
+
+
+def detect_tools():
+    """
+    Find the archivers installed on this host (once per process).
+
+    Returns:
+        dict: Tool name ('gnutar', 'bsdtar', 'pixz', 'xz', 'pigz', 'gzip', 'zstd') -> executable path.
+    """
+    global _detected
+    with _detect_lock:
+        if _detected is not None:
+            return _detected
+        tools = {}
+        for command in ('tar', 'gtar'):
+            path = shutil.which(command)
+            if path and 'GNU tar' in (_version_output(path) or ''):
+                tools['gnutar'] = path
+                break
+        path = shutil.which('bsdtar')
+        if path and 'bsdtar' in (_version_output(path) or ''):
+            tools['bsdtar'] = path
+        for name in ('pixz', 'pigz', 'gzip', 'zstd'):
+            path = shutil.which(name)
+            if path:
+                tools[name] = path
+        path = shutil.which('xz')
+        if path:
+            version = re.search(r'(\d+)\.(\d+)', _version_output(path) or '')
+            # -T is accepted from 5.2 on, and decoding uses it from 5.4 on
+            if version and (int(version.group(1)), int(version.group(2))) >= (5, 2):
+                tools['xz'] = path
+        get_logger().info(f"Native archivers: {', '.join(sorted(tools)) or 'none'}")
+        _detected = tools
+        return tools
+
+
+class NativeExtractor:
+    """
+    Extracts a tar stream with external processes: an optional decompressor
+    piped into GNU tar or bsdtar.
+
+    The archive is fed to the first process from Python, so file paths,
+    download streams and progress reporting all work the same way as with
+    the in-process extractor.
+    """
+
+    def __init__(self, name, tar_command, decompress_command=None, skip_devices=False):
+        self.name = name
+        self.tar_command = tar_command
+        self.decompress_command = decompress_command
+        self.skip_devices = skip_devices
+
+    def _only_device_errors(self, codes, lines):
+        """True if tar failed only because device nodes could not be created."""
+        if not self.skip_devices or any(codes[:-1]):
+            return False
+        failures = [line for line in lines if line.strip() and not _SUMMARY_ERRORS.search(line)]
+        return bool(failures) and all(any(p.search(line) for p in _DEVICE_ERRORS) for line in failures)
+
+    def extract(self, source, dest_dir, progress=None):
+        """
+        Extract the archive read from source into dest_dir.
+
+        Args:
+            source: Path to the archive or a readable file object.
+            dest_dir: Directory to extract into.
+            progress: Optional ProgressBar advanced by the archive bytes consumed.
+
+        Raises:
+            NativeExtractError: If a process exits with an error, other than
+                tar failing only to create device nodes when skip_devices is set.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        fileobj = None
+        if isinstance(source, (str, bytes, os.PathLike)):
+            if progress is not None:
+                progress.set_total(os.path.getsize(source))
+            fileobj = source = open(source, 'rb')
+        processes = []
+        with tempfile.TemporaryFile() as errors:
+            try:
+                tar = self.tar_command + ['-C', dest_dir]
+                if self.decompress_command:
+                    first = subprocess.Popen(self.decompress_command, stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=errors)
+                    processes.append(first)
+                    processes.append(subprocess.Popen(tar, stdin=first.stdout, stderr=errors))
+                    first.stdout.close()
+                else:
+                    first = subprocess.Popen(tar, stdin=subprocess.PIPE, stderr=errors)
+                    processes.append(first)
+                self._feed(source, first.stdin, progress)
+                codes = [process.wait() for process in processes]
+            except BaseException:
+                for process in processes:
+                    process.kill()
+                    process.wait()
+                raise
+            finally:
+                if fileobj is not None:
+                    fileobj.close()
+            if any(codes):
+                errors.seek(0)
+                message = errors.read().decode('utf-8', 'replace').strip().splitlines()
+                if self._only_device_errors(codes, message):
+                    get_logger().info(f"{self.name} skipped {len(message) - 1} device node(s) it may not create")
+                    return
+                raise NativeExtractError(f"{self.name} failed (exit {codes}): "
+                                         f"{'; '.join(message[-3:]) or 'no error output'}")
+
+    @staticmethod
+    def _feed(source, pipe, progress):
+        """Copy source into pipe; stop early if the reader goes away."""
+        try:
+            while True:
+                chunk = source.read(FEED_CHUNK_SIZE)
+                if not chunk:
+                    break
+                pipe.write(chunk)
+                if progress is not None:
+                    progress.update(len(chunk))
+        except BrokenPipeError:
+            # The exit status reports why
+            pass
+        finally:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+
+def _tar_command(tools, tar_tool, exclude_dev):
+    command = [tools[tar_tool], '-x', '-p', '-f', '-']
+    if exclude_dev and tar_tool == 'gnutar':
+        # --anchored keeps dev/* to the top level, as the in-process extractor does
+        command += ['--anchored'] + [f'--exclude={pattern}' for pattern in DEV_EXCLUDES]
+    elif exclude_dev:
+        for pattern in DEV_EXCLUDES:
+            command += ['--exclude', pattern]
+    return command
+
+
+def list_native_extractors(compression, exclude_dev=True):
+    """
+    List the native pipelines available for a tar archive, fastest first.
+
+    GNU tar is preferred over bsdtar, with pixz or xz -T0 (pigz or gzip)
+    decompressing in a separate process; bsdtar can also decompress by
+    itself with libarchive, single-threaded.
+
+    Args:
+        compression: Compression suffix of the stream mode ('xz', 'gz', 'zst' or '' for none).
+        exclude_dev: Skip dev/* members and device nodes, as extract.is_excluded_member does.
+
+    Returns:
+        list: NativeExtractor objects, empty if no suitable tool is installed.
+    """
+    tools = detect_tools()
+    decompressors = [(label, [tools[name]] + arguments)
+                     for name, label, arguments in _DECOMPRESSORS.get(compression, ()) if name in tools]
+    extractors = []
+    for tar_tool, tar_name in (('gnutar', 'GNU tar'), ('bsdtar', 'bsdtar')):
+        if tar_tool not in tools:
+            continue
+        tar = _tar_command(tools, tar_tool, exclude_dev)
+        for label, command in decompressors:
+            extractors.append(NativeExtractor(f"{tar_name} + {label}", tar, command, skip_devices=exclude_dev))
+        if not compression or tar_tool == 'bsdtar':
+            extractors.append(NativeExtractor(tar_name, tar, skip_devices=exclude_dev))
+    return extractors
+
+
+def find_native_extractor(compression, exclude_dev=True):
+    """Return the fastest native pipeline for a tar archive, or None."""
+    extractors = list_native_extractors(compression, exclude_dev)
+    return extractors[0] if extractors else None
@@ -0,0 +1,184 @@
+"""
+Offline bundles for LCSX.
+Packs artifacts into one indexed tar file and seeds an artifact cache from it without network access.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+from lcsx.config.catalog import SHIPPED_LIBS, get_pinned_sha256
+from lcsx.core.download import IntegrityError, hash_file
+from lcsx.core.proot import find_bundled_proot
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_main
+from lcsx.ui.progress import ProgressBar
+
+BUNDLE_INDEX = 'index.json'
+BUNDLE_VERSION = 1
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class BundleError(Exception):
+    """A bundle is malformed or incomplete."""
+
+
+def seed_shipped_lib(cache, url):
+    """
+    Store the shipped copy of url in the cache, if there is one matching its pin.
+
+    Returns:
+        str: Blob path, or None.
+    """
+    path = find_bundled_proot(SHIPPED_LIBS[url], url) if url in SHIPPED_LIBS else None
+    if path is None:
+        return None
+    digest = hash_file(path).hexdigest()
+    tmp_path = os.path.join(cache.tmp_dir, f"{digest}.seed")
+    shutil.copyfile(path, tmp_path)
+    return cache.store(url, tmp_path, digest=digest)
+
+
+def create_bundle(cache, out_path, artifacts):
+    """
+    Write a bundle of artifacts to out_path.
+
+    Artifacts are taken from the cache, or downloaded into it first; proot
+    comes from libs/ when the repository ships it. The bundle is an
+    uncompressed tar whose first member is index.json (name, URL, sha256
+    and size per artifact), followed by one blobs/<sha256> member per
+    distinct artifact, so it can be imported in a single sequential pass.
+
+    Args:
+        cache: ArtifactCache to fill and read from.
+        out_path: Bundle file to write.
+        artifacts: [(name, url), ...], e.g. from catalog.select_artifacts().
+
+    Returns:
+        list: The index entries written.
+    """
+    entries = []
+    for name, url in artifacts:
+        sha256 = get_pinned_sha256(url)
+        if url in SHIPPED_LIBS and cache.lookup(url, sha256=sha256) is None:
+            seed_shipped_lib(cache, url)
+        with ProgressBar(f"Fetching {name}") as progress:
+            blob = cache.ensure(url, reporthook=progress.reporthook, segmented=name.endswith(' rootfs'),
+                                description=name, sha256=sha256)
+        entries.append({'name': name, 'url': url, 'sha256': os.path.basename(blob),
+                        'size': os.path.getsize(blob)})
+
+    index = json.dumps({'version': BUNDLE_VERSION, 'created': time.time(), 'artifacts': entries},
+                       indent=1).encode('utf-8')
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with tarfile.open(tmp_path, 'w', format=tarfile.PAX_FORMAT) as tar:
+            info = tarfile.TarInfo(BUNDLE_INDEX)
+            info.size = len(index)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(index))
+            written = set()
+            for entry in entries:
+                if entry['sha256'] in written:
+                    continue
+                written.add(entry['sha256'])
+                try:
+                    tar.add(cache.blob_path(entry['sha256']), arcname=f"blobs/{entry['sha256']}", recursive=False)
+                except FileNotFoundError:
+                    raise BundleError(f"{entry['url']} was evicted from the cache while bundling; "
+                                      f"raise the cache size or bundle fewer artifacts")
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    total = sum(entry['size'] for entry in entries)
+    print_main(f"Wrote {len(entries)} artifacts ({total / (1024**2):.1f} MB) to {out_path}")
+    get_logger().info(f"Bundle {out_path}: {', '.join(entry['url'] for entry in entries)}")
+    return entries
+
+
+def import_bundle(cache, path):
+    """
+    Seed the cache from a bundle without network access.
+
+    The bundle is read once from start to end. Each blob is copied into the
+    cache's tmp directory while it is hashed, checked against its name and
+    any pinned sha256, and renamed into place; nothing is recompressed.
+    Blobs the cache already holds are skipped.
+
+    Args:
+        cache: ArtifactCache to seed.
+        path: Bundle file.
+
+    Returns:
+        list: The index entries imported.
+
+    Raises:
+        BundleError: If the file is not a bundle or lacks an indexed artifact.
+        IntegrityError: If a blob does not match its sha256.
+    """
+    index = None
+    pending = {}
+    with open(path, 'rb') as raw, ProgressBar("Importing bundle", total=os.path.getsize(path)) as progress:
+        try:
+            tar = tarfile.open(fileobj=raw, mode='r|')
+        except tarfile.ReadError as e:
+            raise BundleError(f"{path} is not an lcsx bundle: {e}")
+        with tar:
+            for member in tar:
+                if index is None:
+                    if member.name != BUNDLE_INDEX:
+                        raise BundleError(f"{path} is not an lcsx bundle: first member is {member.name}")
+                    index = json.load(tar.extractfile(member))
+                    if index.get('version') != BUNDLE_VERSION:
+                        raise BundleError(f"Unsupported bundle version {index.get('version')}")
+                    for entry in index['artifacts']:
+                        pending.setdefault(entry['sha256'], []).append(entry)
+                    continue
+                digest = member.name.rsplit('/', 1)[-1]
+                if not member.isfile() or not member.name.startswith('blobs/') or digest not in pending:
+                    get_logger().warning(f"Ignoring unexpected bundle member {member.name}")
+                    continue
+                entries = pending.pop(digest)
+                for entry in entries:
+                    pinned = get_pinned_sha256(entry['url'])
+                    if pinned and pinned != digest:
+                        raise IntegrityError(f"Bundled {entry['url']} does not match its pinned sha256")
+                if os.path.exists(cache.blob_path(digest)) and cache.verify_blob(digest):
+                    for entry in entries:
+                        cache.alias(entry['url'], digest)
+                    progress.set(raw.tell())
+                    continue
+                _import_blob(cache, tar.extractfile(member), digest, entries, raw, progress)
+    if index is None:
+        raise BundleError(f"{path} is empty")
+    if pending:
+        missing = [entry['url'] for entries in pending.values() for entry in entries]
+        raise BundleError(f"Bundle is incomplete; missing {', '.join(missing)}")
+    print_main(f"Imported {len(index['artifacts'])} artifacts into {cache.cache_dir}")
+    return index['artifacts']
+
+
+def _import_blob(cache, source, digest, entries, raw, progress):
+    """Copy one bundled blob into the cache, hashing it on the way."""
+    tmp_path = os.path.join(cache.tmp_dir, f"{digest}.import")
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                progress.set(raw.tell())
+        if hasher.hexdigest() != digest:
+            raise IntegrityError(f"Bundled blob {digest} is corrupt (sha256 {hasher.hexdigest()})")
+        cache.store(entries[0]['url'], tmp_path, digest=digest)
+        for entry in entries[1:]:
+            cache.alias(entry['url'], digest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
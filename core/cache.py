@@ -0,0 +1,572 @@
+"""
+Artifact cache for LCSX.
+Content-addressed blob store shared by every data directory on the host.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from lcsx.config.constants import (DEFAULT_CACHE_DIR, CACHE_MAX_SIZE, CACHE_REVALIDATE_INTERVAL, CACHE_SEEK_INDEX,
+                                   CACHE_TRANSCODE)
+from lcsx.config.catalog import get_pinned_sha256
+from lcsx.core.logger import get_logger
+from lcsx.core.download import (
+    get_download_manager, DownloadStream, hash_file, conditional_headers, response_validators,
+    RETRYABLE_ERRORS
+)
+
+# Cache instance
+_cache = None
+_cache_enabled = True
+
+VERIFIED_SUFFIX = '.verified'
+
+# Fast-to-decompress copies kept next to a blob, by format
+DERIVED_SUFFIXES = {'zstd': '.tar.zst', 'tar': '.tar'}
+# Member index of a blob, and the re-chunked copy it points into when the blob itself is not seekable
+SEEK_INDEX_SUFFIX = '.idx'
+SEEKABLE_SUFFIX = '.seek.xz'
+
+
+def sha256_file(path):
+    """Return the hex sha256 digest of a file."""
+    return hash_file(path).hexdigest()
+
+
+def place_file(src, dest):
+    """Hard link src to dest, falling back to a copy across filesystems."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class ArtifactCache:
+    """
+    Blob store keyed by URL and sha256.
+
+    Layout:
+        blobs/<aa>/<sha256>   downloaded artifacts, named by content hash
+        blobs/<aa>/<sha256>.verified
+                              inode/size/mtime the blob had when its hash was checked
+        blobs/<aa>/<sha256>.tar.zst, blobs/<aa>/<sha256>.tar
+                              optional fast-to-decompress copy of a .tar.xz blob
+        blobs/<aa>/<sha256>.idx, blobs/<aa>/<sha256>.seek.xz
+                              optional member index of a .tar.xz blob, and the
+                              re-chunked copy it refers to (see core/seekable.py)
+        index.json            url -> sha256, per-blob size/last use and
+                              per-URL ETag/Last-Modified
+        tmp/                  in-flight downloads and per-URL locks
+
+    Cached URLs without a pinned sha256 are revalidated against their
+    source with a conditional request once revalidate_interval seconds
+    have passed since the last check. With transcode set to 'zstd' or
+    'tar', rootfs tarballs also get a derived copy in that format (see
+    core/transcode.py); it counts towards max_size and is evicted with its blob,
+    as is a member index. With seek_index set, rootfs tarballs are also
+    indexed in the background (see core/seekable.py).
+    """
+
+    def __init__(self, cache_dir=None, max_size=None, revalidate_interval=None, transcode=None, seek_index=None):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR))
+        self.max_size = CACHE_MAX_SIZE if max_size is None else max_size
+        self.revalidate_interval = CACHE_REVALIDATE_INTERVAL if revalidate_interval is None else revalidate_interval
+        self.transcode = CACHE_TRANSCODE if transcode is None else transcode
+        self.seek_index = CACHE_SEEK_INDEX if seek_index is None else seek_index
+        self.blob_dir = os.path.join(self.cache_dir, 'blobs')
+        self.tmp_dir = os.path.join(self.cache_dir, 'tmp')
+        self.index_file = os.path.join(self.cache_dir, 'index.json')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self, name='.lock'):
+        """Hold an exclusive host-wide lock on a file in the cache directory."""
+        lock_path = os.path.join(self.cache_dir, name)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        index.setdefault('urls', {})
+        index.setdefault('blobs', {})
+        index.setdefault('validators', {})
+        return index
+
+    def _write_index(self, index):
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_file, self.index_file)
+
+    def blob_path(self, digest):
+        """Return the on-disk path for a blob digest."""
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _mark_verified(self, digest):
+        """Record the stat of a blob whose content was just checked against its name."""
+        blob = self.blob_path(digest)
+        st = os.stat(blob)
+        marker = {'ino': st.st_ino, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+        tmp_file = f"{blob}{VERIFIED_SUFFIX}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(marker, f)
+        os.replace(tmp_file, blob + VERIFIED_SUFFIX)
+
+    def verify_blob(self, digest):
+        """
+        Return True if the blob still holds the content its name promises.
+
+        The blob is only re-hashed when its inode, size or mtime no longer
+        match the verified marker, so unchanged blobs cost a single stat().
+        """
+        blob = self.blob_path(digest)
+        try:
+            st = os.stat(blob)
+            with open(blob + VERIFIED_SUFFIX, 'r') as f:
+                marker = json.load(f)
+            if (marker.get('sha256') == digest and marker.get('ino') == st.st_ino
+                    and marker.get('size') == st.st_size and marker.get('mtime_ns') == st.st_mtime_ns):
+                return True
+        except FileNotFoundError:
+            if not os.path.exists(blob):
+                return False
+        except (json.JSONDecodeError, OSError):
+            pass
+        get_logger().info(f"Re-hashing cached blob {digest}")
+        if sha256_file(blob) != digest:
+            get_logger().warning(f"Cached blob {digest} is corrupt")
+            return False
+        self._mark_verified(digest)
+        return True
+
+    def _forget(self, digest):
+        """Drop a blob, its marker and every URL pointing at it."""
+        with self._lock():
+            index = self._read_index()
+            self._remove_blob(index, digest)
+            self._write_index(index)
+
+    def _remove_blob(self, index, digest):
+        derived = [self.blob_path(digest) + suffix
+                   for suffix in list(DERIVED_SUFFIXES.values()) + [SEEK_INDEX_SUFFIX, SEEKABLE_SUFFIX]]
+        for path in [self.blob_path(digest), self.blob_path(digest) + VERIFIED_SUFFIX] + derived:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        index['blobs'].pop(digest, None)
+        for url in [u for u, d in index['urls'].items() if d == digest]:
+            del index['urls'][url]
+            index['validators'].pop(url, None)
+
+    def lookup(self, url, sha256=None):
+        """
+        Return the cached blob path for url, or None. Marks the blob as recently used.
+
+        A blob that fails verification is deleted and reported as a miss, as
+        is one whose digest differs from the expected sha256.
+        """
+        with self._lock():
+            index = self._read_index()
+            digest = index['urls'].get(url)
+            if not digest:
+                return None
+            path = self.blob_path(digest)
+            if not os.path.exists(path):
+                self._remove_blob(index, digest)
+                self._write_index(index)
+                return None
+            index['blobs'].setdefault(digest, {'size': os.path.getsize(path)})
+            index['blobs'][digest]['last_used'] = time.time()
+            self._write_index(index)
+        if sha256 and digest != sha256.lower():
+            get_logger().warning(f"Cached copy of {url} does not match the pinned sha256; downloading again")
+            return None
+        if not self.verify_blob(digest):
+            self._forget(digest)
+            return None
+        return path
+
+    def revalidate(self, url):
+        """
+        Check whether the cached copy of url is still current upstream.
+
+        Sends one conditional request with the stored ETag/Last-Modified to
+        the source the copy came from, at most once per revalidate_interval.
+        A 304 (or a 200 carrying the same validators, from servers that
+        ignore conditions) only refreshes the check time. If the artifact
+        changed, the URL is dropped from the index so the caller downloads it
+        again. Without stored validators, or when the source cannot be
+        reached, the cached copy is kept.
+
+        Returns:
+            bool: False if the artifact changed upstream.
+        """
+        with self._lock():
+            entry = self._read_index()['validators'].get(url)
+        if not entry or time.time() - entry.get('checked', 0) < self.revalidate_interval:
+            return True
+        headers = conditional_headers(entry)
+        if not headers:
+            return True
+        source = entry.get('source') or url
+        try:
+            with get_download_manager().open(source, headers) as response:
+                current = response_validators(response)
+                # Closing without reading the body drops the connection instead of downloading it
+                unchanged = response.status == 304 or any(
+                    entry.get(key) and current[key] == entry[key] for key in ('etag', 'last_modified'))
+        except RETRYABLE_ERRORS as e:
+            get_logger().warning(f"Could not revalidate cached {url}, using cached copy: {e}")
+            return True
+        with self._lock():
+            index = self._read_index()
+            if unchanged:
+                if url in index['validators']:
+                    index['validators'][url]['checked'] = time.time()
+                get_logger().info(f"Cached {url} is up to date")
+            else:
+                index['urls'].pop(url, None)
+                index['validators'].pop(url, None)
+                get_logger().info(f"{url} changed upstream; downloading it again")
+            self._write_index(index)
+        return unchanged
+
+    def lookup_current(self, url, sha256=None):
+        """lookup() followed by a revalidation when no sha256 pins the content."""
+        blob = self.lookup(url, sha256=sha256)
+        # A pinned artifact cannot change without failing verification, so it is never revalidated
+        if blob is not None and not sha256 and not self.revalidate(url):
+            return None
+        return blob
+
+    def store(self, url, path, digest=None, validators=None):
+        """
+        Move a downloaded file into the cache and return its blob path.
+
+        Args:
+            url: URL the file was downloaded from.
+            path: Downloaded file; it is moved, not copied.
+            digest: Hex sha256 computed during the download, to skip hashing again.
+            validators: Source and ETag/Last-Modified of the download, for later revalidation.
+        """
+        digest = digest or sha256_file(path)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self._lock():
+            if os.path.exists(blob):
+                os.remove(path)
+            else:
+                os.replace(path, blob)
+                self._mark_verified(digest)
+            index = self._read_index()
+            index['urls'][url] = digest
+            # Keep the record of a derived copy when the same content is stored again
+            index['blobs'].setdefault(digest, {}).update(size=os.path.getsize(blob), last_used=time.time())
+            if validators and (validators.get('etag') or validators.get('last_modified')):
+                index['validators'][url] = dict(validators, checked=time.time())
+            else:
+                index['validators'].pop(url, None)
+            self._evict(index, keep=digest)
+            self._write_index(index)
+        get_logger().info(f"Cached {url} as {digest}")
+        return blob
+
+    def alias(self, url, digest):
+        """Point url at a blob that is already cached."""
+        with self._lock():
+            index = self._read_index()
+            if digest not in index['blobs']:
+                raise KeyError(digest)
+            index['urls'][url] = digest
+            index['validators'].pop(url, None)
+            self._write_index(index)
+
+    def derived_path(self, digest, fmt):
+        """Return the on-disk path of a blob's derived copy in format fmt."""
+        return self.blob_path(digest) + DERIVED_SUFFIXES[fmt]
+
+    def lookup_derived(self, digest):
+        """
+        Return the derived copy of a blob.
+
+        Returns:
+            tuple: (path, format), or None if there is none or it is incomplete.
+        """
+        with self._lock():
+            entry = self._read_index()['blobs'].get(digest, {}).get('derived')
+        if not entry or entry.get('format') not in DERIVED_SUFFIXES:
+            return None
+        path = self.derived_path(digest, entry['format'])
+        try:
+            if os.path.getsize(path) != entry.get('size'):
+                return None
+        except OSError:
+            return None
+        return path, entry['format']
+
+    def store_derived(self, digest, fmt, path):
+        """
+        Move a derived copy of a cached blob into place and return its path.
+
+        Returns None (and deletes path) if the blob was evicted meanwhile.
+        """
+        with self._lock():
+            index = self._read_index()
+            if digest not in index['blobs'] or not os.path.exists(self.blob_path(digest)):
+                os.remove(path)
+                return None
+            for other in DERIVED_SUFFIXES:
+                if other != fmt:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self.derived_path(digest, other))
+            dest = self.derived_path(digest, fmt)
+            os.replace(path, dest)
+            index['blobs'][digest]['derived'] = {'format': fmt, 'size': os.path.getsize(dest)}
+            self._evict(index, keep=digest)
+            self._write_index(index)
+        get_logger().info(f"Stored {fmt} copy of cached blob {digest}")
+        return dest
+
+    def seek_index_path(self, digest):
+        """Return the on-disk path of a blob's member index."""
+        return self.blob_path(digest) + SEEK_INDEX_SUFFIX
+
+    def seekable_path(self, digest):
+        """Return the on-disk path of a blob's re-chunked copy."""
+        return self.blob_path(digest) + SEEKABLE_SUFFIX
+
+    def lookup_seek_index(self, digest):
+        """
+        Return the member index of a blob.
+
+        Returns:
+            tuple: (index path, path of the archive it indexes), or None if
+            there is none or it is incomplete.
+        """
+        with self._lock():
+            entry = self._read_index()['blobs'].get(digest, {}).get('seek_index')
+        if not entry:
+            return None
+        data = self.seekable_path(digest) if entry.get('rechunked') else self.blob_path(digest)
+        try:
+            if os.path.getsize(self.seek_index_path(digest)) + (
+                    os.path.getsize(data) if entry.get('rechunked') else 0) != entry.get('size'):
+                return None
+        except OSError:
+            return None
+        return self.seek_index_path(digest), data
+
+    def store_seek_index(self, digest, index_path, data_path=None):
+        """
+        Move a member index, and the re-chunked copy it refers to if any, into place.
+
+        Returns:
+            str: Path of the index, or None (deleting both files) if the blob was evicted meanwhile.
+        """
+        with self._lock():
+            index = self._read_index()
+            if digest not in index['blobs'] or not os.path.exists(self.blob_path(digest)):
+                for path in (index_path, data_path):
+                    if path is not None:
+                        os.remove(path)
+                return None
+            size = 0
+            if data_path is not None:
+                os.replace(data_path, self.seekable_path(digest))
+                size += os.path.getsize(self.seekable_path(digest))
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.seekable_path(digest))
+            os.replace(index_path, self.seek_index_path(digest))
+            size += os.path.getsize(self.seek_index_path(digest))
+            index['blobs'][digest]['seek_index'] = {'rechunked': data_path is not None, 'size': size}
+            self._evict(index, keep=digest)
+            self._write_index(index)
+        get_logger().info(f"Stored member index of cached blob {digest}")
+        return self.seek_index_path(digest)
+
+    @staticmethod
+    def _blob_size(entry):
+        return (entry.get('size', 0) + entry.get('derived', {}).get('size', 0)
+                + entry.get('seek_index', {}).get('size', 0))
+
+    def _evict(self, index, keep=None):
+        """Remove least recently used blobs (with their derived copies and indexes) until the cache fits max_size."""
+        blobs = index['blobs']
+        total = sum(self._blob_size(entry) for entry in blobs.values())
+        for digest in sorted(blobs, key=lambda d: blobs[d].get('last_used', 0)):
+            if total <= self.max_size:
+                break
+            if digest == keep:
+                continue
+            total -= self._blob_size(blobs[digest])
+            self._remove_blob(index, digest)
+            get_logger().info(f"Evicted cached blob {digest}")
+
+    def entries(self):
+        """Return [(url, sha256, size), ...] for every cached URL."""
+        with self._lock():
+            index = self._read_index()
+        return [(url, digest, index['blobs'].get(digest, {}).get('size', 0))
+                for url, digest in sorted(index['urls'].items())]
+
+    def ensure(self, url, reporthook=None, segmented=False, description=None, sha256=None):
+        """
+        Return the blob path for url, downloading it only on a cache miss.
+
+        A per-URL lock makes concurrent processes wait for a single download
+        instead of all fetching the same artifact. Large artifacts can be
+        fetched as parallel byte ranges with segmented=True. When sha256 is
+        given, neither a cached blob nor a fresh download is used unless it
+        matches; otherwise a cache hit is revalidated when it is due.
+        """
+        url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        with self._lock(os.path.join('tmp', f"{url_key}.lock")):
+            blob = self.lookup_current(url, sha256)
+            if blob is None:
+                # Stable name so an interrupted download resumes on the next attempt
+                tmp_path = os.path.join(self.tmp_dir, f"{url_key}.download")
+                validators = {}
+                digest = get_download_manager().download(url, tmp_path, reporthook=reporthook,
+                                                         segmented=segmented, description=description,
+                                                         sha256=sha256, validators=validators)
+                blob = self.store(url, tmp_path, digest=digest, validators=validators)
+            else:
+                get_logger().info(f"Cache hit for {url}")
+        return blob
+
+    def fetch(self, url, dest_path, reporthook=None, segmented=False, description=None, sha256=None):
+        """
+        Place the artifact for url at dest_path, downloading it only on a cache miss.
+
+        See ensure() for locking, segmented downloads and verification.
+
+        Returns:
+            str: dest_path.
+        """
+        blob = self.ensure(url, reporthook=reporthook, segmented=segmented, description=description,
+                           sha256=sha256)
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+        place_file(blob, dest_path)
+        return dest_path
+
+    @contextlib.contextmanager
+    def open_stream(self, url, reporthook=None, segmented=False, sha256=None):
+        """
+        Yield a readable stream of the artifact for url.
+
+        A cached blob is revalidated like in fetch() and opened directly.
+        Otherwise the download is streamed to the caller and mirrored into the
+        cache, and stored as a blob once the caller finishes without error and
+        the body matches sha256.
+        """
+        url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        with self._lock(os.path.join('tmp', f"{url_key}.lock")):
+            blob = self.lookup_current(url, sha256)
+            if blob is not None:
+                get_logger().info(f"Cache hit for {url}")
+                with open(blob, 'rb') as f:
+                    yield f
+                return
+            tmp_path = os.path.join(self.tmp_dir, f"{url_key}.stream")
+            try:
+                with DownloadStream(url, reporthook=reporthook, tee_path=tmp_path,
+                                    segments=None if segmented else 1, sha256=sha256) as stream:
+                    yield stream
+                    digest = stream.drain()
+                self.store(url, tmp_path, digest=digest, validators=stream.validators)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+def setup_cache(cache_dir=None, max_size=None, enabled=True, revalidate_interval=None, transcode=None,
+                seek_index=None):
+    """
+    Configure the global artifact cache.
+
+    Args:
+        cache_dir: Cache directory. If None, uses ~/.cache/lcsx.
+        max_size: Size cap in bytes. If None, uses CACHE_MAX_SIZE.
+        enabled: Set to False to bypass the cache entirely.
+        revalidate_interval: Seconds between upstream checks of a cached URL.
+            If None, uses CACHE_REVALIDATE_INTERVAL.
+        transcode: Format of the fast copy kept of rootfs tarballs ('zstd', 'tar' or 'off').
+            If None, uses CACHE_TRANSCODE.
+        seek_index: Build the member index of rootfs tarballs in the background.
+            If None, uses CACHE_SEEK_INDEX.
+
+    Returns:
+        ArtifactCache instance, or None when caching is disabled.
+    """
+    global _cache, _cache_enabled
+    _cache_enabled = enabled
+    _cache = ArtifactCache(cache_dir, max_size, revalidate_interval, transcode, seek_index) if enabled else None
+    return _cache
+
+
+def get_cache():
+    """Get the global artifact cache, creating it if necessary. None when disabled."""
+    global _cache, _cache_enabled
+    if _cache is None and _cache_enabled:
+        try:
+            _cache = ArtifactCache()
+        except OSError as e:
+            get_logger().warning(f"Artifact cache unavailable, downloading directly: {e}")
+            _cache_enabled = False
+    return _cache
+
+
+def fetch_artifact(url, dest_path, reporthook=None, segmented=False, description=None, sha256=None):
+    """
+    Download url to dest_path, going through the artifact cache when enabled.
+
+    Retries, timeouts and connection reuse are handled by the download manager.
+    The file is checked against sha256, defaulting to the catalog's pinned value.
+
+    Returns:
+        str: dest_path.
+    """
+    sha256 = sha256 or get_pinned_sha256(url)
+    cache = get_cache()
+    if cache is None:
+        get_download_manager().download(url, dest_path, reporthook=reporthook, segmented=segmented,
+                                        description=description, sha256=sha256)
+        return dest_path
+    return cache.fetch(url, dest_path, reporthook=reporthook, segmented=segmented,
+                       description=description, sha256=sha256)
+
+
+@contextlib.contextmanager
+def open_artifact_stream(url, reporthook=None, segmented=False, sha256=None):
+    """
+    Yield a readable stream of url, persisting it to the artifact cache when enabled.
+
+    The body is hashed as it is read and checked against sha256 (defaulting to
+    the catalog's pinned value) when the caller is done; a mismatch raises
+    IntegrityError.
+    """
+    sha256 = sha256 or get_pinned_sha256(url)
+    cache = get_cache()
+    if cache is None:
+        with DownloadStream(url, reporthook=reporthook, segments=None if segmented else 1,
+                            sha256=sha256) as stream:
+            yield stream
+            stream.drain()
+        return
+    with cache.open_stream(url, reporthook=reporthook, segmented=segmented, sha256=sha256) as stream:
+        yield stream
@@ -0,0 +1,206 @@
+"""
+LAN cache server for LCSX.
+Serves the local artifact cache over HTTP so other lcsx nodes can use it as a mirror.
+"""
+
+import email.utils
+import http.server
+import json
+import os
+import threading
+import urllib.parse
+from lcsx.config.catalog import ARCHITECTURES, get_artifacts, get_pinned_sha256
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_main
+
+
+def parse_range(value, size):
+    """
+    Parse a single-range Range header against a body of size bytes.
+
+    Returns:
+        (start, end) inclusive, None if the range cannot be satisfied, or
+        False if the header should be ignored (other units, several ranges).
+    """
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return False
+    first, _, last = value[6:].strip().partition('-')
+    try:
+        if not first:
+            # Suffix range: the last n bytes
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return False
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers GET/HEAD for /<host>/<path> with the cached artifact of
+    http(s)://<host>/<path>, and / with a JSON listing of the cache.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'lcsx-cache'
+
+    def log_message(self, format, *args):
+        get_logger().info(f"Cache server: {self.address_string()} {format % args}")
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_index(self, send_body):
+        entries = [{'url': url, 'path': '/' + url.split('://', 1)[1], 'sha256': digest, 'size': size}
+                   for url, digest, size in self.server.cache.entries()]
+        body = json.dumps({'artifacts': entries}, indent=1).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _serve(self, send_body):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if path in ('/', '/index.json'):
+            self._send_index(send_body)
+            return
+        blob, digest = self.server.resolve(path)
+        if blob is None:
+            self._send_empty(404)
+            return
+        try:
+            f = open(blob, 'rb')
+        except FileNotFoundError:
+            # Evicted between the lookup and now
+            self._send_empty(404)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            # Blobs are content-addressed, so their digest is a strong validator
+            etag = f'"{digest}"'
+            last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+            validators = {'ETag': etag, 'Last-Modified': last_modified, 'Accept-Ranges': 'bytes'}
+
+            requested = self.headers.get('Range')
+            if_range = self.headers.get('If-Range')
+            if not requested and (self.headers.get('If-None-Match') == etag
+                                  or self.headers.get('If-Modified-Since') == last_modified):
+                self._send_empty(304, validators)
+                return
+            span = parse_range(requested, size) if if_range in (None, etag, last_modified) else False
+            if span is None:
+                self._send_empty(416, {'Content-Range': f'bytes */{size}'})
+                return
+            start, end = span if span else (0, size - 1)
+            self.send_response(206 if span else 200)
+            for name, value in validators.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            if span:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if send_body and end >= start:
+                # socket.sendfile() uses os.sendfile(), so the body never passes through userspace
+                self.connection.sendfile(f, start, end - start + 1)
+
+
+class CacheServer(http.server.ThreadingHTTPServer):
+    """
+    Threaded HTTP server over an ArtifactCache.
+
+    With pull enabled, a request for a catalog artifact that is not cached
+    yet gets a 404 (so the client moves on to its next mirror at once)
+    while the server downloads it in the background; every later request
+    is served from the LAN. Only catalog URLs are pulled, so the server is
+    not an open proxy.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, cache, pull=True):
+        super().__init__(address, CacheRequestHandler)
+        self.cache = cache
+        self.pull = pull
+        self._pulling = set()
+        self._pull_lock = threading.Lock()
+        self._pullable = {url for arch in ARCHITECTURES for url in get_artifacts(arch).values()}
+
+    def resolve(self, path):
+        """
+        Map /<host>/<path> onto a cached blob.
+
+        Returns:
+            tuple: (blob path, sha256), or (None, None) on a miss.
+        """
+        rest = path.lstrip('/')
+        for scheme in ('https', 'http'):
+            url = f"{scheme}://{rest}"
+            blob = self.cache.lookup(url)
+            if blob is not None:
+                return blob, os.path.basename(blob)
+        for scheme in ('https', 'http'):
+            url = f"{scheme}://{rest}"
+            if self.pull and url in self._pullable:
+                self._start_pull(url)
+        return None, None
+
+    def _start_pull(self, url):
+        with self._pull_lock:
+            if url in self._pulling:
+                return
+            self._pulling.add(url)
+
+        def run():
+            try:
+                print_main(f"Fetching {url} into the cache")
+                self.cache.ensure(url, segmented=True, sha256=get_pinned_sha256(url))
+                print_main(f"Cached {url}")
+            except Exception as e:
+                get_logger().error(f"Cache server could not fetch {url}: {e}")
+            finally:
+                with self._pull_lock:
+                    self._pulling.discard(url)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def serve_cache(cache, host, port, pull=True):
+    """
+    Serve cache over HTTP until interrupted.
+
+    Args:
+        cache: ArtifactCache to serve.
+        host: Address to listen on.
+        port: Port to listen on.
+        pull: Download missing catalog artifacts in the background when requested.
+    """
+    server = CacheServer((host, port), cache, pull=pull)
+    print_main(f"Serving artifact cache {cache.cache_dir} on http://{host}:{server.server_address[1]}")
+    print_main(f"Add it to mirrors.json on other nodes as {{\"*\": [\"http://<this-host>:{server.server_address[1]}\"]}}")
+    get_logger().info(f"Cache server listening on {host}:{server.server_address[1]} (pull={pull})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print_main("Stopping cache server.")
+    finally:
+        server.server_close()
@@ -0,0 +1,1242 @@
+"""
+Download manager for LCSX.
+Every network fetch goes through one DownloadManager: pooled keep-alive
+connections, connect/read timeouts, retries with backoff, resumable and
+segmented transfers, mirror failover, a throughput watchdog, bandwidth
+limiting, inline sha256 verification and transfer metrics.
+"""
+
+import email.utils
+import hashlib
+import http.client
+import json
+import os
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.core.logger import get_logger
+from lcsx.core.mirrors import get_mirror_selector
+from lcsx.core.ratelimit import get_rate_limiter
+from lcsx.ui.logger import print_main, print_error, print_warning
+from lcsx.config.constants import (
+    DOWNLOAD_SEGMENTS, MIN_SEGMENT_SIZE, ROOTFS_STREAM_EXTRACT,
+    MAX_DOWNLOAD_RETRIES, RETRY_DELAY, DOWNLOAD_TIMEOUT, CONNECTION_TIMEOUT,
+    MIRROR_PROBE_TIMEOUT, MIRROR_PROBE_BYTES, STALL_MIN_RATE, STALL_WINDOW
+)
+
+CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+META_SUFFIX = '.part.json'
+MAX_REDIRECTS = 5
+MAX_RETRY_DELAY = 60  # seconds
+MAX_IDLE_PER_HOST = 8
+USER_AGENT = 'lcsx'
+
+# Errors worth another attempt; HTTP 4xx responses other than these codes are final
+RETRYABLE_ERRORS = (urllib.error.URLError, http.client.HTTPException, OSError)
+RETRYABLE_HTTP_CODES = (408, 416, 429)
+
+# Download settings
+_segments = DOWNLOAD_SEGMENTS
+_stream_extract = ROOTFS_STREAM_EXTRACT
+_stall_rate = STALL_MIN_RATE
+_stall_window = STALL_WINDOW
+
+# Manager instances (the probe manager uses short timeouts and no retries)
+_manager = None
+_probe_manager = None
+_manager_lock = threading.Lock()
+
+
+def configure_downloads(segments=None, stream_extract=None, stall_rate=None, stall_window=None):
+    """
+    Configure download behaviour for this process.
+
+    Args:
+        segments: Number of parallel byte ranges used for large downloads (1 disables).
+        stream_extract: Whether the rootfs is extracted while it downloads.
+        stall_rate: Minimum transfer rate in bytes per second (0 disables the watchdog).
+        stall_window: Seconds the rate may stay below stall_rate before the transfer is aborted.
+    """
+    global _segments, _stream_extract, _stall_rate, _stall_window
+    if segments is not None:
+        _segments = max(1, int(segments))
+    if stream_extract is not None:
+        _stream_extract = bool(stream_extract)
+    if stall_rate is not None:
+        _stall_rate = max(0, int(stall_rate))
+    if stall_window is not None:
+        _stall_window = max(1, int(stall_window))
+
+
+def is_stream_extract_enabled():
+    """Return True when the rootfs should be piped from the network into the extractor."""
+    return _stream_extract
+
+
+class IntegrityError(Exception):
+    """Downloaded bytes do not match the expected sha256."""
+
+
+def hash_file(path, digest=None, limit=None):
+    """
+    Feed the contents of a file into a sha256 object.
+
+    Args:
+        path: File to read.
+        digest: Existing hash object to continue, or None for a new one.
+        limit: Only hash the first limit bytes.
+
+    Returns:
+        The hash object.
+    """
+    digest = digest or hashlib.sha256()
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(HASH_CHUNK_SIZE if remaining is None else min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+def check_sha256(url, digest, expected):
+    """Raise IntegrityError if expected is set and differs from digest."""
+    if expected and digest != expected.lower():
+        raise IntegrityError(f"Checksum mismatch for {url}: expected sha256 {expected}, got {digest}")
+
+
+class StallError(urllib.error.URLError):
+    """A transfer stayed below the minimum rate for a whole watchdog window."""
+
+    def __init__(self, url, rate, window):
+        super().__init__(f"transfer stalled at {rate:.0f} B/s for {window:.0f}s "
+                         f"(minimum {_stall_rate} B/s)")
+        self.url = url
+        self.rate = rate
+        self.window = window
+
+
+class ThroughputWatchdog:
+    """
+    Aborts a response that trickles along below a minimum rate.
+
+    The rate is measured over consecutive windows of stall_window seconds;
+    a read that blocks for a whole window counts as zero throughput.
+    """
+
+    def __init__(self, url, min_rate, window):
+        self.url = url
+        self.min_rate = min_rate
+        self.window = window
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def check(self):
+        """Raise StallError if the window that just ended was below the floor."""
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._window_bytes / elapsed
+        if rate < self.min_rate:
+            self.stalled(rate, elapsed)
+        self._window_start += elapsed
+        self._window_bytes = 0
+
+    def update(self, nbytes):
+        self._window_bytes += nbytes
+
+    def pause(self, seconds):
+        """Leave out time spent throttled by the rate limiter."""
+        self._window_start += seconds
+
+    def stalled(self, rate, elapsed):
+        get_logger().warning(f"Transfer of {self.url} stalled: {rate:.0f} B/s over {elapsed:.1f}s "
+                             f"(minimum {self.min_rate} B/s)")
+        get_download_manager().record('stalls')
+        raise StallError(self.url, rate, elapsed)
+
+
+def is_retryable(error):
+    """Return True if a failed transfer should be attempted again."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code in RETRYABLE_HTTP_CODES
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def response_validators(response):
+    """Return the ETag and Last-Modified of a response, for revalidating the body later."""
+    return {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+
+
+def conditional_headers(validators):
+    """Build If-None-Match/If-Modified-Since headers from saved validators."""
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+class PooledResponse:
+    """
+    HTTP response that hands its connection back to the pool when closed.
+
+    The connection is only reused if the body was read to the end and the
+    server did not ask to close it; otherwise it is closed. Reads are watched
+    by a ThroughputWatchdog and throttled by the rate limiter when configured.
+    """
+
+    def __init__(self, manager, key, conn, response, url):
+        self._manager = manager
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._watchdog = ThroughputWatchdog(url, _stall_rate, _stall_window) if _stall_rate else None
+        self._limiter = get_rate_limiter() if manager.throttle else None
+
+    def read(self, amt=None):
+        if self._watchdog:
+            self._watchdog.check()
+        started = time.monotonic()
+        try:
+            # read1() returns whatever arrived instead of blocking for amt bytes,
+            # so a trickling server cannot hide from the watchdog
+            data = self._response.read1(amt) if amt is not None and amt >= 0 else self._response.read()
+        except http.client.IncompleteRead as e:
+            self._manager.record('bytes', len(e.partial))
+            raise
+        except socket.timeout:
+            if not self._watchdog:
+                raise
+            # Nothing arrived for a whole window
+            self._watchdog.stalled(0, time.monotonic() - started)
+        self._manager.record('bytes', len(data))
+        if self._watchdog:
+            self._watchdog.update(len(data))
+        if self._limiter and data:
+            waited = self._limiter.consume(len(data))
+            if self._watchdog and waited:
+                self._watchdog.pause(waited)
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._manager._release(self._key, conn)
+        else:
+            self._response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FileResponse:
+    """
+    Response-like view of a local file for file:// mirrors.
+
+    Supports the same Range/If-Range/If-Modified-Since subset the HTTP
+    servers are used for, with the file's mtime as its Last-Modified validator.
+    """
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = http.client.HTTPMessage()
+        path = urllib.request.url2pathname(urllib.parse.urlsplit(url).path)
+        try:
+            self._file = open(path, 'rb')
+        except FileNotFoundError:
+            self._file = None
+            self.status, self.reason = 404, 'Not Found'
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        last_modified = email.utils.formatdate(os.fstat(self._file.fileno()).st_mtime, usegmt=True)
+        self.headers['Last-Modified'] = last_modified
+        self.headers['Accept-Ranges'] = 'bytes'
+        start, end = 0, size - 1
+        if (headers or {}).get('If-Modified-Since') == last_modified:
+            self.status, self.reason = 304, 'Not Modified'
+            self._remaining = 0
+            return
+        self.status, self.reason = 200, 'OK'
+        requested = (headers or {}).get('Range')
+        if_range = (headers or {}).get('If-Range')
+        if requested and requested.startswith('bytes=') and if_range in (None, last_modified):
+            first, _, last = requested[6:].partition('-')
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.status, self.reason = 416, 'Range Not Satisfiable'
+                self.headers['Content-Range'] = f'bytes */{size}'
+                return
+            self.status, self.reason = 206, 'Partial Content'
+            self.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        self._file.seek(start)
+        self._remaining = end - start + 1
+        self.headers['Content-Length'] = str(self._remaining)
+
+    def read(self, amt=None):
+        if self._file is None or self.status >= 400:
+            return b''
+        amt = self._remaining if amt is None or amt < 0 else min(amt, self._remaining)
+        data = self._file.read(amt)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DownloadManager:
+    """
+    Shared HTTP client for all artifact downloads.
+
+    Connections are kept per (scheme, host, port) and reused across requests,
+    so fetching several artifacts from one host costs a single TCP/TLS
+    handshake. Connects time out after connect_timeout and each socket read
+    after read_timeout. Failed transfers are retried with exponential backoff
+    and jitter, resuming from what is already on disk. Unless throttle is
+    False, response bodies count against the global rate limit.
+    """
+
+    def __init__(self, connect_timeout=CONNECTION_TIMEOUT, read_timeout=DOWNLOAD_TIMEOUT,
+                 retries=MAX_DOWNLOAD_RETRIES, retry_delay=RETRY_DELAY, throttle=True):
+        self.connect_timeout = connect_timeout
+        self.throttle = throttle
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+        self.metrics = {
+            'downloads': 0,
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'retries': 0,
+            'stalls': 0,
+            'bytes': 0,
+            'seconds': 0.0,
+        }
+
+    def record(self, name, amount=1):
+        """Add amount to the named transfer metric."""
+        with self._lock:
+            self.metrics[name] += amount
+
+    def _new_connection(self, scheme, host, port):
+        """Open a connection to host, tunnelling through a configured proxy if any."""
+        proxy = urllib.request.getproxies().get(scheme)
+        absolute_target = False
+        if proxy and not urllib.request.proxy_bypass(host):
+            proxy_url = urllib.parse.urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+            connect_host, connect_port = proxy_url.hostname, proxy_url.port or 8080
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(connect_host, connect_port, timeout=self.connect_timeout,
+                                                   context=self._ssl_context)
+                conn.set_tunnel(host, port)
+            else:
+                conn = http.client.HTTPConnection(connect_host, connect_port, timeout=self.connect_timeout)
+                absolute_target = True
+        elif scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        # A read blocked for a whole watchdog window is already a stall
+        conn.sock.settimeout(min(self.read_timeout, _stall_window) if _stall_rate else self.read_timeout)
+        conn.lcsx_absolute_target = absolute_target
+        self.record('connections_opened')
+        return conn
+
+    def _acquire(self, key):
+        """Return (connection, reused) for key, preferring an idle pooled connection."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.metrics['connections_reused'] += 1
+                return idle.pop(), True
+        return self._new_connection(*key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < MAX_IDLE_PER_HOST:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _request_once(self, url, headers, method):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'file':
+            self.record('requests')
+            return FileResponse(url, headers)
+        if parts.scheme not in ('http', 'https'):
+            raise urllib.error.URLError(f"Unsupported URL scheme: {url}")
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+        request_headers.update(headers or {})
+
+        conn, reused = self._acquire(key)
+        try:
+            path = url if conn.lcsx_absolute_target else target
+            conn.request(method, path, headers=request_headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+            # The server dropped an idle keep-alive connection; use a fresh one
+            conn = self._new_connection(*key)
+            path = url if conn.lcsx_absolute_target else target
+            conn.request(method, path, headers=request_headers)
+            response = conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+        self.record('requests')
+        return PooledResponse(self, key, conn, response, url)
+
+    def open(self, url, headers=None, method='GET'):
+        """
+        Send a request and return a PooledResponse, following redirects.
+
+        file:// URLs are served from disk by a FileResponse.
+
+        Raises:
+            urllib.error.HTTPError: For 4xx/5xx responses.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers, method)
+            if response.status in (301, 302, 303, 307, 308) and response.headers.get('Location'):
+                location = urllib.parse.urljoin(url, response.headers['Location'])
+                response.read()
+                response.close()
+                url = location
+                continue
+            if response.status >= 400:
+                error_headers = response.headers
+                response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, error_headers, None)
+            return response
+        raise urllib.error.URLError(f"Too many redirects for {url}")
+
+    def backoff_delay(self, attempt):
+        """Delay before retry number attempt (0-based): exponential, capped, with jitter."""
+        delay = min(self.retry_delay * (2 ** attempt), MAX_RETRY_DELAY)
+        return delay * random.uniform(0.5, 1.5)
+
+    def retry(self, func, description, failover=None):
+        """
+        Call func until it succeeds or the retry budget is spent.
+
+        Args:
+            func: Callable performing one attempt.
+            description: What is being fetched, for messages.
+            failover: Optional callable(error, exhausted) that switches func to
+                another source and returns True, in which case the next attempt
+                is made immediately with a fresh retry budget.
+
+        Returns:
+            Whatever func returns.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except RETRYABLE_ERRORS as e:
+                exhausted = attempt >= self.retries - 1 or not is_retryable(e)
+                if failover is not None and failover(e, exhausted):
+                    attempt = 0
+                    continue
+                if exhausted:
+                    print_error(f"Failed to download {description} after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self.backoff_delay(attempt)
+                self.record('retries')
+                print_error(f"Download failed (attempt {attempt + 1}/{self.retries}): {e}")
+                print_main(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
+                attempt += 1
+
+    def download(self, url, dest_path, reporthook=None, segmented=False, description=None, sha256=None,
+                 validators=None):
+        """
+        Download url to dest_path with retries, resuming partial data between attempts.
+
+        The fastest configured mirror for url is tried first. The next mirror
+        takes over once its retries are spent, or at once if the transfer
+        stalls, resuming from the bytes already on disk. The sha256 is computed
+        while the bytes arrive, so checking it costs no extra pass over the file.
+
+        Args:
+            url: URL to download.
+            dest_path: Final path of the downloaded file.
+            reporthook: Optional urlretrieve-style progress callback.
+            segmented: Use parallel byte ranges for large files.
+            description: What is being fetched, for messages (defaults to the file name).
+            sha256: Expected hex digest; a mismatch deletes the file.
+            validators: Optional dict filled with the source that served the
+                file and its ETag/Last-Modified.
+
+        Returns:
+            str: Hex sha256 of the downloaded file.
+
+        Raises:
+            IntegrityError: If the file does not match sha256.
+        """
+        fetch = download_segmented if segmented else download_file
+        description = description or os.path.basename(urllib.parse.urlsplit(url).path)
+        sources = rank_sources(url)
+        current = [0]
+
+        def failover(error, exhausted):
+            if current[0] + 1 >= len(sources) or not (exhausted or isinstance(error, StallError)):
+                return False
+            source = sources[current[0]]
+            get_mirror_selector().mark_failed(url, source)
+            current[0] += 1
+            print_warning(f"Mirror {urllib.parse.urlsplit(source).netloc or source} failed ({error}); "
+                          f"continuing from {sources[current[0]]}")
+            return True
+
+        started = time.monotonic()
+        digest = self.retry(lambda: fetch(url, dest_path, reporthook=reporthook, source=sources[current[0]],
+                                          validators=validators),
+                            description, failover)
+        self.record('downloads')
+        self.record('seconds', time.monotonic() - started)
+        try:
+            check_sha256(url, digest, sha256)
+        except IntegrityError as e:
+            os.remove(dest_path)
+            print_error(f"Downloaded {description} is corrupt: {e}")
+            raise
+        return digest
+
+    def log_metrics(self):
+        """Write a one-line summary of transfers so far to the log."""
+        m = dict(self.metrics)
+        rate = m['bytes'] / m['seconds'] if m['seconds'] else 0
+        get_logger().info(
+            f"Downloads: {m['downloads']} files, {m['bytes'] / (1024**2):.1f} MB "
+            f"({rate / (1024**2):.2f} MB/s), {m['requests']} requests over "
+            f"{m['connections_opened']} connections ({m['connections_reused']} reused), "
+            f"{m['retries']} retries, {m['stalls']} stalls")
+
+    def close(self):
+        """Close all idle pooled connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def get_download_manager():
+    """Get the global download manager, creating it if necessary."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DownloadManager()
+    return _manager
+
+
+def probe_source(url):
+    """
+    Measure how quickly url starts and transfers, for mirror ranking.
+
+    Fetches the first MIRROR_PROBE_BYTES with short timeouts and no retries;
+    probes are not rate limited so they measure the mirror, not the limit.
+
+    Returns:
+        tuple: (latency in seconds, throughput in bytes per second).
+    """
+    global _probe_manager
+    with _manager_lock:
+        if _probe_manager is None:
+            _probe_manager = DownloadManager(connect_timeout=MIRROR_PROBE_TIMEOUT,
+                                             read_timeout=MIRROR_PROBE_TIMEOUT, retries=1,
+                                             throttle=False)
+    started = time.monotonic()
+    with _probe_manager.open(url, {'Range': f'bytes=0-{MIRROR_PROBE_BYTES - 1}'}) as response:
+        latency = time.monotonic() - started
+        received = 0
+        while received < MIRROR_PROBE_BYTES:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+        elapsed = time.monotonic() - started - latency
+    return latency, received / max(elapsed, 1e-6)
+
+
+def rank_sources(url):
+    """Return the URLs url can be fetched from (mirrors, then origin), fastest first."""
+    return get_mirror_selector().rank(url, probe_source)
+
+
+def _load_part_meta(meta_path, url):
+    """Return saved validator metadata for a partial download of url, or None."""
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return meta if meta.get('url') == url else None
+
+
+def _save_part_meta(meta_path, url, source, response, total):
+    meta = {
+        'url': url,
+        'source': source,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'total': total,
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+
+def _parse_content_range(value):
+    """Parse 'bytes start-end/total' into (start, total); total may be None."""
+    try:
+        unit, spec = value.split(' ', 1)
+        span, total = spec.split('/', 1)
+        start = int(span.split('-', 1)[0])
+        return start, (None if total == '*' else int(total))
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def remove_partial(dest_path):
+    """Delete any partial download state kept for dest_path."""
+    for suffix in (PART_SUFFIX, META_SUFFIX):
+        if os.path.exists(dest_path + suffix):
+            os.remove(dest_path + suffix)
+
+
+def download_file(url, dest_path, reporthook=None, source=None, validators=None):
+    """
+    Download url to dest_path, resuming a previous partial download if present.
+
+    Bytes are written to dest_path + '.part' and renamed into place when the
+    transfer completes. If a partial file exists, the request carries a Range
+    header and, when a validator was recorded, an If-Range header so a changed
+    upstream file is sent in full. Servers that ignore Range (200 instead of
+    206) restart the file from zero. A partial file from another mirror of
+    the same URL is resumed as long as the total size matches, since mirror
+    validators are not comparable.
+
+    Args:
+        url: URL to download.
+        dest_path: Final path of the downloaded file.
+        reporthook: Optional urlretrieve-style callback (block_num, block_size, total_size).
+        source: Mirror URL to fetch from; defaults to url.
+        validators: Optional dict filled with the source and its ETag/Last-Modified.
+
+    Returns:
+        str: Hex sha256 of the file, hashed as it was written.
+    """
+    source = source or url
+    part_path = dest_path + PART_SUFFIX
+    meta_path = dest_path + META_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    meta = _load_part_meta(meta_path, url) if offset else None
+    if offset and (meta is None or 'segments' in meta):
+        # Partial file from a different URL, a segmented download or without metadata; start over
+        offset = 0
+
+    headers = {}
+    same_source = bool(meta) and meta.get('source', url) == source
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        validator = meta.get('etag') or meta.get('last_modified')
+        if validator and same_source:
+            headers['If-Range'] = validator
+
+    try:
+        response = get_download_manager().open(source, headers)
+    except urllib.error.HTTPError as e:
+        if e.code == 416 and meta and meta.get('total') == offset:
+            # Partial file already holds the complete body
+            if validators is not None:
+                validators.update(source=meta.get('source', url), etag=meta.get('etag'),
+                                  last_modified=meta.get('last_modified'))
+            digest = hash_file(part_path).hexdigest()
+            os.replace(part_path, dest_path)
+            os.remove(meta_path)
+            return digest
+        if e.code == 416:
+            remove_partial(dest_path)
+        raise
+
+    with response:
+        status = response.status
+        total = response.headers.get('Content-Length')
+        total = int(total) if total is not None else -1
+        if offset and status == 206:
+            start, full_size = _parse_content_range(response.headers.get('Content-Range'))
+            if start != offset:
+                raise urllib.error.URLError(f"Server resumed at byte {start}, expected {offset}")
+            total = full_size if full_size is not None else (offset + total if total >= 0 else -1)
+            if not same_source and total != meta.get('total'):
+                remove_partial(dest_path)
+                raise urllib.error.URLError(f"{source} has a different size than the partial download; restarting")
+            get_logger().info(f"Resuming download of {url} at byte {offset}")
+            mode = 'ab'
+            # Only the bytes kept from the earlier attempt are read back
+            digest = hash_file(part_path, limit=offset)
+        else:
+            if offset:
+                get_logger().info(f"Server ignored Range for {url}; restarting download")
+            offset = 0
+            mode = 'wb'
+            digest = hashlib.sha256()
+        _save_part_meta(meta_path, url, source, response, total)
+        if validators is not None:
+            validators.update(source=source, **response_validators(response))
+
+        received = offset
+        # Reads return whatever has arrived, not CHUNK_SIZE bytes, so progress is reported in bytes
+        if reporthook:
+            reporthook(received, 1, total)
+        with open(part_path, mode) as f:
+            while True:
+                try:
+                    chunk = response.read(CHUNK_SIZE)
+                except http.client.IncompleteRead as e:
+                    # Connection dropped mid-body; keep what arrived for the next attempt
+                    chunk = e.partial
+                    f.write(chunk)
+                    digest.update(chunk)
+                    received += len(chunk)
+                    break
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                if reporthook:
+                    reporthook(received, 1, total)
+
+    if total >= 0 and received < total:
+        raise urllib.error.ContentTooShortError(
+            f"retrieval incomplete: got only {received} out of {total} bytes", None)
+    os.replace(part_path, dest_path)
+    os.remove(meta_path)
+    return digest.hexdigest()
+
+
+def _probe_ranges(url, validators=None):
+    """
+    Ask for the first byte of url to learn its size and whether Range works.
+
+    Returns:
+        tuple: (total_size or None, validator or None). total_size is None
+        when the server does not answer with a usable 206.
+    """
+    with get_download_manager().open(url, {'Range': 'bytes=0-0'}) as response:
+        if response.status != 206:
+            return None, None
+        # Drain the single byte so the connection can be reused
+        response.read()
+        _, total = _parse_content_range(response.headers.get('Content-Range'))
+        if validators is not None:
+            validators.update(source=url, **response_validators(response))
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+        return total, validator
+
+
+def _plan_segments(total, count):
+    """Split [0, total) into count contiguous [start, end] ranges with done counters."""
+    size = total // count
+    plan = []
+    for i in range(count):
+        start = i * size
+        end = total - 1 if i == count - 1 else start + size - 1
+        plan.append([start, end, 0])
+    return plan
+
+
+def _fetch_segment(url, fd, segment, validator, progress):
+    """Download one [start, end] range into fd at its offset, resuming from segment[2]."""
+    start, end, done = segment
+    if start + done > end:
+        return
+    headers = {'Range': f'bytes={start + done}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+    with get_download_manager().open(url, headers) as response:
+        resumed_at, _ = _parse_content_range(response.headers.get('Content-Range'))
+        if response.status != 206 or resumed_at != start + done:
+            raise urllib.error.URLError(f"Server did not honour range {start + done}-{end}; file may have changed")
+        while start + segment[2] <= end:
+            try:
+                chunk = response.read(min(CHUNK_SIZE, end - start - segment[2] + 1))
+            except http.client.IncompleteRead as e:
+                chunk = e.partial
+                os.pwrite(fd, chunk, start + segment[2])
+                progress(segment, len(chunk))
+                break
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, start + segment[2])
+            progress(segment, len(chunk))
+        if start + segment[2] > end:
+            # Consume the (empty) remainder so the connection goes back to the pool
+            response.read()
+    if start + segment[2] <= end:
+        raise urllib.error.ContentTooShortError(
+            f"segment {start}-{end} incomplete: got {segment[2]} of {end - start + 1} bytes", None)
+
+
+class _PrefixHasher:
+    """
+    Hash a segmented download front to back while it is still being written.
+
+    A background thread follows the end of the contiguous downloaded prefix
+    (segment 0, then segment 1 once segment 0 is complete, ...) and hashes
+    those bytes straight from the page cache, so the digest is ready moments
+    after the last segment lands instead of needing a second pass.
+    """
+
+    def __init__(self, path, plan):
+        self.digest = hashlib.sha256()
+        self.offset = 0
+        self._plan = plan
+        self._fd = os.open(path, os.O_RDONLY)
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _prefix_end(self):
+        end = 0
+        for start, stop, done in self._plan:
+            end = start + done
+            if end <= stop:
+                break
+        return end
+
+    def _hash_to(self, end):
+        while self.offset < end:
+            data = os.pread(self._fd, min(HASH_CHUNK_SIZE, end - self.offset), self.offset)
+            if not data:
+                break
+            self.digest.update(data)
+            self.offset += len(data)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._cond.wait(1)
+            self._hash_to(self._prefix_end())
+
+    def notify(self):
+        """Wake the hashing thread after new bytes were written."""
+        with self._cond:
+            self._cond.notify()
+
+    def finish(self):
+        """Stop the thread, hash whatever prefix is complete and return the hex digest."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        try:
+            self._hash_to(self._prefix_end())
+        finally:
+            os.close(self._fd)
+        return self.digest.hexdigest()
+
+
+def download_segmented(url, dest_path, reporthook=None, segments=None, source=None, validators=None):
+    """
+    Download url using several parallel byte ranges written into one preallocated file.
+
+    The file is split into contiguous segments fetched on a small thread pool,
+    each written at its own offset. Segment progress is saved next to the
+    partial file so an interrupted download only re-fetches the missing bytes,
+    also when it continues from another mirror. The file is hashed in order
+    as its prefix completes. Falls back to download_file() when the server
+    lacks Range support or the file is too small to be worth splitting.
+
+    Args:
+        url: URL to download.
+        dest_path: Final path of the downloaded file.
+        reporthook: Optional urlretrieve-style callback (block_num, block_size, total_size).
+        segments: Number of segments; defaults to the configured value.
+        source: Mirror URL to fetch from; defaults to url.
+        validators: Optional dict filled with the source and its ETag/Last-Modified.
+
+    Returns:
+        str: Hex sha256 of the file.
+    """
+    source = source or url
+    count = _segments if segments is None else max(1, int(segments))
+    total, validator = _probe_ranges(source, validators) if count > 1 else (None, None)
+    if total is not None:
+        count = min(count, total // MIN_SEGMENT_SIZE)
+    if total is None or count < 2:
+        return download_file(url, dest_path, reporthook=reporthook, source=source, validators=validators)
+
+    part_path = dest_path + PART_SUFFIX
+    meta_path = dest_path + META_SUFFIX
+    meta = _load_part_meta(meta_path, url)
+    # Validators are only comparable when the partial data came from the same mirror
+    if (meta and meta.get('total') == total and meta.get('segments') and os.path.exists(part_path)
+            and (meta.get('source', url) != source or meta.get('validator') == validator)):
+        plan = meta['segments']
+        get_logger().info(f"Resuming segmented download of {url}")
+    else:
+        plan = _plan_segments(total, count)
+        with open(part_path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total)
+                except OSError:
+                    f.truncate(total)
+            else:
+                f.truncate(total)
+
+    def save_state():
+        with open(meta_path, 'w') as f:
+            json.dump({'url': url, 'source': source, 'total': total, 'validator': validator,
+                       'segments': plan}, f)
+
+    lock = threading.Lock()
+    received = [sum(seg[2] for seg in plan)]
+    resumed = received[0]
+
+    def progress(segment, nbytes):
+        with lock:
+            segment[2] += nbytes
+            received[0] += nbytes
+            if reporthook:
+                reporthook(received[0] // CHUNK_SIZE, CHUNK_SIZE, total)
+        hasher.notify()
+
+    save_state()
+    started = time.monotonic()
+    fd = os.open(part_path, os.O_WRONLY)
+    hasher = _PrefixHasher(part_path, plan)
+    try:
+        with ThreadPoolExecutor(max_workers=len(plan)) as pool:
+            futures = [pool.submit(_fetch_segment, source, fd, seg, validator, progress) for seg in plan]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+    finally:
+        os.close(fd)
+        digest = hasher.finish()
+        save_state()
+    if errors:
+        raise errors[0]
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    fetched = total - resumed
+    rate = fetched / elapsed
+    print_main(f"Downloaded {fetched / (1024**2):.1f} MB in {elapsed:.1f}s "
+               f"({rate / (1024**2):.2f} MB/s over {len(plan)} segments)")
+    get_logger().info(f"Segmented download of {url}: {fetched} bytes, {rate:.0f} B/s, {len(plan)} segments")
+    os.replace(part_path, dest_path)
+    os.remove(meta_path)
+    return digest
+
+
+def _fetch_range(url, start, end, validator):
+    """
+    Return the bytes of url in [start, end], retrying dropped connections.
+
+    A StallError is raised straight away so the caller can switch mirrors.
+    """
+    headers = {'Range': f'bytes={start}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+    manager = get_download_manager()
+    for attempt in range(manager.retries):
+        try:
+            data = bytearray()
+            with manager.open(url, headers) as response:
+                resumed_at, _ = _parse_content_range(response.headers.get('Content-Range'))
+                if response.status != 206 or resumed_at != start:
+                    raise urllib.error.URLError(f"Server did not honour range {start}-{end}; file may have changed")
+                # Read in chunks so the watchdog sees the transfer rate
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    data += chunk
+            if len(data) == end - start + 1:
+                return bytes(data)
+            error = urllib.error.ContentTooShortError(
+                f"range {start}-{end} incomplete: got {len(data)} bytes", None)
+        except StallError:
+            raise
+        except RETRYABLE_ERRORS as e:
+            if not is_retryable(e):
+                raise
+            error = e
+        if attempt < manager.retries - 1:
+            get_logger().warning(f"Range {start}-{end} of {url} failed ({error}); retrying")
+            manager.record('retries')
+            time.sleep(manager.backoff_delay(attempt))
+    raise error
+
+
+class DownloadStream:
+    """
+    Readable file object over an HTTP download, for feeding a decompressor directly.
+
+    With Range support and more than one segment, fixed-size chunks are
+    fetched ahead on a thread pool and handed out in order, so the reader
+    overlaps with several connections. Otherwise a single response is read
+    and, if the connection drops, re-requested from the current offset.
+    Every byte handed out is hashed and can be mirrored to tee_path; drain()
+    checks the digest against sha256 once the body is complete. The body is
+    read from the fastest mirror that answers; if that mirror stalls, the
+    stream continues from the current offset on the next one. validators
+    holds the source and ETag/Last-Modified of the body once it is open.
+    """
+
+    STREAM_CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, url, reporthook=None, tee_path=None, segments=None, sha256=None):
+        self.url = url
+        self.reporthook = reporthook
+        self.sha256 = sha256
+        self.digest = hashlib.sha256()
+        self.received = 0
+        self._buffer = b''
+        self._pos = 0
+        self._response = None
+        self._pool = None
+        self._pending = []
+        self._tee = None
+        self._source_lock = threading.Lock()
+        self._started = time.monotonic()
+        self.validators = {}
+        count = _segments if segments is None else max(1, int(segments))
+        self.sources = rank_sources(url)
+        for i, source in enumerate(self.sources):
+            self.source = source
+            try:
+                self.total, self.validator = _probe_ranges(source, self.validators) if count > 1 else (None, None)
+                if self.total is None or self.total <= self.STREAM_CHUNK_SIZE:
+                    self._open_response()
+                break
+            except RETRYABLE_ERRORS as e:
+                if i == len(self.sources) - 1:
+                    raise
+                get_mirror_selector().mark_failed(url, source)
+                print_warning(f"Mirror {urllib.parse.urlsplit(source).netloc or source} failed ({e}); "
+                              f"trying {self.sources[i + 1]}")
+        if self._response is None:
+            self._chunks = iter(range(0, self.total, self.STREAM_CHUNK_SIZE))
+            self._pool = ThreadPoolExecutor(max_workers=count)
+            for _ in range(count * 2):
+                self._schedule_chunk()
+        self._tee = open(tee_path, 'wb') if tee_path else None
+        if self.reporthook:
+            self.reporthook(0, CHUNK_SIZE, self.total if self.total is not None else -1)
+
+    def _schedule_chunk(self):
+        start = next(self._chunks, None)
+        if start is not None:
+            end = min(start + self.STREAM_CHUNK_SIZE, self.total) - 1
+            self._pending.append(self._pool.submit(self._fetch_chunk, start, end))
+
+    def _failover(self, failed_source, error):
+        """
+        Move the stream to the mirror after failed_source.
+
+        Returns:
+            bool: False if failed_source was the last mirror.
+        """
+        with self._source_lock:
+            if self.source != failed_source:
+                # Another prefetch thread already moved on
+                return True
+            index = self.sources.index(failed_source)
+            if index + 1 >= len(self.sources):
+                return False
+            get_mirror_selector().mark_failed(self.url, failed_source)
+            self.source = self.sources[index + 1]
+            # Validators from one mirror mean nothing to another
+            self.validator = None
+            self.validators = {}
+            print_warning(f"Mirror {urllib.parse.urlsplit(failed_source).netloc or failed_source} failed "
+                          f"({error}); continuing from {self.source}")
+            return True
+
+    def _fetch_chunk(self, start, end):
+        """Fetch one prefetch chunk, moving to the next mirror (or connection) when a transfer stalls."""
+        for _ in range(get_download_manager().retries):
+            source, validator = self.source, self.validator
+            try:
+                return _fetch_range(source, start, end, validator)
+            except StallError as e:
+                error = e
+                self._failover(source, e)
+        raise error
+
+    def _open_response(self):
+        """Open (or reopen at the current offset) the single-connection response."""
+        headers = {}
+        if self.received:
+            headers['Range'] = f'bytes={self.received}-'
+            if self.validator:
+                headers['If-Range'] = self.validator
+        response = get_download_manager().open(self.source, headers)
+        if self.received:
+            resumed_at, full_size = _parse_content_range(response.headers.get('Content-Range'))
+            if (response.status != 206 or resumed_at != self.received
+                    or (self.total is not None and full_size not in (None, self.total))):
+                response.close()
+                raise urllib.error.URLError(f"Cannot resume stream of {self.url} at byte {self.received}")
+            get_logger().info(f"Resumed stream of {self.url} at byte {self.received}")
+        else:
+            length = response.headers.get('Content-Length')
+            self.total = int(length) if length is not None else None
+            self.validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            self.validators = dict(source=self.source, **response_validators(response))
+        self._response = response
+
+    def _next_block(self):
+        """Return the next block of the body in order, or b'' at the end."""
+        if self._pool is not None:
+            if not self._pending:
+                return b''
+            data = self._pending.pop(0).result()
+            self._schedule_chunk()
+            return data
+        manager = get_download_manager()
+        for attempt in range(manager.retries):
+            try:
+                if self._response is None:
+                    self._open_response()
+                data = self._response.read(CHUNK_SIZE)
+                if data or self.total is None or self.received >= self.total:
+                    return data
+                error = urllib.error.ContentTooShortError(
+                    f"connection closed at byte {self.received} of {self.total}", None)
+            except http.client.IncompleteRead as e:
+                if e.partial:
+                    self._response.close()
+                    self._response = None
+                    return e.partial
+                error = e
+            except RETRYABLE_ERRORS as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+            get_logger().warning(f"Stream of {self.url} interrupted at byte {self.received} ({error}); resuming")
+            if self._response is not None:
+                self._response.close()
+                self._response = None
+            if isinstance(error, StallError) and self._failover(self.source, error):
+                # A fresh mirror needs no backoff
+                continue
+            manager.record('retries')
+            time.sleep(manager.backoff_delay(attempt))
+        raise error
+
+    def _fill(self):
+        data = self._next_block()
+        if not data:
+            if self.total is not None and self.received < self.total:
+                raise urllib.error.ContentTooShortError(
+                    f"retrieval incomplete: got only {self.received} out of {self.total} bytes", None)
+            return False
+        if self._tee:
+            self._tee.write(data)
+        self.digest.update(data)
+        self.received += len(data)
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        if self.reporthook:
+            self.reporthook(self.received // CHUNK_SIZE, CHUNK_SIZE,
+                            self.total if self.total is not None else -1)
+        return True
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything remaining if size is negative)."""
+        while size < 0 or len(self._buffer) - self._pos < size:
+            if not self._fill():
+                break
+        if size < 0:
+            size = len(self._buffer) - self._pos
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def drain(self):
+        """
+        Consume the rest of the body, e.g. trailing padding the reader never asked for.
+
+        Returns:
+            str: Hex sha256 of the whole body.
+
+        Raises:
+            IntegrityError: If the body does not match sha256.
+        """
+        while self._fill():
+            self._buffer, self._pos = b'', 0
+        digest = self.digest.hexdigest()
+        check_sha256(self.url, digest, self.sha256)
+        return digest
+
+    def close(self):
+        if self._started is not None:
+            manager = get_download_manager()
+            manager.record('downloads')
+            manager.record('seconds', time.monotonic() - self._started)
+            self._started = None
+        if self._pool is not None:
+            for future in self._pending:
+                future.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+        if self._tee is not None:
+            self._tee.close()
+            self._tee = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
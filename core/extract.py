@@ -0,0 +1,346 @@
+"""
+Archive extraction for LCSX.
+Streams rootfs tarballs to disk in a single pass over the archive.
+"""
+
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.config.constants import (EXTRACT_BACKEND, EXTRACT_DECODE_BUFFER, EXTRACT_DECODE_THREADS,
+                                   EXTRACT_WRITE_BUFFER, EXTRACT_WRITE_MAX_FILE, EXTRACT_WRITE_THREADS)
+from lcsx.core.archiver import NativeExtractError, find_native_extractor, list_native_extractors
+from lcsx.core.logger import get_logger
+from lcsx.core.xz import ParallelXZReader
+from lcsx.ui.logger import print_error, print_warning
+
+# Python 3.12+ warns (and 3.14 refuses absolute symlinks) unless an extraction
+# filter is given; rootfs tarballs need the historical, fully trusted behaviour.
+_EXTRACT_KWARGS = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+
+_backend = EXTRACT_BACKEND
+_decode_threads = EXTRACT_DECODE_THREADS
+_write_threads = EXTRACT_WRITE_THREADS
+
+
+def configure_extraction(backend=None, decode_threads=None, write_threads=None):
+    """
+    Set the extraction backend and parallelism.
+
+    Args:
+        backend: 'auto' (native archivers when installed) or 'python'.
+        decode_threads: Threads decoding xz blocks in-process (0 = one per CPU, 1 = serial).
+        write_threads: Threads writing file contents in-process (0 or 1 = write inline).
+    """
+    global _backend, _decode_threads, _write_threads
+    if backend is not None:
+        if backend not in ('auto', 'python'):
+            raise ValueError(f"Unknown extraction backend: {backend}")
+        _backend = backend
+    if decode_threads is not None:
+        _decode_threads = max(0, int(decode_threads))
+    if write_threads is not None:
+        _write_threads = max(0, int(write_threads))
+
+
+def get_extraction_backend():
+    """Return the configured extraction backend ('auto' or 'python')."""
+    return _backend
+
+
+def is_excluded_member(member):
+    """Return True for members that must not be extracted (dev/* and device nodes)."""
+    return member.name.startswith('dev/') or member.isdev()
+
+
+def member_path(name):
+    """A tar member name as a path relative to the extraction directory, as manifests store it."""
+    return os.path.normpath(name.lstrip('/'))
+
+
+class _CountingReader:
+    """File wrapper reporting how many bytes were read to a progress callback."""
+
+    def __init__(self, fileobj, callback):
+        self._fileobj = fileobj
+        self._callback = callback
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self.count += len(data)
+        if self._callback is not None:
+            self._callback(len(data))
+        return data
+
+
+class _WriterPool:
+    """
+    Bounded thread pool writing regular file contents.
+
+    The tar reader stays the only consumer of the archive: it reads each
+    small file into memory and hands it over, so slow storage does not hold
+    up decoding. Submissions block once max_bytes are queued. Writes to the
+    same path are kept in archive order, and hard links wait for their target.
+    """
+
+    def __init__(self, tar, threads, max_bytes=EXTRACT_WRITE_BUFFER):
+        self._tar = tar
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._max_bytes = max_bytes
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._submitted = 0
+        self._errors = []
+
+    def wait_for(self, path):
+        """Block until a queued write to path has finished."""
+        future = self._pending.pop(path, None)
+        if future is not None:
+            future.result()
+
+    def submit(self, member, path, data):
+        self.wait_for(path)
+        with self._cond:
+            while self._queued and self._queued + len(data) > self._max_bytes:
+                self._cond.wait()
+            self._queued += len(data)
+        self._pending[path] = self._pool.submit(self._write, member, path, data)
+        self._submitted += 1
+        if self._submitted % 4096 == 0:
+            # Forget finished writes so the map does not grow with the archive
+            self._pending = {p: f for p, f in self._pending.items() if not f.done()}
+
+    def _write(self, member, path, data):
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._tar.chown(member, path, numeric_owner=False)
+            self._tar.chmod(member, path)
+            self._tar.utime(member, path)
+        except PermissionError:
+            print_error(f"Permission denied, skipping file: {member.name}")
+        except (OSError, tarfile.ExtractError) as e:
+            self._errors.append(e)
+        finally:
+            with self._cond:
+                self._queued -= len(data)
+                self._cond.notify_all()
+
+    def close(self):
+        """Wait for every queued write; re-raise the first failure."""
+        self._pool.shutdown(wait=True)
+        self._pending.clear()
+        if self._errors:
+            raise self._errors[0]
+
+
+def _open_decoder(fileobj, mode):
+    """Wrap fileobj in a parallel xz decoder when mode is 'r|xz'; return (fileobj, mode)."""
+    if mode != 'r|xz' or _decode_threads == 1:
+        return fileobj, mode
+    reader = ParallelXZReader(fileobj, threads=_decode_threads or None, max_inflight=EXTRACT_DECODE_BUFFER)
+    return reader, 'r|'
+
+
+def extract_tar_stream(source, dest_dir, mode='r|xz', exclude=is_excluded_member, progress=None):
+    """
+    Extract a tar archive in one sequential pass.
+
+    Members are read in stream mode so the compressed data is decoded exactly
+    once and no member list is kept in memory. Directory owner, mtime and mode
+    are applied at the end, deepest first, so restrictive directory modes do not
+    block extraction of their contents.
+
+    xz archives made of several blocks (xz -T, pixz) are decoded on a thread
+    pool; small regular files are written by a separate bounded pool. Both
+    are set with configure_extraction().
+
+    Args:
+        source: Path to the archive or a readable file object.
+        dest_dir: Directory to extract into.
+        mode: tarfile stream mode (e.g. 'r|xz', 'r|gz', 'r|').
+        exclude: Predicate returning True for members to skip.
+        progress: Optional ProgressBar advanced by the archive bytes consumed.
+
+    Returns:
+        int: Number of members extracted.
+    """
+    fileobj = None
+    if isinstance(source, (str, bytes, os.PathLike)):
+        fileobj = open(source, 'rb')
+        if progress is not None:
+            progress.set_total(os.path.getsize(source))
+        source = fileobj
+    if progress is not None:
+        source = _CountingReader(source, progress.update)
+    decoder = None
+    try:
+        source, mode = _open_decoder(source, mode)
+        if isinstance(source, ParallelXZReader):
+            decoder = source
+        tar = tarfile.open(fileobj=source, mode=mode)
+    except BaseException:
+        if decoder is not None:
+            decoder.close()
+        if fileobj is not None:
+            fileobj.close()
+        raise
+    writer = _WriterPool(tar, _write_threads) if _write_threads > 1 else None
+
+    try:
+        directories = []
+        extracted = 0
+        with tar:
+            while True:
+                member = tar.next()
+                if member is None:
+                    break
+                # next() appends every header to tar.members; drop them so memory
+                # stays flat for archives with tens of thousands of entries.
+                tar.members = []
+                if exclude is not None and exclude(member):
+                    continue
+                try:
+                    path = os.path.join(dest_dir, member.name)
+                    if writer is not None:
+                        writer.wait_for(path)
+                        if member.islnk():
+                            writer.wait_for(os.path.join(dest_dir, member.linkname))
+                    if member.isdir():
+                        directories.append(member)
+                        tar.extract(member, dest_dir, set_attrs=False, **_EXTRACT_KWARGS)
+                    elif (writer is not None and member.isreg() and not member.issparse()
+                          and member.size <= EXTRACT_WRITE_MAX_FILE):
+                        parent = os.path.dirname(path)
+                        if not os.path.isdir(parent):
+                            os.makedirs(parent)
+                        writer.submit(member, path, tar.extractfile(member).read())
+                    else:
+                        tar.extract(member, dest_dir, **_EXTRACT_KWARGS)
+                    extracted += 1
+                except PermissionError:
+                    print_error(f"Permission denied, skipping file: {member.name}")
+                except KeyError:
+                    # Hard link whose target was excluded or skipped.
+                    print_error(f"Link target missing, skipping file: {member.name}")
+
+            if writer is not None:
+                writer.close()
+                writer = None
+            if decoder is not None and decoder.blocks:
+                get_logger().info(f"Decoded {decoder.blocks} xz blocks on {decoder.threads} threads")
+
+            directories.sort(key=lambda m: m.name, reverse=True)
+            for member in directories:
+                dirpath = os.path.join(dest_dir, member.name)
+                try:
+                    tar.chown(member, dirpath, numeric_owner=False)
+                    tar.utime(member, dirpath)
+                    tar.chmod(member, dirpath)
+                except tarfile.ExtractError as e:
+                    print_error(f"Could not set attributes on {member.name}: {e}")
+    finally:
+        if writer is not None:
+            writer.close()
+        if decoder is not None:
+            decoder.close()
+        if fileobj is not None:
+            fileobj.close()
+    return extracted
+
+
+def extract_archive(source, dest_dir, mode='r|xz', exclude=is_excluded_member, progress=None):
+    """
+    Extract a tar archive with the fastest available backend.
+
+    With the 'auto' backend the archive is piped through GNU tar or bsdtar
+    (and xz -T0, pixz or pigz) when they are installed; otherwise, or when
+    exclude is not one the native tools can express, extract_tar_stream()
+    does the work. If a native tool fails on an archive file, the file is
+    extracted again in-process; a failing stream cannot be replayed, so the
+    error is raised.
+
+    Args:
+        source: Path to the archive or a readable file object.
+        dest_dir: Directory to extract into.
+        mode: tarfile stream mode (e.g. 'r|xz', 'r|gz', 'r|').
+        exclude: is_excluded_member or None; other predicates force the in-process extractor.
+        progress: Optional ProgressBar advanced by the archive bytes consumed.
+
+    Returns:
+        str: Name of the backend that extracted the archive.
+    """
+    extractor = None
+    if _backend == 'auto' and exclude in (is_excluded_member, None):
+        extractor = find_native_extractor(mode.partition('|')[2], exclude_dev=exclude is not None)
+    is_path = isinstance(source, (str, bytes, os.PathLike))
+    if extractor is not None:
+        started = time.monotonic()
+        counter = None if is_path else _CountingReader(source, None)
+        try:
+            extractor.extract(source if is_path else counter, dest_dir, progress=progress)
+            _log_throughput(extractor.name, os.path.getsize(source) if is_path else counter.count,
+                            time.monotonic() - started)
+            return extractor.name
+        except NativeExtractError as e:
+            if not is_path:
+                raise
+            print_warning(f"{e}")
+            print_warning("Extracting with the built-in extractor instead.")
+            if progress is not None:
+                progress.set(0)
+
+    started = time.monotonic()
+    if is_path:
+        extract_tar_stream(source, dest_dir, mode=mode, exclude=exclude, progress=progress)
+        size = os.path.getsize(source)
+    else:
+        counter = _CountingReader(source, None)
+        extract_tar_stream(counter, dest_dir, mode=mode, exclude=exclude, progress=progress)
+        size = counter.count
+    _log_throughput('python', size, time.monotonic() - started)
+    return 'python'
+
+
+def _log_throughput(backend, size, seconds):
+    rate = size / seconds / (1024**2) if seconds > 0 else 0
+    get_logger().info(f"Extracted {size / (1024**2):.1f} MB with {backend} in {seconds:.2f}s ({rate:.1f} MB/s)")
+
+
+def benchmark_extractors(archive, mode='r|xz', scratch_dir=None):
+    """
+    Extract archive with every available backend and time each run.
+
+    Args:
+        archive: Path to the archive.
+        mode: tarfile stream mode of the archive.
+        scratch_dir: Where the throwaway extraction directories are made (default: system temp).
+
+    Returns:
+        list: (backend, seconds, archive bytes per second, error or None), in order of preference.
+    """
+    size = os.path.getsize(archive)
+    backends = [(extractor.name, extractor) for extractor in list_native_extractors(mode.partition('|')[2])]
+    backends.append(('python', None))
+    results = []
+    for name, extractor in backends:
+        dest_dir = tempfile.mkdtemp(prefix='lcsx-bench-', dir=scratch_dir)
+        started = time.monotonic()
+        error = None
+        try:
+            if extractor is not None:
+                extractor.extract(archive, dest_dir)
+            else:
+                extract_tar_stream(archive, dest_dir, mode=mode)
+        except (OSError, tarfile.TarError) as e:
+            error = e
+        finally:
+            seconds = time.monotonic() - started
+            shutil.rmtree(dest_dir, ignore_errors=True)
+        results.append((name, seconds, size / seconds if seconds > 0 else 0, error))
+    return results
@@ -1,14 +1,12 @@
 import os
-import urllib.request
-import urllib.error
-import tarfile
 import subprocess
 import platform
-import time
 from lcsx.ui.logger import print_main, print_error
+from lcsx.ui.progress import ProgressBar
+from lcsx.core.cache import fetch_artifact
+from lcsx.core.extract import extract_archive
 from lcsx.config.constants import (
-    GOTTY_BASE_URL, PROOT_PERMISSIONS,
-    MAX_DOWNLOAD_RETRIES, RETRY_DELAY
+    GOTTY_BASE_URL, PROOT_PERMISSIONS
 )
 
 def get_gotty_url():
@@ -23,34 +21,18 @@ def get_gotty_url():
         raise Exception(f"Unsupported architecture for gotty: {arch}")
 
 def download_gotty(data_dir):
-    """Downloads the gotty tarball with retry logic."""
+    """Downloads the gotty tarball (retried by the download manager)."""
     gotty_url = get_gotty_url()
     gotty_dir = os.path.join(data_dir, 'libs', 'gotty')
     os.makedirs(gotty_dir, exist_ok=True)
     tar_path = os.path.join(gotty_dir, 'gotty.tar.gz')
-    
-    # Retry logic for downloads
-    for attempt in range(MAX_DOWNLOAD_RETRIES):
-        try:
-            urllib.request.urlretrieve(gotty_url, tar_path)
-            return tar_path, gotty_dir
-        except (urllib.error.URLError, urllib.error.HTTPError, OSError) as e:
-            if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                print_error(f"Download failed (attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}): {e}")
-                print_main(f"Retrying in {RETRY_DELAY} seconds...")
-                if os.path.exists(tar_path):
-                    os.remove(tar_path)
-                time.sleep(RETRY_DELAY)
-            else:
-                print_error(f"Failed to download gotty after {MAX_DOWNLOAD_RETRIES} attempts: {e}")
-                if os.path.exists(tar_path):
-                    os.remove(tar_path)
-                raise
+    with ProgressBar("Downloading gotty") as progress:
+        fetch_artifact(gotty_url, tar_path, reporthook=progress.reporthook, description='gotty')
+    return tar_path, gotty_dir
 
 def extract_gotty(tar_path, gotty_dir):
     """Extracts the gotty tarball."""
-    with tarfile.open(tar_path, 'r:gz') as tar:
-        tar.extractall(path=gotty_dir)
+    extract_archive(tar_path, gotty_dir, mode='r|gz', exclude=None)
     os.remove(tar_path)
 
 def find_gotty_binary(gotty_dir):
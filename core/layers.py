@@ -0,0 +1,513 @@
+"""
+Layered rootfs for LCSX.
+Shares one sealed base tree per distribution release between instances, each with its own writable layer.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import re
+import shutil
+import stat
+import time
+from lcsx.config.config import load_config
+from lcsx.config.constants import DEFAULT_BASE_DIR, LAYER_PATHS, ROOTFS_LAYOUT
+from lcsx.core.logger import get_logger
+from lcsx.core.templates import clone_tree, template_name
+
+BASE_META = 'base.json'
+CURRENT_FILE = 'CURRENT'
+INSTANCES_FILE = 'instances.json'
+VERSION_PATTERN = re.compile(r'^v(\d+)$')
+# A base version is cloned for promotion by sharing extents or by copying; never by
+# hard links, which would let the change chmod or rewrite files of the version it came from
+PROMOTE_CLONE_METHODS = ('reflink', 'copy')
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+# Base store instance
+_store = None
+_base_dir = None
+_layout = ROOTFS_LAYOUT
+
+
+class LayerError(Exception):
+    """A base version cannot be built, promoted or used."""
+
+
+def base_root(version_dir):
+    """Root directory of the rootfs in a base version (inside its single top-level directory, if any)."""
+    rootfs = os.path.join(version_dir, 'rootfs')
+    entries = os.listdir(rootfs)
+    if len(entries) == 1 and os.path.isdir(os.path.join(rootfs, entries[0])):
+        return os.path.join(rootfs, entries[0])
+    return rootfs
+
+
+def find_version_dir(root):
+    """Base version directory that contains the rootfs root, or None."""
+    path = os.path.abspath(root)
+    while True:
+        if os.path.isfile(os.path.join(path, BASE_META)):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def seal_tree(path, keep_writable=()):
+    """
+    Remove write permission from every file and directory under path.
+
+    The subtrees in keep_writable (relative to path) are left alone: they
+    only seed the writable layers of new instances, which shadow them.
+    Symlinks are skipped, since chmod would follow them.
+    """
+    keep = {p.strip('/') for p in keep_writable}
+    for root, dirs, files in os.walk(path):
+        rel_root = os.path.relpath(root, path)
+        rel_root = '' if rel_root == '.' else rel_root
+        dirs[:] = [name for name in dirs if os.path.join(rel_root, name) not in keep]
+        for name in dirs + files:
+            _chmod_bits(os.path.join(root, name), clear=WRITE_BITS)
+    _chmod_bits(path, clear=WRITE_BITS)
+
+
+def unseal_tree(path):
+    """Give the owner write permission on every file and directory under path again."""
+    _chmod_bits(path, add=stat.S_IWUSR)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            _chmod_bits(os.path.join(root, name), add=stat.S_IWUSR)
+
+
+def _chmod_bits(path, add=0, clear=0):
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        return
+    mode = (stat.S_IMODE(st.st_mode) | add) & ~clear
+    if mode != stat.S_IMODE(st.st_mode):
+        os.chmod(path, mode)
+
+
+def remove_tree(path):
+    """Remove a (possibly sealed) tree."""
+    if os.path.lexists(path):
+        unseal_tree(path)
+        shutil.rmtree(path)
+
+
+def create_layer(base, layer_dir):
+    """
+    Seed the writable layer of a new instance with the LAYER_PATHS of its base.
+
+    Args:
+        base: Root directory of the base rootfs.
+        layer_dir: Directory of the layer; created if missing.
+    """
+    os.makedirs(layer_dir, exist_ok=True)
+    for path in LAYER_PATHS:
+        source = os.path.join(base, path)
+        target = os.path.join(layer_dir, path)
+        if os.path.isdir(source) and not os.path.islink(source):
+            clone_tree(source, target, 'copy')
+        else:
+            os.makedirs(target, exist_ok=True)
+
+
+def is_layer(layer_dir):
+    """True if layer_dir holds a writable layer (only LAYER_PATHS), not a full rootfs."""
+    try:
+        entries = set(os.listdir(layer_dir))
+    except OSError:
+        return False
+    return entries <= set(LAYER_PATHS) and all(os.path.isdir(os.path.join(layer_dir, path)) for path in LAYER_PATHS)
+
+
+def layer_binds(config):
+    """proot -b arguments that put the writable layer of a layered instance over its base."""
+    if not config.get('rootfs_base'):
+        return []
+    layer_dir = os.path.abspath(config['rootfs'])
+    binds = []
+    for path in LAYER_PATHS:
+        binds.extend(['-b', f"{os.path.join(layer_dir, path)}:/{path}"])
+    return binds
+
+
+def _entry_key(path):
+    """What decides whether an entry of a base changed between two versions, or None if missing."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    if stat.S_ISLNK(st.st_mode):
+        return ('link', os.readlink(path))
+    if stat.S_ISDIR(st.st_mode):
+        return ('dir',)
+    return ('file', stat.S_IFMT(st.st_mode), st.st_size, st.st_mtime_ns)
+
+
+def sync_layer(old_base, new_base, layer_dir):
+    """
+    Carry the changes between two base versions under LAYER_PATHS into a layer.
+
+    Files added or changed by the new version replace the layer's copy and
+    files it removed are deleted, so that e.g. /etc and the package
+    database in /var match the /usr the instance now runs. Everything else
+    in the layer is kept.
+
+    Returns:
+        int: Number of layer entries written or removed.
+    """
+    changed = 0
+    for path in LAYER_PATHS:
+        new_top = os.path.join(new_base, path)
+        for root, dirs, files in os.walk(new_top):
+            rel_root = os.path.relpath(root, new_base)
+            for name in list(dirs):
+                if os.path.islink(os.path.join(root, name)):
+                    dirs.remove(name)
+                    files.append(name)
+            for name in dirs + files:
+                rel = os.path.join(rel_root, name)
+                source = os.path.join(new_base, rel)
+                key = _entry_key(source)
+                if key == _entry_key(os.path.join(old_base, rel)):
+                    continue
+                target = os.path.join(layer_dir, rel)
+                if key == ('dir',):
+                    if not os.path.isdir(target) or os.path.islink(target):
+                        _remove_entry(target)
+                        os.makedirs(target)
+                        shutil.copystat(source, target)
+                        changed += 1
+                    continue
+                _remove_entry(target)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if key[0] == 'link':
+                    os.symlink(key[1], target)
+                elif stat.S_ISREG(key[1]):
+                    shutil.copy2(source, target)
+                else:
+                    continue
+                changed += 1
+        old_top = os.path.join(old_base, path)
+        for root, dirs, files in os.walk(old_top, topdown=False):
+            rel_root = os.path.relpath(root, old_base)
+            for name in files + dirs:
+                rel = os.path.join(rel_root, name)
+                if not os.path.lexists(os.path.join(new_base, rel)) and os.path.lexists(os.path.join(layer_dir, rel)):
+                    _remove_entry(os.path.join(layer_dir, rel))
+                    changed += 1
+    return changed
+
+
+def _remove_entry(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class BaseStore:
+    """
+    Sealed base trees shared by layered instances, versioned per distribution release.
+
+    Layout:
+        <name>/v<N>/rootfs/     the rootfs, read-only except the LAYER_PATHS seeds
+        <name>/v<N>/base.json   URL and sha256 of the tarball, parent version, command
+        <name>/CURRENT          version new instances start from
+        <name>/instances.json   data directory -> version of every instance set up on the base
+        <name>.lock             exclusive while a version is built or promoted
+        <name>.instances.lock   exclusive while instances.json is updated or a version removed
+
+    A version is never modified once published: promoting a package change
+    creates v<N+1>, and instances move to it one at a time. A version that
+    an instance still runs on is not removed unless forced.
+    """
+
+    def __init__(self, base_dir=None):
+        self.base_dir = os.path.abspath(os.path.expanduser(base_dir or DEFAULT_BASE_DIR))
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _lock(self, name):
+        with open(os.path.join(self.base_dir, f"{name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def versions(self, name):
+        """Published versions of a base, oldest first."""
+        try:
+            entries = os.listdir(os.path.join(self.base_dir, name))
+        except FileNotFoundError:
+            return []
+        return sorted((e for e in entries if VERSION_PATTERN.match(e)), key=lambda e: int(e[1:]))
+
+    def meta(self, name, version):
+        """base.json of a version, or None."""
+        try:
+            with open(os.path.join(self.base_dir, name, version, BASE_META), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def current_version(self, name):
+        """Name of the version new instances of a base start from, or None."""
+        try:
+            with open(os.path.join(self.base_dir, name, CURRENT_FILE), 'r') as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version if version in self.versions(name) else None
+
+    def current(self, url, sha256=None):
+        """
+        Return the current version directory of the base for url, or None.
+
+        With sha256 given, a base built from a different tarball is a miss.
+        """
+        name = template_name(url)
+        version = self.current_version(name)
+        meta = self.meta(name, version) if version else None
+        if meta is None or meta.get('url') != url or (sha256 and meta.get('sha256') != sha256):
+            return None
+        return os.path.join(self.base_dir, name, version)
+
+    def entries(self):
+        """
+        List every published version.
+
+        Returns:
+            list: (name, version, meta, is_current) tuples.
+        """
+        result = []
+        for name in sorted(os.listdir(self.base_dir)):
+            if not os.path.isdir(os.path.join(self.base_dir, name)):
+                continue
+            current = self.current_version(name)
+            for version in self.versions(name):
+                result.append((name, version, self.meta(name, version) or {}, version == current))
+        return result
+
+    def _next_version(self, name):
+        versions = self.versions(name)
+        return f"v{int(versions[-1][1:]) + 1}" if versions else 'v1'
+
+    def _publish(self, name, version, staging, meta):
+        """Seal a staged version, move it into place and make it current."""
+        root = base_root(staging)
+        seal_tree(os.path.join(staging, 'rootfs'),
+                  keep_writable=[os.path.relpath(os.path.join(root, path), os.path.join(staging, 'rootfs'))
+                                 for path in LAYER_PATHS])
+        with open(os.path.join(staging, BASE_META), 'w') as f:
+            json.dump(meta, f, indent=1)
+        final = os.path.join(self.base_dir, name, version)
+        os.replace(staging, final)
+        current_tmp = os.path.join(self.base_dir, name, f".{CURRENT_FILE}.{os.getpid()}")
+        with open(current_tmp, 'w') as f:
+            f.write(version + '\n')
+        os.replace(current_tmp, os.path.join(self.base_dir, name, CURRENT_FILE))
+        return final
+
+    def build(self, url, sha256, extract, prepare=None):
+        """
+        Build the first version of the base for url (or a new one if the tarball changed).
+
+        Args:
+            url: Rootfs tarball URL.
+            sha256: Digest of the tarball, recorded to detect staleness.
+            extract: Callable extracting the rootfs into the directory it is given; it may
+                return the tarball's sha256 when that was not known beforehand.
+            prepare: Optional callable given the rootfs root before it is sealed,
+                e.g. to install the packages every instance needs.
+
+        Returns:
+            str: The new version directory.
+        """
+        name = template_name(url)
+        with self._lock(name):
+            # Another process may have built it while we waited for the lock
+            existing = self.current(url, sha256)
+            if existing is not None:
+                return existing
+            version = self._next_version(name)
+            staging = os.path.join(self.base_dir, name, f".{version}.{os.getpid()}.build")
+            remove_tree(staging)
+            os.makedirs(os.path.join(staging, 'rootfs'))
+            try:
+                sha256 = extract(os.path.join(staging, 'rootfs')) or sha256
+                if prepare is not None:
+                    prepare(base_root(staging))
+                final = self._publish(name, version, staging, {
+                    'url': url, 'sha256': sha256, 'parent': None, 'command': None, 'created': time.time()})
+            finally:
+                remove_tree(staging)
+        get_logger().info(f"Built base {name}/{version} from {url}")
+        return final
+
+    def promote(self, version_dir, run, layer_dir=None, command=None):
+        """
+        Create the next version of a base by running a change in a writable copy of version_dir.
+
+        Args:
+            version_dir: Version the change starts from.
+            run: Callable given the copy's rootfs root; returns the exit status of the change.
+            layer_dir: Writable layer of the instance being promoted. What the change did
+                under LAYER_PATHS is carried into it (see sync_layer).
+            command: Description of the change, recorded in base.json.
+
+        Returns:
+            str: The new version directory, which is now current.
+
+        Raises:
+            LayerError: If the change exits with an error; nothing is published.
+        """
+        name = os.path.basename(os.path.dirname(version_dir))
+        parent = os.path.basename(version_dir)
+        meta = self.meta(name, parent)
+        if meta is None:
+            raise LayerError(f"Not a base version: {version_dir}")
+        with self._lock(name):
+            version = self._next_version(name)
+            staging = os.path.join(self.base_dir, name, f".{version}.{os.getpid()}.build")
+            remove_tree(staging)
+            try:
+                for method in PROMOTE_CLONE_METHODS:
+                    try:
+                        clone_tree(os.path.join(version_dir, 'rootfs'), os.path.join(staging, 'rootfs'), method)
+                        break
+                    except OSError as e:
+                        if method == PROMOTE_CLONE_METHODS[-1]:
+                            raise
+                        get_logger().info(f"Cloning base {name}/{parent} with {method} failed ({e}); trying the next method")
+                        remove_tree(staging)
+                unseal_tree(os.path.join(staging, 'rootfs'))
+                status = run(base_root(staging))
+                if status != 0:
+                    raise LayerError(f"Command exited with status {status}; {name}/{parent} is unchanged")
+                if layer_dir is not None:
+                    changed = sync_layer(base_root(version_dir), base_root(staging), layer_dir)
+                    get_logger().info(f"Carried {changed} changed entries into layer {layer_dir}")
+                final = self._publish(name, version, staging, dict(
+                    meta, parent=parent, command=command, created=time.time()))
+            finally:
+                remove_tree(staging)
+        get_logger().info(f"Promoted base {name}/{parent} to {version}")
+        return final
+
+    def _read_instances(self, name):
+        try:
+            with open(os.path.join(self.base_dir, name, INSTANCES_FILE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_instances(self, name, instances):
+        path = os.path.join(self.base_dir, name, INSTANCES_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(instances, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def register(self, version_dir, data_dir):
+        """
+        Record that the instance in data_dir runs on version_dir.
+
+        Entries of data directories that no longer exist are dropped.
+
+        Raises:
+            LayerError: If version_dir is not a published version (e.g. it was just removed).
+        """
+        name = os.path.basename(os.path.dirname(version_dir))
+        version = os.path.basename(version_dir)
+        with self._lock(f"{name}.instances"):
+            if self.meta(name, version) is None:
+                raise LayerError(f"Not a base version: {version_dir}")
+            instances = {path: v for path, v in self._read_instances(name).items() if os.path.isdir(path)}
+            instances[os.path.abspath(data_dir)] = version
+            self._write_instances(name, instances)
+
+    def users(self, name, version):
+        """
+        Data directories of the instances that still run on a version.
+
+        An instance counts while its writable layer exists and its config
+        points at the version; one whose config is not written yet (being
+        set up) or cannot be read counts too.
+        """
+        version_dir = os.path.join(self.base_dir, name, version)
+        result = []
+        for data_dir, registered in sorted(self._read_instances(name).items()):
+            if registered != version or not is_layer(os.path.join(data_dir, 'rootfs')):
+                continue
+            try:
+                base = load_config(data_dir, data_dir).get('rootfs_base')
+            except (FileNotFoundError, ValueError, PermissionError):
+                result.append(data_dir)
+                continue
+            if base and find_version_dir(base) == version_dir:
+                result.append(data_dir)
+        return result
+
+    def remove(self, name, version, force=False):
+        """
+        Delete a version that is not current and that no instance runs on.
+
+        Args:
+            name: Base name.
+            version: Version to delete, e.g. 'v1'.
+            force: Delete it even while instances run on it; they will no longer start.
+
+        Returns:
+            list: Data directories of the instances that were still on it (only with force).
+
+        Raises:
+            LayerError: If the version does not exist, is current or, without force, is in use.
+        """
+        with self._lock(name), self._lock(f"{name}.instances"):
+            if version not in self.versions(name):
+                raise LayerError(f"No such base version: {name}/{version}")
+            if version == self.current_version(name):
+                raise LayerError(f"{name}/{version} is the current version")
+            users = self.users(name, version)
+            if users and not force:
+                raise LayerError(f"{name}/{version} is used by {len(users)} instance(s): {', '.join(users)}. "
+                                 f"Move them with 'lcsx base rebase DATA_DIR' first, or pass --force")
+            remove_tree(os.path.join(self.base_dir, name, version))
+        get_logger().info(f"Removed base {name}/{version}" + (f" still used by {', '.join(users)}" if users else ''))
+        return users
+
+
+def setup_layers(base_dir=None, layout=None):
+    """
+    Configure the global base store and the rootfs layout of new instances.
+
+    The store directory is only created when a layered instance needs it.
+
+    Args:
+        base_dir: Base directory. If None, uses DEFAULT_BASE_DIR.
+        layout: 'copy' or 'layered'. If None, uses ROOTFS_LAYOUT.
+    """
+    global _store, _base_dir, _layout
+    _layout = ROOTFS_LAYOUT if layout is None else layout
+    _base_dir = base_dir
+    _store = None
+
+
+def get_base_store():
+    """Get the global base store, creating it if necessary."""
+    global _store
+    if _store is None:
+        _store = BaseStore(_base_dir)
+    return _store
+
+
+def get_rootfs_layout():
+    """Return the configured rootfs layout of new instances."""
+    return _layout
@@ -0,0 +1,369 @@
+"""
+Rootfs manifests for LCSX.
+Records path, size, mode, mtime and content hash of every extracted entry and verifies a rootfs against them.
+"""
+
+import bisect
+import hashlib
+import multiprocessing
+import os
+import random
+import stat
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from lcsx.config.constants import MANIFEST_WORKERS, REPAIR_KEEP_MODIFIED, VERIFY_SAMPLE_RATE
+from lcsx.core.logger import get_logger
+
+MANIFEST_MAGIC = b'LCSXMF2\n'
+# entry count, size of the path blob, sha256 of the tarball the rootfs came from (zeros if unknown)
+MANIFEST_HEADER = struct.Struct('<II32s')
+HASH_SIZE = 16
+HASH_CHUNK_SIZE = 1024 * 1024
+# Entries handed to a worker process at once
+CHUNK_ENTRIES = 2048
+NO_HASH = bytes(HASH_SIZE)
+# tarfile sets mtimes from float seconds, so a re-extracted file can be off by a few hundred ns
+MTIME_TOLERANCE_NS = 1000000
+HASH_MODES = ('none', 'sample', 'full')
+
+
+def manifest_path(rootfs_dir):
+    """Manifest file of a rootfs directory, e.g. <data dir>/rootfs.manifest."""
+    return os.path.abspath(rootfs_dir).rstrip('/') + '.manifest'
+
+
+def is_instance_state(path, top=''):
+    """True if a relative rootfs path lies under REPAIR_KEEP_MODIFIED (below the top-level directory top)."""
+    for keep in REPAIR_KEEP_MODIFIED:
+        keep = os.path.join(top, keep)
+        if path == keep or path.startswith(keep + '/'):
+            return True
+    return False
+
+
+def hash_file(path):
+    """blake2b-128 of a file's contents."""
+    digest = hashlib.blake2b(digest_size=HASH_SIZE)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _entry_hash(path, mode):
+    """Content hash of an entry: file data, symlink target, nothing for anything else."""
+    if stat.S_ISREG(mode):
+        return hash_file(path)
+    if stat.S_ISLNK(mode):
+        return hashlib.blake2b(os.fsencode(os.readlink(path)), digest_size=HASH_SIZE).digest()
+    return NO_HASH
+
+
+def _hash_chunk(root, entries):
+    """Worker: hash (path, mode) entries under root; unreadable ones get NO_HASH."""
+    hashes = []
+    for path, mode in entries:
+        try:
+            hashes.append(_entry_hash(os.path.join(root, path), mode))
+        except OSError:
+            hashes.append(NO_HASH)
+    return b''.join(hashes)
+
+
+def _workers(workers):
+    return max(1, workers or MANIFEST_WORKERS or os.cpu_count() or 1)
+
+
+def _chunks(items, size=CHUNK_ENTRIES):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _map_chunks(func, root, chunks, workers):
+    """
+    Return [func(root, chunk) for chunk in chunks], computed in a process pool when it helps.
+
+    Workers are spawned rather than forked, since setup calls this while
+    download threads are running; frozen builds route the re-executed
+    binary to them through multiprocessing.freeze_support(). A pool that
+    cannot start or dies is not fatal: the work is redone in this process.
+    """
+    workers = min(_workers(workers), len(chunks))
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                return list(pool.map(func, [root] * len(chunks), chunks))
+        except (OSError, BrokenProcessPool, NotImplementedError) as e:
+            get_logger().warning(f"Process pool unavailable ({e}); continuing in-process")
+    return [func(root, chunk) for chunk in chunks]
+
+
+class Manifest:
+    """
+    Column arrays describing every entry of a rootfs, sorted by path.
+
+    On disk (little-endian):
+        magic, entry count, path blob size, tarball sha256
+        sizes    uint64[count]
+        mtimes   int64[count]    nanoseconds
+        modes    uint32[count]   st_mode, file type included
+        ends     uint32[count]   end of each path in the blob
+        hashes   count * 16 bytes (blake2b-128; zero for directories and unreadable files)
+        blob     the paths, relative to the rootfs directory, concatenated
+    """
+
+    def __init__(self, paths=(), sizes=(), mtimes=(), modes=(), hashes=b'', source_sha256=None):
+        self.paths = list(paths)
+        self.sizes = array('Q', sizes)
+        self.mtimes = array('q', mtimes)
+        self.modes = array('I', modes)
+        self.hashes = bytes(hashes)
+        self.source_sha256 = source_sha256
+
+    def __len__(self):
+        return len(self.paths)
+
+    def entry(self, index):
+        """(path, size, mtime_ns, mode, hash) of entry index."""
+        return (self.paths[index], self.sizes[index], self.mtimes[index], self.modes[index],
+                self.hashes[index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def subset(self, paths):
+        """Manifest of the given relative paths (those it lists)."""
+        indices = sorted(i for i in (self.find(path) for path in paths) if i is not None)
+        return Manifest([self.paths[i] for i in indices], [self.sizes[i] for i in indices],
+                        [self.mtimes[i] for i in indices], [self.modes[i] for i in indices],
+                        b''.join(self.hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE] for i in indices),
+                        self.source_sha256)
+
+    def top_level(self):
+        """The single top-level directory the rootfs is wrapped in, or ''."""
+        tops = [i for i, path in enumerate(self.paths) if '/' not in path]
+        if len(tops) == 1 and stat.S_ISDIR(self.modes[tops[0]]):
+            return self.paths[tops[0]]
+        return ''
+
+    def find(self, path):
+        """Index of a relative path, or None."""
+        index = bisect.bisect_left(self.paths, path)
+        if index < len(self.paths) and self.paths[index] == path:
+            return index
+        return None
+
+    def write(self, path):
+        """Write the manifest atomically to path."""
+        ends = array('I')
+        encoded = [os.fsencode(p) for p in self.paths]
+        blob = b''.join(encoded)
+        end = 0
+        for item in encoded:
+            end += len(item)
+            ends.append(end)
+        columns = [array(self.sizes.typecode, self.sizes), array(self.mtimes.typecode, self.mtimes),
+                   array(self.modes.typecode, self.modes), ends]
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            source = bytes.fromhex(self.source_sha256) if self.source_sha256 else bytes(32)
+            f.write(MANIFEST_MAGIC + MANIFEST_HEADER.pack(len(self.paths), len(blob), source))
+            for column in columns:
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                column.tofile(f)
+            f.write(self.hashes)
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a manifest file.
+
+        Raises:
+            ValueError: If the file is not a manifest or is truncated.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MANIFEST_MAGIC) or len(data) < len(MANIFEST_MAGIC) + MANIFEST_HEADER.size:
+            raise ValueError(f"Not a rootfs manifest: {path}")
+        count, blob_size, source = MANIFEST_HEADER.unpack_from(data, len(MANIFEST_MAGIC))
+        offset = len(MANIFEST_MAGIC) + MANIFEST_HEADER.size
+        columns = []
+        for typecode in ('Q', 'q', 'I', 'I'):
+            column = array(typecode)
+            end = offset + count * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns.append(column)
+            offset = end
+        hashes = data[offset:offset + count * HASH_SIZE]
+        offset += count * HASH_SIZE
+        blob = data[offset:offset + blob_size]
+        if len(hashes) != count * HASH_SIZE or len(blob) != blob_size:
+            raise ValueError(f"Truncated rootfs manifest: {path}")
+        sizes, mtimes, modes, ends = columns
+        paths = []
+        start = 0
+        for end in ends:
+            paths.append(os.fsdecode(blob[start:end]))
+            start = end
+        manifest = cls()
+        manifest.paths, manifest.sizes, manifest.mtimes, manifest.modes = paths, sizes, mtimes, modes
+        manifest.hashes = hashes
+        manifest.source_sha256 = source.hex() if any(source) else None
+        return manifest
+
+
+def build_manifest(rootfs_dir, workers=None, source_sha256=None):
+    """
+    Scan an extracted rootfs and return its Manifest.
+
+    The tree is walked once for metadata; file contents are hashed in a
+    process pool, right after extraction while they are still in the page cache.
+
+    Args:
+        rootfs_dir: Directory the tarball was extracted into.
+        workers: Hashing processes (default: MANIFEST_WORKERS, or one per CPU).
+        source_sha256: sha256 of the tarball, which repairs extract from.
+    """
+    entries = []
+    for root, dirs, files in os.walk(rootfs_dir):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            entries.append((os.path.relpath(path, rootfs_dir), st.st_size, st.st_mtime_ns, st.st_mode))
+    entries.sort()
+    chunks = _chunks([(path, mode) for path, _, _, mode in entries])
+    hashes = b''.join(_map_chunks(_hash_chunk, rootfs_dir, chunks, workers))
+    return Manifest([e[0] for e in entries], [e[1] for e in entries], [e[2] for e in entries],
+                    [e[3] for e in entries], hashes, source_sha256)
+
+
+def record_manifest(rootfs_dir, workers=None, source_sha256=None):
+    """
+    Build and store the manifest of a freshly extracted rootfs.
+
+    A manifest is an aid, not a requirement: failures are logged and the
+    manifest is left out.
+
+    Returns:
+        Manifest, or None if it could not be written.
+    """
+    started = time.monotonic()
+    try:
+        manifest = build_manifest(rootfs_dir, workers, source_sha256)
+        manifest.write(manifest_path(rootfs_dir))
+    except (OSError, BrokenProcessPool, NotImplementedError) as e:
+        get_logger().warning(f"Could not write the manifest of {rootfs_dir}: {e}")
+        return None
+    get_logger().info(f"Recorded manifest of {rootfs_dir} ({len(manifest)} entries) "
+                      f"in {time.monotonic() - started:.2f}s")
+    return manifest
+
+
+def load_manifest(rootfs_dir):
+    """Manifest of a rootfs directory, or None if it has none (or an unreadable one)."""
+    try:
+        return Manifest.load(manifest_path(rootfs_dir))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        get_logger().warning(f"Ignoring manifest of {rootfs_dir}: {e}")
+        return None
+
+
+def _check_chunk(root, entries):
+    """
+    Worker: compare (path, size, mtime_ns, mode, hash, rehash) entries with the tree under root.
+
+    Returns:
+        tuple: (missing paths, modified paths, entries hashed)
+    """
+    missing, modified, hashed = [], [], 0
+    for path, size, mtime, mode, digest, rehash in entries:
+        full = os.path.join(root, path)
+        try:
+            st = os.lstat(full)
+        except FileNotFoundError:
+            missing.append(path)
+            continue
+        except OSError:
+            modified.append(path)
+            continue
+        if stat.S_IFMT(st.st_mode) != stat.S_IFMT(mode) or stat.S_IMODE(st.st_mode) != stat.S_IMODE(mode):
+            modified.append(path)
+        elif stat.S_ISDIR(mode):
+            # Directory times change whenever an entry is added or removed
+            continue
+        elif stat.S_ISLNK(mode):
+            if _entry_hash(full, mode) != digest:
+                modified.append(path)
+        elif st.st_size != size or (stat.S_ISREG(mode) and abs(st.st_mtime_ns - mtime) > MTIME_TOLERANCE_NS):
+            modified.append(path)
+        elif rehash and stat.S_ISREG(mode) and digest != NO_HASH:
+            hashed += 1
+            try:
+                if hash_file(full) != digest:
+                    modified.append(path)
+            except OSError:
+                modified.append(path)
+    return missing, modified, hashed
+
+
+def verify_rootfs(rootfs_dir, manifest=None, hash_mode='sample', sample_rate=None, workers=None):
+    """
+    Compare a rootfs with its manifest.
+
+    Every entry is checked with lstat (type, mode, size and, for files,
+    mtime); 'sample' also re-hashes a random sample of the files whose
+    metadata matches and 'full' re-hashes all of them. The work is spread
+    over a process pool. Modified entries under REPAIR_KEEP_MODIFIED are
+    the instance's own state (resolv.conf, the prompt in .bashrc, installed
+    packages) and are reported as 'state' rather than 'modified'.
+
+    Args:
+        rootfs_dir: Directory the tarball was extracted into.
+        manifest: Manifest to check against (default: the one stored next to rootfs_dir).
+        hash_mode: 'none', 'sample' or 'full'.
+        sample_rate: Fraction of files hashed in 'sample' mode (default: VERIFY_SAMPLE_RATE).
+        workers: Checking processes (default: MANIFEST_WORKERS, or one per CPU).
+
+    Returns:
+        dict: 'missing', 'modified' and 'state' (sorted relative paths), 'checked' and
+        'hashed' (entry counts), 'seconds'; None if there is no manifest.
+    """
+    started = time.monotonic()
+    manifest = manifest or load_manifest(rootfs_dir)
+    if manifest is None:
+        return None
+    rate = VERIFY_SAMPLE_RATE if sample_rate is None else sample_rate
+    count = len(manifest)
+    if hash_mode == 'full':
+        rehash = set(range(count))
+    elif hash_mode == 'sample':
+        files = [i for i in range(count) if stat.S_ISREG(manifest.modes[i])]
+        rehash = set(random.sample(files, min(len(files), max(1, int(len(files) * rate))))) if files else set()
+    else:
+        rehash = set()
+    entries = [manifest.entry(i) + (i in rehash,) for i in range(count)]
+    chunks = _chunks(entries)
+    missing, modified, hashed = [], [], 0
+    for chunk_missing, chunk_modified, chunk_hashed in _map_chunks(_check_chunk, os.path.abspath(rootfs_dir),
+                                                                   chunks, workers):
+        missing.extend(chunk_missing)
+        modified.extend(chunk_modified)
+        hashed += chunk_hashed
+    top = manifest.top_level()
+    state = [path for path in modified if is_instance_state(path, top)]
+    modified = [path for path in modified if not is_instance_state(path, top)]
+    seconds = time.monotonic() - started
+    get_logger().info(f"Verified {rootfs_dir}: {count} entries, {hashed} hashed, {len(missing)} missing, "
+                      f"{len(modified)} modified, {len(state)} instance state changed in {seconds:.2f}s")
+    return {'missing': missing, 'modified': modified, 'state': state, 'checked': count, 'hashed': hashed,
+            'seconds': seconds}
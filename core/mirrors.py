@@ -0,0 +1,205 @@
+"""
+Mirror selection for LCSX.
+Maps artifact URLs onto configured mirrors and ranks them by a cached latency/throughput probe.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.config.catalog import MIRRORS
+from lcsx.config.constants import MIRRORS_FILE, MIRROR_PROBE_FILE, MIRROR_PROBE_TTL
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_main, print_warning
+
+# Selector instance
+_selector = None
+_selector_lock = threading.Lock()
+
+
+class MirrorSelector:
+    """
+    Ordered mirror lists for artifact URLs.
+
+    mirrors.json maps an origin URL prefix to mirror base URLs, which may be
+    http(s):// or file:// locations:
+
+        {"https://github.com/termux/proot-distro/releases/download":
+            ["file:///srv/mirror/proot-distro", "http://mirror.lan/proot-distro"]}
+
+    An artifact under a prefix can then be fetched from any of its mirrors
+    with the rest of the URL appended, with the origin as the last resort.
+    The "*" key lists lcsx cache servers (lcsx cache serve), which are tried
+    for every http(s) artifact as <server>/<host>/<path>.
+    When there is more than one candidate they are probed in parallel and
+    ranked fastest first; probe results are kept per mirror for ttl seconds
+    so later runs skip probing.
+    """
+
+    def __init__(self, mirrors_file=None, probe_file=None, ttl=MIRROR_PROBE_TTL):
+        self.mirrors_file = mirrors_file or MIRRORS_FILE
+        self.probe_file = probe_file or MIRROR_PROBE_FILE
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.mirrors = self._load_mirrors()
+
+    def _load_mirrors(self):
+        """Merge the user's mirrors.json over the built-in catalog mirrors."""
+        mirrors = {prefix.rstrip('/'): list(urls) for prefix, urls in MIRRORS.items()}
+        try:
+            with open(self.mirrors_file, 'r') as f:
+                user_mirrors = json.load(f)
+        except FileNotFoundError:
+            return mirrors
+        except (json.JSONDecodeError, OSError) as e:
+            print_warning(f"Ignoring invalid mirrors file {self.mirrors_file}: {e}")
+            return mirrors
+        if not isinstance(user_mirrors, dict):
+            print_warning(f"Ignoring invalid mirrors file {self.mirrors_file}: expected an object")
+            return mirrors
+        for prefix, urls in user_mirrors.items():
+            if isinstance(urls, str):
+                urls = [urls]
+            prefix = prefix.rstrip('/')
+            merged = [url.rstrip('/') for url in urls]
+            merged += [url for url in mirrors.get(prefix, []) if url not in merged]
+            mirrors[prefix] = merged
+        return mirrors
+
+    def _read_probes(self):
+        try:
+            with open(self.probe_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_probes(self, probes):
+        try:
+            os.makedirs(os.path.dirname(self.probe_file), exist_ok=True)
+            tmp_file = f"{self.probe_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(probes, f, indent=1)
+            os.replace(tmp_file, self.probe_file)
+        except OSError as e:
+            get_logger().warning(f"Could not save mirror probe results: {e}")
+
+    def _server_candidates(self, url):
+        """Return the URLs of url on the configured cache servers."""
+        scheme, sep, rest = url.partition('://')
+        if not sep or scheme not in ('http', 'https'):
+            return []
+        return [f"{server}/{rest}" for server in self.mirrors.get('*', [])]
+
+    def candidates(self, url):
+        """
+        Return [(key, candidate_url), ...] for url in configured order.
+
+        Cache servers come first, then the mirrors of the longest matching
+        prefix. The origin comes last unless it is listed explicitly. key
+        names the probe result: the mirror base, or the candidate URL itself
+        for cache servers, which may hold some artifacts and not others.
+        """
+        result = [(candidate, candidate) for candidate in self._server_candidates(url)]
+        for prefix in sorted(self.mirrors, key=len, reverse=True):
+            if url == prefix or url.startswith(prefix + '/'):
+                tail = url[len(prefix):]
+                bases = self.mirrors[prefix] + ([prefix] if prefix not in self.mirrors[prefix] else [])
+                return result + [(base, base + tail) for base in bases]
+        return result + [(url, url)]
+
+    def rank(self, url, probe):
+        """
+        Return candidate URLs for url, fastest reachable first.
+
+        Args:
+            url: Canonical artifact URL.
+            probe: Callable(candidate_url) returning (latency_seconds, bytes_per_second);
+                it raises if the candidate is unreachable.
+
+        Returns:
+            list: Candidate URLs. Reachable cache servers come first, since
+                serving from the LAN is the point of running them; unreachable
+                candidates are kept at the end in configured order.
+        """
+        candidates = self.candidates(url)
+        if len(candidates) == 1:
+            return [candidates[0][1]]
+
+        with self._lock:
+            probes = self._read_probes()
+            now = time.time()
+            stale = [(base, candidate) for base, candidate in candidates
+                     if now - probes.get(base, {}).get('checked', 0) > self.ttl]
+            if stale:
+                def run(item):
+                    base, candidate = item
+                    try:
+                        latency, rate = probe(candidate)
+                        return base, {'ok': True, 'latency': latency, 'rate': rate, 'checked': now}
+                    except Exception as e:
+                        get_logger().info(f"Mirror probe of {candidate} failed: {e}")
+                        return base, {'ok': False, 'checked': now}
+                with ThreadPoolExecutor(max_workers=len(stale)) as pool:
+                    for base, result in pool.map(run, stale):
+                        probes[base] = result
+                self._write_probes(probes)
+
+        order = {base: i for i, (base, _) in enumerate(candidates)}
+        servers = set(self._server_candidates(url))
+
+        def score(item):
+            base, _ = item
+            result = probes.get(base, {})
+            if not result.get('ok'):
+                return (1, order[base])
+            # Time to fetch a typical 1 MB block: round trip plus transfer
+            return (0, base not in servers, result['latency'] + (1024 * 1024) / max(result['rate'], 1))
+
+        ranked = sorted(candidates, key=score)
+        best = probes.get(ranked[0][0], {})
+        if stale and best.get('ok'):
+            print_main(f"Using mirror {ranked[0][0]} ({best['latency'] * 1000:.0f} ms, "
+                       f"{best['rate'] / (1024**2):.2f} MB/s)")
+        summary = []
+        for base, _ in ranked:
+            result = probes.get(base, {})
+            summary.append(f"{base} ({result['latency'] * 1000:.0f} ms)" if result.get('ok') else f"{base} (unreachable)")
+        get_logger().info(f"Mirror ranking for {url}: {', '.join(summary)}")
+        return [candidate for _, candidate in ranked]
+
+    def mark_failed(self, url, source):
+        """Record that the mirror serving source (a candidate for url) failed, so it ranks last until re-probed."""
+        with self._lock:
+            probes = self._read_probes()
+            for base, candidate in self.candidates(url):
+                if candidate == source:
+                    probes[base] = {'ok': False, 'checked': time.time()}
+                    self._write_probes(probes)
+
+
+def setup_mirrors(mirrors_file=None, probe_file=None, ttl=MIRROR_PROBE_TTL):
+    """
+    Configure the global mirror selector.
+
+    Args:
+        mirrors_file: Mirror configuration. If None, uses ~/.lcsx/mirrors.json.
+        probe_file: Where probe results are kept. If None, uses ~/.lcsx/mirror-probes.json.
+        ttl: Seconds a probe result stays valid.
+
+    Returns:
+        MirrorSelector instance.
+    """
+    global _selector
+    with _selector_lock:
+        _selector = MirrorSelector(mirrors_file, probe_file, ttl)
+    return _selector
+
+
+def get_mirror_selector():
+    """Get the global mirror selector, creating it if necessary."""
+    global _selector
+    with _selector_lock:
+        if _selector is None:
+            _selector = MirrorSelector()
+    return _selector
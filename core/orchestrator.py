@@ -0,0 +1,109 @@
+"""
+Setup orchestration for LCSX.
+Runs independent setup phases concurrently according to their dependencies.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_main
+
+
+class SetupScheduler:
+    """
+    Dependency-aware runner for setup phases.
+
+    Each phase is a callable with a list of phases it depends on. Phases whose
+    dependencies have finished run concurrently on a thread pool; among ready
+    phases, higher priority ones are submitted first so the critical path
+    (the rootfs download) starts immediately.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.phases = {}
+        self.timings = {}
+
+    def add_phase(self, name, func, deps=(), priority=0):
+        """
+        Register a phase.
+
+        Args:
+            name: Unique phase name.
+            func: Callable run with no arguments.
+            deps: Names of phases that must finish first.
+            priority: Higher values are started first when several phases are ready.
+        """
+        if name in self.phases:
+            raise ValueError(f"Duplicate setup phase: {name}")
+        self.phases[name] = {'func': func, 'deps': set(deps), 'priority': priority}
+
+    def _check_graph(self):
+        """Reject unknown dependencies and cycles before anything runs."""
+        for name, phase in self.phases.items():
+            unknown = phase['deps'] - set(self.phases)
+            if unknown:
+                raise ValueError(f"Setup phase '{name}' depends on unknown phase(s): {', '.join(sorted(unknown))}")
+        remaining = {name: set(phase['deps']) for name, phase in self.phases.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Setup phases have a dependency cycle: {', '.join(sorted(remaining))}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def _timed(self, name):
+        started = time.monotonic()
+        try:
+            return self.phases[name]['func']()
+        finally:
+            self.timings[name] = time.monotonic() - started
+            get_logger().info(f"Setup phase '{name}' took {self.timings[name]:.2f}s")
+
+    def run(self):
+        """
+        Run all phases, returning {name: result}.
+
+        If a phase fails, no new phases are started, running phases are
+        allowed to finish, and the first error is re-raised.
+        """
+        self._check_graph()
+        results = {}
+        done = set()
+        pending = dict(self.phases)
+        running = {}
+        error = None
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    ready = [name for name, phase in pending.items() if phase['deps'] <= done]
+                    ready.sort(key=lambda name: -pending[name]['priority'])
+                    # Only as many as there are idle workers, so nothing sits queued past a failure
+                    for name in ready[:self.max_workers - len(running)]:
+                        del pending[name]
+                        running[pool.submit(self._timed, name)] = name
+                elif not running:
+                    break
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        done.add(name)
+                    except Exception as e:
+                        get_logger().error(f"Setup phase '{name}' failed: {e}")
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+        total = time.monotonic() - started
+        summary = ', '.join(f"{name} {self.timings[name]:.1f}s" for name in self.phases)
+        print_main(f"Setup finished in {total:.1f}s ({summary})")
+        return results
@@ -1,29 +1,60 @@
 import subprocess
 import os
+import shutil
 import sys
-import urllib.request
-import urllib.error
 import platform
-import time
 from lcsx.ui.logger import print_main, print_error
+from lcsx.ui.progress import ProgressBar
 from lcsx.core.gotty import run_gotty
+from lcsx.core.cache import fetch_artifact
+from lcsx.core.download import hash_file
+from lcsx.core.layers import layer_binds
+from lcsx.core.logger import get_logger
+from lcsx.config.catalog import get_pinned_sha256
 from lcsx.config.constants import (
-    PROOT_X86_64_URL, PROOT_ARM64_URL, PROOT_PERMISSIONS,
-    DOWNLOAD_TIMEOUT, MAX_DOWNLOAD_RETRIES, RETRY_DELAY
+    PROOT_X86_64_URL, PROOT_ARM64_URL, PROOT_PERMISSIONS
 )
 
+# PATH inside the guest, independent of the host's
+GUEST_PATH = '/bin:/sbin:/usr/bin:/usr/sbin:/usr/local/bin:/usr/local/sbin'
+
 def get_proot_path(data_dir, proot_bin):
     """Get the path to the proot binary."""
     return os.path.join(data_dir, 'libs', proot_bin)
 
+def get_bundled_libs_dirs():
+    """Directories that may hold the binaries shipped in libs/: the PyInstaller bundle first, then the source tree."""
+    dirs = []
+    if getattr(sys, '_MEIPASS', None):
+        dirs.append(os.path.join(sys._MEIPASS, 'libs'))
+    dirs.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'libs'))
+    return dirs
+
+def find_bundled_proot(proot_bin, proot_url=None):
+    """
+    Return the path of a shipped proot binary, or None.
+
+    When proot_url has a pinned sha256, a shipped file that does not match
+    it is ignored.
+    """
+    expected = get_pinned_sha256(proot_url) if proot_url else None
+    for libs_dir in get_bundled_libs_dirs():
+        path = os.path.join(libs_dir, proot_bin)
+        if not os.path.isfile(path):
+            continue
+        if expected and hash_file(path).hexdigest() != expected:
+            get_logger().warning(f"Bundled {path} does not match the pinned sha256 of {proot_url}; ignoring it")
+            continue
+        return path
+    return None
+
 def setup_proot_binary(data_dir, proot_bin):
-    """Downloads and sets up the proot binary if it doesn't exist."""
+    """Sets up the proot binary if it doesn't exist, from the shipped libs/ when possible."""
     proot_dir = os.path.join(data_dir, 'libs')
     os.makedirs(proot_dir, exist_ok=True)
     proot_path = os.path.join(proot_dir, proot_bin)
 
     if not os.path.exists(proot_path):
-        print_main(f"Proot binary '{proot_bin}' not found. Downloading again...")
         arch = platform.machine()
         if arch == 'x86_64':
             proot_url = PROOT_X86_64_URL
@@ -32,32 +63,35 @@ def setup_proot_binary(data_dir, proot_bin):
         else:
             raise Exception(f"Unsupported architecture for proot: {arch}")
 
-        print_main(f"Downloading {proot_bin}...")
-        # Retry logic for downloads
-        for attempt in range(MAX_DOWNLOAD_RETRIES):
-            try:
-                urllib.request.urlretrieve(proot_url, proot_path)
-                os.chmod(proot_path, PROOT_PERMISSIONS)
-                print_main(f"{proot_bin} downloaded and set executable.")
-                break
-            except (urllib.error.URLError, urllib.error.HTTPError, OSError) as e:
-                if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                    print_error(f"Download failed (attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}): {e}")
-                    print_main(f"Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
-                else:
-                    print_error(f"Failed to download {proot_bin} after {MAX_DOWNLOAD_RETRIES} attempts: {e}")
-                    raise
+        bundled = find_bundled_proot(proot_bin, proot_url)
+        if bundled:
+            # Copied rather than linked: the chmod below must not touch the shipped file
+            shutil.copyfile(bundled, proot_path)
+            os.chmod(proot_path, PROOT_PERMISSIONS)
+            print_main(f"Using bundled {proot_bin}.")
+            return proot_path
+
+        print_main(f"Proot binary '{proot_bin}' not found. Downloading...")
+        # Retried by the download manager
+        with ProgressBar(f"Downloading {proot_bin}") as progress:
+            fetch_artifact(proot_url, proot_path, reporthook=progress.reporthook, description=proot_bin)
+        os.chmod(proot_path, PROOT_PERMISSIONS)
+        print_main(f"{proot_bin} downloaded and set executable.")
     return proot_path
 
-def run_proot_command(data_dir, rootfs, command, input=None, capture_output=False, proot_bin='proot'):
-    """Run a command inside proot."""
+def build_proot_command(data_dir, rootfs, command, proot_bin='proot', binds=()):
+    """Return the argument list that runs a command inside proot, with extra -b arguments in binds."""
     proot_path = get_proot_path(data_dir, proot_bin)
-    cmd = [proot_path, '-r', rootfs, '-0', '-w', '/']
+    cmd = [proot_path, '-r', rootfs, '-0', '-w', '/'] + list(binds)
     if isinstance(command, str):
         cmd.append(command)
     else:
         cmd.extend(command)
+    return cmd
+
+def run_proot_command(data_dir, rootfs, command, input=None, capture_output=False, proot_bin='proot', binds=()):
+    """Run a command inside proot."""
+    cmd = build_proot_command(data_dir, rootfs, command, proot_bin, binds)
     return subprocess.run(cmd, input=input, capture_output=capture_output, text=True)
 
 import psutil
@@ -65,7 +99,8 @@ from lcsx.config.constants import DEFAULT_SHELL
 
 def start_proot_shell(config):
     """Start the proot shell with the configured prompt or sshx/gotty."""
-    rootfs = config['rootfs']
+    # Layered instances run on the shared base with their own layer bound over it
+    rootfs = config.get('rootfs_base') or config['rootfs']
     proot_bin = config['proot_bin']
     data_dir = config['data_dir']
     user = config['user']
@@ -87,6 +122,7 @@ def start_proot_shell(config):
 
     # Mount /proc from host to fix /proc/stat parsing error
     cmd.extend(['-b', '/proc:/proc'])
+    cmd.extend(layer_binds(config))
 
     if terminal_service == 'sshx' and sshx_path:
         abs_sshx_dir = os.path.abspath(os.path.dirname(sshx_path))
@@ -115,7 +151,7 @@ def start_proot_shell(config):
         f'RAM_TOTAL={ram_total}',
         f'DISK_TOTAL={disk_total}',
         'HOME=/root',
-        'PATH=/bin:/sbin:/usr/bin:/usr/sbin:/usr/local/bin:/usr/local/sbin'
+        f'PATH={GUEST_PATH}'
     ]
     # Prepend env vars to command
     env_command = ['env'] + env_vars + command
@@ -0,0 +1,145 @@
+"""
+Bandwidth limiting for LCSX.
+Token bucket shared by every download thread, with the budget split fairly between lcsx processes on the host.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from lcsx.config.constants import RATE_LIMIT_DIR, RATE_LIMIT_HEARTBEAT, RATE_LIMIT_PEER_TIMEOUT
+from lcsx.core.logger import get_logger
+
+# Limiter instance (None when downloads are not limited)
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the bytes per second read by this process.
+
+    Every limited process that is downloading keeps a heartbeat file
+    <pid>.json in coord_dir with its configured rate. Once per heartbeat
+    the peers that are alive and active are counted and the bucket is
+    refilled at the smallest configured rate divided by that count, so
+    concurrent setups split the budget evenly and an idle or finished
+    process hands its share back within RATE_LIMIT_PEER_TIMEOUT seconds.
+    """
+
+    def __init__(self, rate, coord_dir=None):
+        self.rate = rate
+        self.coord_dir = coord_dir or RATE_LIMIT_DIR
+        self.share = rate
+        self.peers = 1
+        self._heartbeat_file = os.path.join(self.coord_dir, f"{os.getpid()}.json")
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+        self._last_heartbeat = 0.0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _capacity(self):
+        # A quarter second of burst keeps reads smooth without overshooting the share
+        return max(self.share / 4, 1)
+
+    def _write_heartbeat(self, now):
+        try:
+            os.makedirs(self.coord_dir, exist_ok=True)
+            tmp_file = f"{self._heartbeat_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump({'pid': os.getpid(), 'rate': self.rate, 'updated': now}, f)
+            os.replace(tmp_file, self._heartbeat_file)
+        except OSError as e:
+            get_logger().warning(f"Could not write rate limit heartbeat: {e}")
+
+    def _active_rates(self, now):
+        """Return the configured rates of the processes currently downloading, including this one."""
+        rates = [self.rate]
+        try:
+            names = os.listdir(self.coord_dir)
+        except OSError:
+            return rates
+        for name in names:
+            if not name.endswith('.json') or name == os.path.basename(self._heartbeat_file):
+                continue
+            path = os.path.join(self.coord_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    peer = json.load(f)
+                os.kill(peer['pid'], 0)
+            except ProcessLookupError:
+                # The peer exited without cleaning up
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if now - peer.get('updated', 0) <= RATE_LIMIT_PEER_TIMEOUT:
+                rates.append(peer['rate'])
+        return rates
+
+    def _heartbeat(self):
+        """Announce this process and recompute its share of the host budget."""
+        now = time.time()
+        self._write_heartbeat(now)
+        rates = self._active_rates(now)
+        share = min(rates) / len(rates)
+        if len(rates) != self.peers:
+            get_logger().info(f"Download rate limit {min(rates) / 1024:.0f} KB/s shared by {len(rates)} "
+                              f"processes: {share / 1024:.0f} KB/s each")
+        self.peers = len(rates)
+        self.share = share
+
+    def consume(self, nbytes):
+        """
+        Take nbytes from the bucket, sleeping until the share allows them.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_heartbeat >= RATE_LIMIT_HEARTBEAT:
+                self._last_heartbeat = now
+                self._heartbeat()
+            self._tokens = min(self._capacity(), self._tokens + (now - self._updated) * self.share)
+            self._updated = now
+            # Reserve the bytes now and sleep off any debt outside the lock, so
+            # concurrent threads queue up in order instead of busy-waiting
+            self._tokens -= nbytes
+            wait = -self._tokens / self.share if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def close(self):
+        """Remove the heartbeat file so peers take over the whole budget."""
+        with contextlib.suppress(OSError):
+            os.remove(self._heartbeat_file)
+
+
+def setup_rate_limit(rate, coord_dir=None):
+    """
+    Configure the global download rate limit.
+
+    Args:
+        rate: Host-wide budget in bytes per second; 0 or None disables limiting.
+        coord_dir: Directory for the per-process heartbeat files. If None, uses ~/.lcsx/ratelimit.
+
+    Returns:
+        RateLimiter instance, or None when disabled.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is not None:
+            _limiter.close()
+        _limiter = RateLimiter(rate, coord_dir) if rate else None
+    return _limiter
+
+
+def get_rate_limiter():
+    """Get the global rate limiter, or None if downloads are not limited."""
+    return _limiter
@@ -0,0 +1,152 @@
+"""
+Rootfs repair for LCSX.
+Re-extracts only the missing or damaged entries of a rootfs from its cached tarball.
+"""
+
+import contextlib
+import os
+import shutil
+import stat
+import time
+from lcsx.core.cache import get_cache
+from lcsx.core.extract import extract_tar_stream, is_excluded_member, member_path
+from lcsx.core.logger import get_logger
+from lcsx.core.manifest import load_manifest, verify_rootfs
+from lcsx.core.resolv import set_resolv_conf
+from lcsx.core.seekable import extract_members, load_seek_index
+from lcsx.core.xz import STREAM_MAGIC
+
+
+def find_repair_source(sha256):
+    """
+    Return the cached copy of a tarball to re-extract from.
+
+    An archive with a member index is preferred: only the xz blocks holding
+    damaged members are decoded. Next comes the plain tar copy, read in
+    random-access mode, so members that are not needed are skipped by
+    seeking past their data.
+
+    Returns:
+        tuple: (path, tarfile mode, or 'index' for an indexed archive), or
+        None if the tarball is not cached.
+    """
+    cache = get_cache()
+    if cache is None or not sha256:
+        return None
+    indexed = load_seek_index(cache, sha256)
+    if indexed is not None:
+        return indexed[1], 'index'
+    derived = cache.lookup_derived(sha256)
+    if derived is not None and derived[1] == 'tar':
+        return derived[0], 'r:'
+    blob = cache.blob_path(sha256)
+    if not os.path.exists(blob):
+        return None
+    with open(blob, 'rb') as f:
+        return blob, 'r|xz' if f.read(len(STREAM_MAGIC)) == STREAM_MAGIC else 'r|*'
+
+
+def _damaged_paths(report, restore_modified):
+    """Missing and modified entries, plus the modified instance state when restore_modified is set."""
+    damaged = set(report['missing']) | set(report['modified'])
+    if restore_modified:
+        damaged |= set(report['state'])
+    return sorted(damaged)
+
+
+def _clear(rootfs_dir, manifest, paths):
+    """Remove what is on disk at the damaged paths, so fresh files are written (never through a hard link)."""
+    for path in sorted(paths, reverse=True):
+        full = os.path.join(rootfs_dir, path)
+        try:
+            st = os.lstat(full)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            if stat.S_ISDIR(manifest.modes[manifest.find(path)]):
+                # Only its mode changed; extraction applies it again
+                continue
+            shutil.rmtree(full)
+        else:
+            os.remove(full)
+
+
+@contextlib.contextmanager
+def _writable_parents(rootfs_dir, paths):
+    """
+    Let the owner write into the existing parent directories of paths while repairing.
+
+    Parents that are among paths themselves get their mode from extraction afterwards.
+    """
+    restore = {}
+    damaged = set(paths)
+    for path in paths:
+        parent = os.path.dirname(os.path.join(rootfs_dir, path))
+        if parent in restore or not os.path.isdir(parent):
+            continue
+        mode = stat.S_IMODE(os.lstat(parent).st_mode)
+        if not mode & stat.S_IWUSR:
+            os.chmod(parent, mode | stat.S_IWUSR)
+            if os.path.relpath(parent, rootfs_dir) not in damaged:
+                restore[parent] = mode
+    try:
+        yield
+    finally:
+        for parent, mode in restore.items():
+            with contextlib.suppress(OSError):
+                os.chmod(parent, mode)
+
+
+def repair_rootfs(rootfs_dir, hash_mode='none', restore_modified=False, progress=None):
+    """
+    Restore the damaged entries of an extracted rootfs from the tarball it came from.
+
+    The rootfs is checked against its manifest; only missing entries and
+    modified ones are re-extracted, from the cached tarball whose sha256 the
+    manifest records. Modified files under REPAIR_KEEP_MODIFIED are the
+    instance's own state (passwords, shell startup files, package database)
+    and are left alone unless restore_modified is set. The repaired entries
+    are checked again, contents included.
+
+    Args:
+        rootfs_dir: Directory the tarball was extracted into.
+        hash_mode: How the rootfs is checked first: 'none', 'sample' or 'full'.
+        restore_modified: Also restore modified files under REPAIR_KEEP_MODIFIED.
+        progress: Optional ProgressBar advanced by the archive bytes read.
+
+    Returns:
+        dict: 'damaged' (paths restored), 'remaining' (paths still damaged),
+        'rootfs' (root of the rootfs), 'seconds'; None if there is no
+        manifest or the tarball is no longer cached.
+    """
+    started = time.monotonic()
+    manifest = load_manifest(rootfs_dir)
+    if manifest is None:
+        return None
+    top = manifest.top_level()
+    result = {'damaged': [], 'remaining': [], 'rootfs': os.path.join(rootfs_dir, top) if top else rootfs_dir}
+    damaged = _damaged_paths(verify_rootfs(rootfs_dir, manifest, hash_mode), restore_modified)
+    if damaged:
+        source = find_repair_source(manifest.source_sha256)
+        if source is None:
+            get_logger().info(f"Cannot repair {rootfs_dir}: tarball {manifest.source_sha256} is not cached")
+            return None
+        path, mode = source
+        wanted = set(damaged)
+        _clear(rootfs_dir, manifest, damaged)
+        with _writable_parents(rootfs_dir, damaged):
+            if mode == 'index':
+                extract_members(get_cache(), manifest.source_sha256, damaged, rootfs_dir)
+            else:
+                # Random access needs the real file object, without a progress wrapper
+                extract_tar_stream(path, rootfs_dir, mode=mode, progress=progress if mode.startswith('r|') else None,
+                                   exclude=lambda m: is_excluded_member(m) or member_path(m.name) not in wanted)
+        check = verify_rootfs(rootfs_dir, manifest.subset(damaged), hash_mode='full')
+        result['damaged'] = damaged
+        result['remaining'] = sorted(check['missing'] + check['modified'] + check['state'])
+        if os.path.join(top, 'etc', 'resolv.conf') in wanted:
+            set_resolv_conf(result['rootfs'])
+        get_logger().info(f"Repaired {len(damaged) - len(result['remaining'])} of {len(damaged)} damaged "
+                          f"entries of {rootfs_dir} from {path}")
+    result['seconds'] = time.monotonic() - started
+    return result
@@ -0,0 +1,375 @@
+"""
+Seekable rootfs archives for LCSX.
+Indexes the members of cached .tar.xz blobs by xz block, so single files are extracted without decoding the whole archive.
+"""
+
+import bisect
+import contextlib
+import fcntl
+import lzma
+import os
+import struct
+import sys
+import tarfile
+import threading
+from array import array
+from collections import deque
+from lcsx.config.catalog import get_pinned_sha256
+from lcsx.config.constants import SEEK_BLOCK_SIZE, SEEK_MAX_BLOCK, SEEK_PRESET
+from lcsx.core.cache import get_cache
+from lcsx.core.extract import extract_tar_stream, is_excluded_member, member_path
+from lcsx.core.logger import get_logger
+from lcsx.core.xz import ParallelXZReader, XZBlockWriter, XZFormatError, list_blocks, read_block
+
+SEEK_INDEX_MAGIC = b'LCSXSI1\n'
+# block count, member count, size of the path blob, size of the indexed archive, 1 if it is a re-chunked copy
+SEEK_INDEX_HEADER = struct.Struct('<IIIQB')
+END_OF_ARCHIVE = bytes(2 * tarfile.BLOCKSIZE)
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _write_columns(f, columns):
+    for column in columns:
+        if sys.byteorder == 'big':
+            column = array(column.typecode, column)
+            column.byteswap()
+        column.tofile(f)
+
+
+def _read_columns(data, offset, typecodes, count):
+    columns = []
+    for typecode in typecodes:
+        column = array(typecode)
+        end = offset + count * column.itemsize
+        column.frombytes(data[offset:end])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        offset = end
+    return columns, offset
+
+
+class SeekIndex:
+    """
+    Location of every member of a .tar.xz archive, sorted by path.
+
+    A member is found by path, its tar headers and data by uncompressed
+    offset, and the xz block holding that offset by bisecting the block
+    starts; only the blocks a member spans are decoded to extract it.
+
+    On disk (little-endian):
+        magic, block count, member count, path blob size, archive size, re-chunked flag
+        streams  uint64[blocks]   offset of the stream header of each block
+        offsets  uint64[blocks]   offset of each block in the archive
+        sizes    uint64[blocks]   size of each block, padding and check included
+        starts   uint64[blocks]   uncompressed offset of each block
+        members  uint64[members]  uncompressed offset of the first tar header of each member
+        spans    uint64[members]  bytes of headers, data and padding of each member
+        ends     uint32[members]  end of each path in the blob
+        blob     member paths (as manifests store them) concatenated
+    """
+
+    def __init__(self, blocks=(), members=(), archive_size=0, rechunked=False):
+        blocks = list(blocks)
+        members = sorted(members)
+        self.streams = array('Q', [block[0] for block in blocks])
+        self.offsets = array('Q', [block[1] for block in blocks])
+        self.sizes = array('Q', [block[2] for block in blocks])
+        self.starts = array('Q', [block[3] for block in blocks])
+        self.paths = [member[0] for member in members]
+        self.members = array('Q', [member[1] for member in members])
+        self.spans = array('Q', [member[2] for member in members])
+        self.archive_size = archive_size
+        self.rechunked = rechunked
+
+    def __len__(self):
+        return len(self.paths)
+
+    def find(self, path):
+        """(uncompressed offset, span) of the member at a relative path, or None."""
+        index = bisect.bisect_left(self.paths, path)
+        if index < len(self.paths) and self.paths[index] == path:
+            return self.members[index], self.spans[index]
+        return None
+
+    def block_at(self, offset):
+        """Index of the block holding an uncompressed offset."""
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def write(self, path):
+        """Write the index atomically to path."""
+        ends = array('I')
+        encoded = [os.fsencode(p) for p in self.paths]
+        blob = b''.join(encoded)
+        end = 0
+        for item in encoded:
+            end += len(item)
+            ends.append(end)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(SEEK_INDEX_MAGIC + SEEK_INDEX_HEADER.pack(len(self.starts), len(self.paths), len(blob),
+                                                              self.archive_size, int(self.rechunked)))
+            _write_columns(f, [self.streams, self.offsets, self.sizes, self.starts, self.members, self.spans, ends])
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index file.
+
+        Raises:
+            ValueError: If the file is not a member index or is truncated.
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(SEEK_INDEX_MAGIC) or len(data) < len(SEEK_INDEX_MAGIC) + SEEK_INDEX_HEADER.size:
+            raise ValueError(f"Not a member index: {path}")
+        blocks, count, blob_size, archive_size, rechunked = SEEK_INDEX_HEADER.unpack_from(data, len(SEEK_INDEX_MAGIC))
+        offset = len(SEEK_INDEX_MAGIC) + SEEK_INDEX_HEADER.size
+        block_columns, offset = _read_columns(data, offset, 'QQQQ', blocks)
+        member_columns, offset = _read_columns(data, offset, 'QQI', count)
+        blob = data[offset:offset + blob_size]
+        if len(blob) != blob_size or len(member_columns[2]) != count:
+            raise ValueError(f"Truncated member index: {path}")
+        index = cls(archive_size=archive_size, rechunked=bool(rechunked))
+        index.streams, index.offsets, index.sizes, index.starts = block_columns
+        index.members, index.spans, ends = member_columns
+        start = 0
+        for end in ends:
+            index.paths.append(os.fsdecode(blob[start:end]))
+            start = end
+        return index
+
+
+class _TeeReader:
+    """File wrapper handing every chunk read to a callback as well."""
+
+    def __init__(self, fileobj, callback):
+        self._fileobj = fileobj
+        self._callback = callback
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        if data:
+            self._callback(data)
+        return data
+
+
+def _scan_members(fileobj):
+    """
+    Walk the tar headers of an uncompressed stream.
+
+    Returns:
+        list: (path, uncompressed offset, span) per member; the last copy of a path wins.
+    """
+    members = {}
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        while True:
+            member = tar.next()
+            if member is None:
+                break
+            tar.members = []
+            # After next(), tar.offset is the end of the member's data and padding
+            members[member_path(member.name)] = (member.offset, tar.offset - member.offset)
+    return [(path, offset, span) for path, (offset, span) in members.items()]
+
+
+def build_seek_index(cache, digest, threads=None):
+    """
+    Build the member index of a cached .tar.xz blob in the foreground.
+
+    The archive is decoded once while its tar headers are read. A blob made
+    of blocks of at most SEEK_MAX_BLOCK uncompressed bytes (xz -T with a
+    small --block-size, pixz) is indexed in place. Anything else, single-block
+    output of plain xz in particular, is re-chunked during the same pass into
+    a copy of SEEK_BLOCK_SIZE blocks kept next to the blob, so extracting one
+    file decodes at most a block more than the file itself. A host-wide lock
+    per blob keeps concurrent lcsx processes from doing the same work twice.
+
+    Returns:
+        str: Path of the index, or None if another process is building it or
+        the blob is no longer cached.
+
+    Raises:
+        XZFormatError: If the blob is not a seekable .xz file.
+    """
+    existing = cache.lookup_seek_index(digest)
+    if existing is not None:
+        return existing[0]
+    blob = cache.blob_path(digest)
+    lock_path = os.path.join(cache.tmp_dir, f"{digest}.index.lock")
+    index_path = os.path.join(cache.tmp_dir, f"{digest}.idx")
+    data_path = os.path.join(cache.tmp_dir, f"{digest}.seek")
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            get_logger().info(f"Blob {digest} is already being indexed by another process")
+            return None
+        try:
+            with open(blob, 'rb') as source:
+                blocks = list_blocks(source)
+                source.seek(0)
+                in_place = all(block[4] <= SEEK_MAX_BLOCK for block in blocks)
+                with ParallelXZReader(source, threads=threads) as reader:
+                    if in_place:
+                        members = _scan_members(reader)
+                        archive_size = os.path.getsize(blob)
+                    else:
+                        with open(data_path, 'wb') as out:
+                            with XZBlockWriter(out, SEEK_BLOCK_SIZE, SEEK_PRESET, threads) as writer:
+                                members = _scan_members(_TeeReader(reader, writer.write))
+                                # End-of-archive marker and whatever follows it
+                                while True:
+                                    chunk = reader.read(COPY_CHUNK_SIZE)
+                                    if not chunk:
+                                        break
+                                    writer.write(chunk)
+                            archive_size = out.tell()
+                        blocks = writer.blocks
+            SeekIndex(blocks, members, archive_size, rechunked=not in_place).write(index_path)
+            get_logger().info(f"Indexed {len(members)} members of {digest} in {len(blocks)} blocks"
+                              f"{'' if in_place else ' (re-chunked)'}")
+            return cache.store_seek_index(digest, index_path, None if in_place else data_path)
+        finally:
+            for path in (index_path, data_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_seek_index(cache, digest):
+    """
+    Return the member index of a cached blob.
+
+    Returns:
+        tuple: (SeekIndex, path of the archive it indexes), or None if there
+        is no usable index.
+    """
+    found = cache.lookup_seek_index(digest)
+    if found is None:
+        return None
+    path, archive = found
+    try:
+        index = SeekIndex.load(path)
+    except ValueError as e:
+        get_logger().warning(str(e))
+        return None
+    if index.archive_size != os.path.getsize(archive):
+        return None
+    return index, archive
+
+
+class _MemberReader:
+    """
+    Readable tar stream holding only some members of an indexed archive.
+
+    Member spans are read in archive order and each block is decoded at most
+    once; an end-of-archive marker follows the last member.
+    """
+
+    def __init__(self, fileobj, index, spans):
+        self._fileobj = fileobj
+        self._index = index
+        self._spans = deque(sorted(spans))
+        self._offset = 0
+        self._remaining = 0
+        self._block = None
+        self._data = b''
+        self._trailer = END_OF_ARCHIVE
+
+    def _load(self, block):
+        if block != self._block:
+            index = self._index
+            self._data = read_block(self._fileobj, index.streams[block], index.offsets[block], index.sizes[block])
+            self._block = block
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize
+        while not self._remaining:
+            if not self._spans:
+                data = self._trailer[:size]
+                self._trailer = self._trailer[len(data):]
+                return data
+            self._offset, self._remaining = self._spans.popleft()
+        block = self._index.block_at(self._offset)
+        self._load(block)
+        start = self._offset - self._index.starts[block]
+        data = self._data[start:start + min(size, self._remaining)]
+        if not data:
+            raise XZFormatError("Member index does not match the archive")
+        self._offset += len(data)
+        self._remaining -= len(data)
+        return data
+
+
+def extract_members(cache, digest, paths, dest_dir, exclude=is_excluded_member):
+    """
+    Extract some members of a cached .tar.xz blob through its member index.
+
+    Only the blocks holding those members are read and decoded, so the work
+    is proportional to the size of the members rather than of the archive.
+    A directory member is extracted on its own, without its contents.
+
+    Args:
+        cache: ArtifactCache holding the blob.
+        digest: sha256 of the blob.
+        paths: Member paths relative to the archive root, as manifests store them.
+        dest_dir: Directory to extract into.
+        exclude: Predicate returning True for members to skip.
+
+    Returns:
+        tuple: (number of members extracted, paths not in the archive), or
+        None if the blob has no usable index.
+    """
+    found = load_seek_index(cache, digest)
+    if found is None:
+        return None
+    index, archive = found
+    spans = []
+    unknown = []
+    for path in paths:
+        location = index.find(member_path(path))
+        if location is None:
+            unknown.append(path)
+        else:
+            spans.append(location)
+    with open(archive, 'rb') as f:
+        count = extract_tar_stream(_MemberReader(f, index, set(spans)), dest_dir, mode='r|', exclude=exclude)
+    return count, unknown
+
+
+def schedule_seek_index(url):
+    """
+    Start building the member index of the cached rootfs for url in a background thread.
+
+    Does nothing when the cache is disabled, indexing is off, the URL is not
+    cached or already indexed. The thread is a daemon, like the transcoding
+    one: a partial index is discarded if lcsx exits first.
+
+    Returns:
+        threading.Thread, or None if nothing was started.
+    """
+    cache = get_cache()
+    if cache is None or not cache.seek_index:
+        return None
+    blob = cache.lookup(url, sha256=get_pinned_sha256(url))
+    if blob is None:
+        return None
+    digest = os.path.basename(blob)
+    if cache.lookup_seek_index(digest) is not None:
+        return None
+
+    def run():
+        try:
+            if build_seek_index(cache, digest, threads=1):
+                get_logger().info(f"Indexed cached rootfs {url}")
+        except (OSError, tarfile.TarError, lzma.LZMAError) as e:
+            get_logger().warning(f"Indexing cached rootfs {url} failed: {e}")
+
+    thread = threading.Thread(target=run, name='lcsx-seek-index', daemon=True)
+    thread.start()
+    get_logger().info(f"Indexing cached rootfs {url} in the background")
+    return thread
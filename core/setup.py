@@ -4,18 +4,41 @@ Handles initial environment setup inside proot.
 """
 
 import os
+import re
 import shutil
+import subprocess
 import urllib.request
 import urllib.error
+import http.client
 import tarfile
+import lzma
 import sys
-import time
 import tempfile
-from lcsx.core.proot import run_proot_command, setup_proot_binary
+import time
+from lcsx.core.proot import build_proot_command, setup_proot_binary
 from lcsx.core.resolv import set_resolv_conf
-from lcsx.ui.logger import print_main as print_normal, print_error, print_warning, download_progress
-from lcsx.config.constants import MAX_DOWNLOAD_RETRIES, RETRY_DELAY
+from lcsx.ui.logger import print_main as print_normal, print_error, print_warning
+from lcsx.ui.progress import ProgressBar
 from lcsx.core.validation import check_disk_space
+from lcsx.core.extract import extract_archive
+from lcsx.core.transcode import find_fast_copy, schedule_transcode
+from lcsx.core.templates import get_template_store, get_clone_method, nearest_existing_dir, reflink_supported
+from lcsx.core.layers import base_root, create_layer, get_base_store, get_rootfs_layout, is_layer
+from lcsx.core.manifest import manifest_path, record_manifest
+from lcsx.core.repair import repair_rootfs
+from lcsx.core.seekable import schedule_seek_index
+from lcsx.core.cache import fetch_artifact, open_artifact_stream, get_cache
+from lcsx.core.download import is_stream_extract_enabled, get_download_manager, rank_sources, IntegrityError
+from lcsx.core.orchestrator import SetupScheduler
+from lcsx.core.gotty import setup_gotty
+from lcsx.core.sshx import setup_sshx
+from lcsx.config.catalog import get_pinned_sha256
+from lcsx.config.constants import ALPINE_PACKAGES_BASE_URL, ALPINE_PACKAGES_BRANCH, ALPINE_APK_TOOLS_STATIC
+
+# apk prints "(3/20) Installing musl (1.1.20-r6)" for each package
+APK_STEP_PATTERN = re.compile(r'^\((\d+)/(\d+)\) ')
+# Free space an extracted rootfs needs (tarballs are 100-500MB compressed, 1-3GB extracted)
+ROOTFS_REQUIRED_SPACE = 1 * 1024 * 1024 * 1024  # 1 GB
 
 def is_rootfs_valid(rootfs_path, shell='/bin/bash'):
     """Check if the rootfs is valid by checking for the specified shell."""
@@ -29,25 +52,18 @@ def install_alpine_packages(rootfs_path, proot_bin, data_dir):
 
     print_normal("Installing Alpine base packages...")
     temp_dir = tempfile.mkdtemp()
-    apk_url = "https://dl-cdn.alpinelinux.org/alpine/v3.9/main/x86_64/apk-tools-static-2.10.6-r0.apk"
+    repo_path = f"/{ALPINE_PACKAGES_BRANCH}/main/"
+    apk_tail = f"{repo_path}x86_64/{ALPINE_APK_TOOLS_STATIC}"
+    apk_url = ALPINE_PACKAGES_BASE_URL + apk_tail
     apk_path = os.path.join(temp_dir, 'apk-tools-static.apk')
 
-    # Download apk-tools-static
-    for attempt in range(MAX_DOWNLOAD_RETRIES):
-        try:
-            urllib.request.urlretrieve(apk_url, apk_path, reporthook=download_progress)
-            break
-        except (urllib.error.URLError, urllib.error.HTTPError, OSError) as e:
-            if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                print_error(f"Download failed (attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}): {e}")
-                print_normal(f"Retrying in {RETRY_DELAY} seconds...")
-                if os.path.exists(apk_path):
-                    os.remove(apk_path)
-                time.sleep(RETRY_DELAY)
-            else:
-                print_error(f"Failed to download apk-tools-static after {MAX_DOWNLOAD_RETRIES} attempts: {e}")
-                shutil.rmtree(temp_dir)
-                raise
+    # Download apk-tools-static (retried by the download manager)
+    try:
+        with ProgressBar("Downloading apk-tools-static") as progress:
+            fetch_artifact(apk_url, apk_path, reporthook=progress.reporthook, description='apk-tools-static')
+    except (urllib.error.URLError, http.client.HTTPException, OSError):
+        shutil.rmtree(temp_dir)
+        raise
 
     # Extract apk-tools-static
     try:
@@ -64,12 +80,29 @@ def install_alpine_packages(rootfs_path, proot_bin, data_dir):
     os.makedirs(os.path.dirname(apk_static_dest), exist_ok=True)
     shutil.copy2(apk_static_src, apk_static_dest)
 
+    # Point apk at the fastest HTTP mirror of the repository (probe results are cached)
+    repo_url = ALPINE_PACKAGES_BASE_URL + repo_path
+    for source in rank_sources(apk_url):
+        if source.startswith(('http://', 'https://')) and source.endswith(apk_tail):
+            repo_url = source[:-len(apk_tail)] + repo_path
+            break
+
     # Run apk.static inside proot to install packages
-    apk_command = ['/tmp/apk.static', '-X', 'https://dl-cdn.alpinelinux.org/alpine/v3.9/main/', '-U', '--allow-untrusted', '--root', '/', 'add', 'alpine-base', 'apk-tools']
+    apk_command = ['/tmp/apk.static', '-X', repo_url, '-U', '--allow-untrusted', '--root', '/', 'add', 'alpine-base', 'apk-tools']
     try:
-        proc = run_proot_command(data_dir, rootfs_path, apk_command, proot_bin=proot_bin, capture_output=True)
+        output = []
+        with ProgressBar("Installing packages", unit='packages') as progress:
+            proc = subprocess.Popen(build_proot_command(data_dir, rootfs_path, apk_command, proot_bin),
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            for line in proc.stdout:
+                output.append(line)
+                step = APK_STEP_PATTERN.match(line)
+                if step:
+                    progress.set_total(int(step.group(2)))
+                    progress.set(int(step.group(1)))
+            proc.wait()
         if proc.returncode != 0:
-            print_error(f"Failed to install Alpine packages: {proc.stderr}")
+            print_error(f"Failed to install Alpine packages: {''.join(output[-20:])}")
             shutil.rmtree(temp_dir)
             raise Exception(f"apk.static failed with return code {proc.returncode}")
         else:
@@ -86,54 +119,208 @@ def install_alpine_packages(rootfs_path, proot_bin, data_dir):
     # Cleanup
     shutil.rmtree(temp_dir)
 
-def download_and_extract(url, dest_dir):
-    """Download and extract the rootfs tar.xz, return the rootfs path."""
-    os.makedirs(dest_dir, exist_ok=True)
-    tar_path = os.path.join(dest_dir, 'rootfs.tar.xz')
-    
-    # Estimate required space (typically rootfs is 100-500MB compressed, 1-3GB extracted)
-    # We'll check for at least 1GB to be safe
-    required_space = 1 * 1024 * 1024 * 1024  # 1 GB
-    has_space, available, error_msg = check_disk_space(dest_dir, required_space)
-    if not has_space:
-        print_warning(error_msg)
-        print_warning("Proceeding anyway, but download may fail if space is insufficient.")
-    else:
-        print_normal(f"Disk space check passed. Available: {available / (1024**3):.2f} GB")
-    
-    print_normal("Downloading rootfs...")
-    # Retry logic for downloads
-    for attempt in range(MAX_DOWNLOAD_RETRIES):
-        try:
-            urllib.request.urlretrieve(url, tar_path, reporthook=download_progress)
-            break
-        except (urllib.error.URLError, urllib.error.HTTPError, OSError) as e:
-            if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                print_error(f"Download failed (attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}): {e}")
-                print_normal(f"Retrying in {RETRY_DELAY} seconds...")
-                if os.path.exists(tar_path):
-                    os.remove(tar_path)
-                time.sleep(RETRY_DELAY)
-            else:
-                print_error(f"Failed to download rootfs after {MAX_DOWNLOAD_RETRIES} attempts: {e}")
-                if os.path.exists(tar_path):
-                    os.remove(tar_path)
-                raise
-    print_normal("Extracting rootfs...")
+def clear_directory(path):
+    """Remove everything inside path, keeping path itself."""
+    for item in os.listdir(path):
+        item_path = os.path.join(path, item)
+        if os.path.isdir(item_path) and not os.path.islink(item_path):
+            shutil.rmtree(item_path)
+        else:
+            os.remove(item_path)
+
+def stream_and_extract(url, dest_dir):
+    """
+    Extract the rootfs while it downloads, without a temporary tarball.
+
+    The response body feeds the xz decompressor and tar reader directly; the
+    bytes are kept only as a cache blob when the artifact cache is enabled.
+    The body is hashed on the way through, and a checksum mismatch discards
+    everything that was extracted.
+
+    Returns:
+        bool: True on success, False if the transfer failed and dest_dir was
+        emptied so the caller can fall back to download-then-extract.
+    """
+    print_normal("Downloading and extracting rootfs...")
     try:
-        with tarfile.open(tar_path, 'r:xz') as tar:
-            # Extract all except dev/* and device files
-            for member in tar.getmembers():
-                if not member.name.startswith('dev/') and not member.isdev():
-                    try:
-                        tar.extract(member, dest_dir)
-                    except PermissionError as e:
-                        print_error(f"Permission denied, skipping file: {member.name}")
+        with ProgressBar("Downloading and extracting rootfs") as progress, \
+                open_artifact_stream(url, segmented=True) as stream:
+            # Progress follows the archive bytes consumed, whether they come from the network or the cache
+            progress.set_total(stream.total if hasattr(stream, 'total') else os.fstat(stream.fileno()).st_size)
+            extract_archive(stream, dest_dir, progress=progress)
+    except IntegrityError as e:
+        print_error(f"Rootfs failed verification: {e}")
+        clear_directory(dest_dir)
+        raise
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+        print_warning(f"Streaming extraction failed: {e}")
+        print_warning("Falling back to download-then-extract.")
+        clear_directory(dest_dir)
+        return False
     except Exception as e:
         print_error(f"Error extracting rootfs: {e}")
         raise Exception("Extraction failed")
-    os.remove(tar_path)
+    return True
+
+def extract_fast_copy(url, dest_dir):
+    """
+    Extract the rootfs from the artifact cache's fast copy (zstd or plain tar), if it has one.
+
+    Returns:
+        bool: True on success, False if there is no usable copy or it failed
+        and dest_dir was emptied.
+    """
+    fast = find_fast_copy(url)
+    if fast is None:
+        return False
+    print_normal("Extracting rootfs from the cached fast copy...")
+    try:
+        with ProgressBar("Extracting rootfs") as progress:
+            extract_archive(fast[0], dest_dir, mode=fast[1], progress=progress)
+    except (OSError, tarfile.TarError) as e:
+        print_warning(f"Extracting the cached fast copy failed: {e}")
+        clear_directory(dest_dir)
+        return False
+    return True
+
+def extract_rootfs(url, dest_dir):
+    """Extract the rootfs tarball for url into dest_dir: from the cached fast copy, while downloading, or after it."""
+    tar_path = os.path.join(dest_dir, 'rootfs.tar.xz')
+    from_fast_copy = extract_fast_copy(url, dest_dir)
+    if not from_fast_copy and not (is_stream_extract_enabled() and stream_and_extract(url, dest_dir)):
+        print_normal("Downloading rootfs...")
+        # Retried (and resumed) by the download manager
+        with ProgressBar("Downloading rootfs") as progress:
+            fetch_artifact(url, tar_path, reporthook=progress.reporthook, segmented=True, description='rootfs')
+        print_normal("Extracting rootfs...")
+        try:
+            # Single streaming pass; dev/* and device files are skipped inline
+            with ProgressBar("Extracting rootfs") as progress:
+                extract_archive(tar_path, dest_dir, progress=progress)
+        except Exception as e:
+            print_error(f"Error extracting rootfs: {e}")
+            raise Exception("Extraction failed")
+        os.remove(tar_path)
+    if not from_fast_copy:
+        # Later setups of this rootfs extract from a zstd or plain tar copy
+        schedule_transcode(url)
+    # Repairs and single-file extraction decode only the blocks they need
+    schedule_seek_index(url)
+
+def rootfs_digest(url):
+    """sha256 of the rootfs tarball: the pinned value, else that of the cached copy (None if unknown)."""
+    pinned = get_pinned_sha256(url)
+    if pinned:
+        return pinned
+    cache = get_cache()
+    blob = cache.lookup_current(url) if cache is not None else None
+    return os.path.basename(blob) if blob else None
+
+def template_clone_plan(dest_dir):
+    """
+    Decide whether the rootfs in dest_dir comes from a template.
+
+    Returns:
+        tuple: (template store, clone method), or None to extract directly:
+        templates are off, or 'auto' is set and dest_dir cannot be reflinked
+        from the store, where a template would only double what setup writes.
+    """
+    store = get_template_store()
+    if store is None:
+        return None
+    method = get_clone_method()
+    if method == 'auto':
+        if not reflink_supported(store.template_dir, dest_dir):
+            print_normal("No reflink support between the template store and the data directory; "
+                         "extracting without a template (use --rootfs-clone copy to keep one anyway).")
+            return None
+        method = 'reflink'
+    return store, method
+
+def required_space(url, dest_dir, plan):
+    """
+    Return [(directory, bytes), ...]: free space setting up the rootfs for url needs, per filesystem.
+
+    Extracting into dest_dir needs ROOTFS_REQUIRED_SPACE there. With a
+    template, building it (when it does not exist yet) needs that much in
+    the store, and a copied clone needs it again in dest_dir; reflinked and
+    hard linked clones share the template's data.
+    """
+    needs = {dest_dir: ROOTFS_REQUIRED_SPACE if plan is None or plan[1] == 'copy' else 0}
+    if plan is not None and plan[0].lookup(url, rootfs_digest(url)) is None:
+        template_dir = nearest_existing_dir(plan[0].template_dir)
+        needs[template_dir] = needs.get(template_dir, 0) + ROOTFS_REQUIRED_SPACE
+    # Directories on one filesystem share its free space
+    by_device = {}
+    for path, need in needs.items():
+        device = os.stat(path).st_dev
+        first, total = by_device.get(device, (path, 0))
+        by_device[device] = (first, total + need)
+    return list(by_device.values())
+
+def clone_rootfs_template(url, dest_dir, plan):
+    """
+    Materialize the rootfs in dest_dir from the template store, building the template on first use.
+
+    Args:
+        plan: (store, clone method) from template_clone_plan, or None.
+
+    Returns:
+        bool: True on success, False if there is no plan or cloning failed
+        and dest_dir was emptied.
+    """
+    if plan is None:
+        return False
+    store, clone_method = plan
+    digest = rootfs_digest(url)
+    if store.lookup(url, digest) is None:
+        print_normal("Building rootfs template (once per distribution release)...")
+
+        def build(template_dir):
+            extract_rootfs(url, template_dir)
+            sha256 = rootfs_digest(url)
+            record_manifest(template_dir, source_sha256=sha256)
+            return sha256
+
+        store.build(url, digest, build)
+    started = time.monotonic()
+    try:
+        method = store.clone(url, dest_dir, clone_method)
+    except OSError as e:
+        print_warning(f"Cloning the rootfs template failed: {e}")
+        os.makedirs(dest_dir, exist_ok=True)
+        clear_directory(dest_dir)
+        return False
+    # Clones keep sizes, modes and mtimes, so the template's manifest describes them too
+    template_rootfs = store.lookup(url)
+    if template_rootfs and os.path.exists(manifest_path(template_rootfs)):
+        shutil.copyfile(manifest_path(template_rootfs), manifest_path(dest_dir))
+    print_normal(f"Rootfs cloned from template ({method}) in {time.monotonic() - started:.1f}s.")
+    return True
+
+def download_and_extract(url, dest_dir):
+    """Download and extract the rootfs tar.xz (or clone its template), return the rootfs path."""
+    os.makedirs(dest_dir, exist_ok=True)
+    plan = template_clone_plan(dest_dir)
+
+    # Space for the rootfs, and for its template when one is built first
+    for path, required in required_space(url, dest_dir, plan):
+        has_space, available, error_msg = check_disk_space(path, required)
+        if not has_space:
+            print_warning(f"{error_msg} ({path})")
+            print_warning("Proceeding anyway, but download may fail if space is insufficient.")
+        else:
+            print_normal(f"Disk space check passed. Available: {available / (1024**3):.2f} GB")
+
+    if os.path.exists(manifest_path(dest_dir)):
+        os.remove(manifest_path(dest_dir))
+    if not clone_rootfs_template(url, dest_dir, plan):
+        extract_rootfs(url, dest_dir)
     print_normal("Extraction complete.")
+    if not os.path.exists(manifest_path(dest_dir)):
+        # Before resolv.conf and the prompt are written, so the manifest describes the tarball
+        print_normal("Recording rootfs manifest...")
+        record_manifest(dest_dir, source_sha256=rootfs_digest(url))
     # Check for subdirectory
     extracted_items = os.listdir(dest_dir)
     if len(extracted_items) == 1 and os.path.isdir(os.path.join(dest_dir, extracted_items[0])):
@@ -144,14 +331,30 @@ def download_and_extract(url, dest_dir):
     set_resolv_conf(rootfs_path)
     return rootfs_path
 
-def setup_environment(config):
-    """Set up the proot environment: download rootfs."""
-    distro_url = config['distro_url']
-    proot_bin = config['proot_bin']
-    data_dir = config['data_dir']
-    shell = config.get('shell', '/bin/bash')
+def repair_damaged_rootfs(base_dir, shell='/bin/bash'):
+    """
+    Repair a rootfs in place from its cached tarball.
+
+    Returns:
+        str: The rootfs path if it is valid afterwards, else None.
+    """
+    try:
+        with ProgressBar("Repairing rootfs") as progress:
+            result = repair_rootfs(base_dir, progress=progress)
+    except (OSError, tarfile.TarError, lzma.LZMAError) as e:
+        print_warning(f"Rootfs repair failed: {e}")
+        return None
+    if result is None:
+        print_normal("No manifest or cached tarball to repair the rootfs from.")
+        return None
+    if result['remaining'] or not is_rootfs_valid(result['rootfs'], shell):
+        print_warning(f"Rootfs repair left {len(result['remaining'])} entries damaged.")
+        return None
+    print_normal(f"Repaired {len(result['damaged'])} damaged entries in {result['seconds']:.1f}s.")
+    return result['rootfs']
 
-    # Download and extract rootfs if not exists or invalid
+def prepare_rootfs(distro_url, data_dir, shell='/bin/bash'):
+    """Return the rootfs path, downloading and extracting it if missing or invalid."""
     base_dir = os.path.join(data_dir, 'rootfs')
     rootfs = base_dir
     if os.path.exists(base_dir):
@@ -160,24 +363,74 @@ def setup_environment(config):
         if len(extracted_items) == 1 and os.path.isdir(os.path.join(base_dir, extracted_items[0])):
             rootfs = os.path.join(base_dir, extracted_items[0])
         if not is_rootfs_valid(rootfs, shell):
-            print_normal("Rootfs invalid, re-downloading...")
-            shutil.rmtree(base_dir)
-            rootfs = download_and_extract(distro_url, base_dir)
+            print_normal("Rootfs invalid, repairing...")
+            repaired = repair_damaged_rootfs(base_dir, shell)
+            if repaired:
+                rootfs = repaired
+            else:
+                print_normal("Rootfs invalid, re-downloading...")
+                shutil.rmtree(base_dir)
+                rootfs = download_and_extract(distro_url, base_dir)
     else:
         rootfs = download_and_extract(distro_url, base_dir)
+    return rootfs
 
-    config['rootfs'] = rootfs
+def prepare_layered_rootfs(distro_url, data_dir, shell='/bin/bash', prepare=None):
+    """
+    Return (layer, base rootfs) for a layered instance, building the shared base on first use.
 
-    # Ensure proot binary is set up
-    setup_proot_binary(data_dir, proot_bin)
+    Args:
+        distro_url: Rootfs tarball URL.
+        data_dir: Data directory; the writable layer goes in its rootfs/. An existing
+            layer there is kept; an existing full rootfs is moved aside, never deleted.
+        shell: Shell the base must provide.
+        prepare: Optional callable given the base rootfs before it is sealed.
+    """
+    store = get_base_store()
+    digest = rootfs_digest(distro_url)
+    version_dir = store.current(distro_url, digest)
+    if version_dir is None:
+        print_normal("Building shared base rootfs (once per distribution release)...")
+        version_dir = store.build(distro_url, digest,
+                                  lambda rootfs_dir: extract_rootfs(distro_url, rootfs_dir) or rootfs_digest(distro_url),
+                                  prepare=prepare)
+    base = base_root(version_dir)
+    if not is_rootfs_valid(base, shell):
+        raise Exception(f"Base rootfs {version_dir} has no {shell}")
+    layer_dir = os.path.join(data_dir, 'rootfs')
+    if os.path.lexists(layer_dir) and not is_layer(layer_dir):
+        # e.g. a copy-mode instance switched to --rootfs-layout layered; it may hold the user's files
+        aside = f"{layer_dir}.pre-layered.{time.strftime('%Y%m%d-%H%M%S')}"
+        os.replace(layer_dir, aside)
+        if os.path.exists(manifest_path(layer_dir)):
+            os.replace(manifest_path(layer_dir), manifest_path(aside))
+        print_warning(f"{layer_dir} held a full rootfs; moved it to {aside}. "
+                      f"Copy what you need from it into the new instance, then delete it.")
+    if os.path.isdir(layer_dir):
+        print_normal("Keeping the existing writable layer.")
+    else:
+        create_layer(base, layer_dir)
+    # Keeps `lcsx base remove` from deleting the version under this instance
+    store.register(version_dir, data_dir)
+    print_normal(f"Using shared base {os.path.relpath(version_dir, store.base_dir)} with a writable layer.")
+    set_resolv_conf(layer_dir)
+    return layer_dir, base
 
-    # Install Alpine packages if Alpine distro
-    if 'alpine' in distro_url.lower():
-        install_alpine_packages(rootfs, proot_bin, data_dir)
+def setup_terminal_binary(config):
+    """Fetch the binary for the configured terminal service and record its path."""
+    terminal_service = config.get('terminal_service')
+    data_dir = config['data_dir']
+    if terminal_service == 'sshx' and not config.get('sshx_path'):
+        print_normal("Setting up sshx...")
+        config['sshx_path'] = setup_sshx(data_dir)
+        print_normal("sshx setup complete.")
+    elif terminal_service == 'gotty' and not config.get('gotty_path'):
+        print_normal("Setting up gotty...")
+        config['gotty_path'] = setup_gotty(data_dir)
+        print_normal("Gotty setup complete.")
 
-    # Set permanent prompt based on shell
-    user = config['user']
-    hostname = config['hostname']
+def set_shell_prompt(rootfs, user, hostname, shell):
+    """Append a permanent PS1 to the root shell startup file."""
     if shell == '/bin/bash':
         bashrc_path = os.path.join(rootfs, 'root', '.bashrc')
         try:
@@ -193,6 +446,50 @@ def setup_environment(config):
         except (OSError, PermissionError) as e:
             print_normal(f"Warning: Could not update .profile: {e}")
 
+def setup_environment(config):
+    """
+    Set up the proot environment.
+
+    The rootfs, proot binary and terminal service binary do not depend on
+    each other and are fetched concurrently, with the rootfs (the critical
+    path) started first. Alpine packages and the shell prompt wait for the
+    pieces they need.
+    """
+    distro_url = config['distro_url']
+    proot_bin = config['proot_bin']
+    data_dir = config['data_dir']
+    shell = config.get('shell', '/bin/bash')
+
+    is_alpine = 'alpine' in distro_url.lower()
+    layered = get_rootfs_layout() == 'layered'
+
+    def rootfs_phase():
+        if layered:
+            # Alpine packages go into the base before it is sealed
+            prepare = (lambda base: install_alpine_packages(base, proot_bin, data_dir)) if is_alpine else None
+            config['rootfs'], config['rootfs_base'] = prepare_layered_rootfs(distro_url, data_dir, shell, prepare)
+        else:
+            config['rootfs'] = prepare_rootfs(distro_url, data_dir, shell)
+            config.pop('rootfs_base', None)
+
+    scheduler = SetupScheduler()
+    scheduler.add_phase('rootfs', rootfs_phase, priority=10, deps=['proot'] if layered and is_alpine else ())
+    scheduler.add_phase('proot', lambda: setup_proot_binary(data_dir, proot_bin))
+    scheduler.add_phase('terminal', lambda: setup_terminal_binary(config))
+    prompt_deps = ['rootfs']
+    # Install Alpine packages if Alpine distro
+    if is_alpine and not layered:
+        scheduler.add_phase('alpine-packages',
+                            lambda: install_alpine_packages(config['rootfs'], proot_bin, data_dir),
+                            deps=['rootfs', 'proot'])
+        prompt_deps.append('alpine-packages')
+    # Set permanent prompt based on shell
+    scheduler.add_phase('prompt',
+                        lambda: set_shell_prompt(config['rootfs'], config['user'], config['hostname'], shell),
+                        deps=prompt_deps)
+    scheduler.run()
+    get_download_manager().log_metrics()
+
     # Save config after setup
     import sys
     sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
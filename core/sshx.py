@@ -1,13 +1,12 @@
 import os
-import urllib.request
-import urllib.error
-import subprocess
+import tarfile
 import platform
-import time
 from lcsx.ui.logger import print_main, print_error
+from lcsx.ui.progress import ProgressBar
+from lcsx.core.cache import fetch_artifact
+from lcsx.core.extract import extract_archive
 from lcsx.config.constants import (
-    SSHX_X86_64_URL, SSHX_ARM64_URL,
-    MAX_DOWNLOAD_RETRIES, RETRY_DELAY
+    SSHX_X86_64_URL, SSHX_ARM64_URL
 )
 
 def get_sshx_url():
@@ -30,23 +29,15 @@ def setup_sshx(data_dir):
     sshx_path = os.path.join(sshx_dir, 'sshx')
     if not os.path.exists(sshx_path):
         print_main(f"sshx binary not found. Downloading again...")
-        # Retry logic for downloads
-        for attempt in range(MAX_DOWNLOAD_RETRIES):
-            try:
-                urllib.request.urlretrieve(sshx_url, tar_path)
-                subprocess.run(['tar', '-xf', tar_path, '-C', sshx_dir], check=True)
+        # Retried by the download manager
+        with ProgressBar("Downloading sshx") as progress:
+            fetch_artifact(sshx_url, tar_path, reporthook=progress.reporthook, description='sshx')
+        try:
+            extract_archive(tar_path, sshx_dir, mode='r|gz', exclude=None)
+        except (OSError, tarfile.TarError) as e:
+            print_error(f"Failed to extract sshx: {e}")
+            raise
+        finally:
+            if os.path.exists(tar_path):
                 os.remove(tar_path)
-                break
-            except (urllib.error.URLError, urllib.error.HTTPError, OSError, subprocess.CalledProcessError) as e:
-                if attempt < MAX_DOWNLOAD_RETRIES - 1:
-                    print_error(f"Download/extraction failed (attempt {attempt + 1}/{MAX_DOWNLOAD_RETRIES}): {e}")
-                    print_main(f"Retrying in {RETRY_DELAY} seconds...")
-                    if os.path.exists(tar_path):
-                        os.remove(tar_path)
-                    time.sleep(RETRY_DELAY)
-                else:
-                    print_error(f"Failed to setup sshx after {MAX_DOWNLOAD_RETRIES} attempts: {e}")
-                    if os.path.exists(tar_path):
-                        os.remove(tar_path)
-                    raise
     return sshx_path
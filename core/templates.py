@@ -0,0 +1,416 @@
+"""
+Rootfs template store for LCSX.
+Keeps one pristine extracted rootfs per tarball and clones it into new data directories.
+"""
+
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.config.constants import (
+    DEFAULT_TEMPLATE_DIR, TEMPLATE_CLONE, TEMPLATE_CLONE_THREADS, TEMPLATE_COPY_PATHS, TEMPLATE_MAX_SIZE
+)
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_warning
+
+# ioctl that makes a file share the extents of another (Linux, btrfs/xfs/bcachefs/...)
+FICLONE = 0x40049409
+CLONE_METHODS = ('reflink', 'hardlink', 'copy')
+# Methods 'auto' tries in order. A copied clone writes the whole rootfs a second time, so on a
+# filesystem without reflink 'auto' extracts directly; copy and hardlink are opt-in only
+AUTO_CLONE_METHODS = ('reflink',)
+TEMPLATE_META = 'template.json'
+
+# Template store instance
+_store = None
+_clone_method = TEMPLATE_CLONE
+
+
+class _ReflinkUnsupported(OSError):
+    """The filesystem cannot share extents between these two files."""
+
+
+def template_name(url):
+    """Template directory name for a rootfs URL, e.g. debian-bookworm-x86_64-pd-v4.17.3."""
+    base = url.rstrip('/').rsplit('/', 1)[-1]
+    base = re.sub(r'\.(tar\.\w+|t[gx]z)$', '', base)
+    return re.sub(r'[^A-Za-z0-9._-]', '_', base) or 'rootfs'
+
+
+def _reflink(src, dst):
+    """Clone src to dst by sharing its extents, then copy mode and times."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise _ReflinkUnsupported(e.errno, f"reflink not supported: {e.strerror}")
+            raise
+    shutil.copystat(src, dst)
+
+
+def nearest_existing_dir(path):
+    """path, or its nearest ancestor that exists."""
+    path = os.path.abspath(path)
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def reflink_supported(src_dir, dst_dir):
+    """
+    True if files under src_dir can be reflinked into dst_dir.
+
+    Probes with a throwaway file in the nearest existing directory of each,
+    so neither has to be created.
+    """
+    src_dir, dst_dir = nearest_existing_dir(src_dir), nearest_existing_dir(dst_dir)
+    src = dst = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=src_dir, prefix='.lcsx-reflink-', delete=False) as f:
+            src = f.name
+            f.write(bytes(4096))
+        dst = os.path.join(dst_dir, os.path.basename(src) + '.clone')
+        _reflink(src, dst)
+        return True
+    except OSError:
+        return False
+    finally:
+        for path in (src, dst):
+            if path:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+
+def tree_size(path):
+    """Total size of the regular files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            if stat.S_ISREG(st.st_mode):
+                total += st.st_size
+    return total
+
+
+def _copy(src, dst):
+    shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+def _copy_attrs(src, dst, st):
+    """Apply owner (when root), mode and times of src to a directory or symlink at dst."""
+    if os.geteuid() == 0:
+        with contextlib.suppress(OSError):
+            os.lchown(dst, st.st_uid, st.st_gid)
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+    with contextlib.suppress(NotImplementedError, OSError):
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+
+def clone_tree(src, dst, method, copy_paths=(), threads=TEMPLATE_CLONE_THREADS):
+    """
+    Recreate the tree at src under dst.
+
+    Directories and symlinks are created in a single walk; regular files are
+    reflinked, hard linked or copied on a thread pool. With 'hardlink', files
+    under copy_paths (relative to src) are copied instead, so the paths an
+    instance edits in place never write through to src; everywhere else a
+    package manager replaces files by rename, which breaks the link. Directory
+    modes are applied deepest first at the end, like extraction does.
+
+    Args:
+        src: Tree to clone.
+        dst: Destination directory; created if missing.
+        method: 'reflink', 'hardlink' or 'copy'.
+        copy_paths: Relative path prefixes that are always copied.
+        threads: Files cloned at the same time.
+
+    Returns:
+        int: Number of regular files cloned.
+
+    Raises:
+        OSError: If a file cannot be cloned with method (for 'reflink' and
+            'hardlink', typically because the filesystem does not allow it).
+    """
+    copy_prefixes = tuple(path.strip('/') for path in copy_paths)
+    link_op = {'reflink': _reflink, 'hardlink': os.link, 'copy': _copy}[method]
+    directories = []
+    os.makedirs(dst, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = []
+        for root, dirs, files in os.walk(src):
+            rel_root = os.path.relpath(root, src)
+            rel_root = '' if rel_root == '.' else rel_root
+            target_root = os.path.join(dst, rel_root)
+            directories.append((root, target_root))
+            for name in list(dirs):
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    # os.walk lists symlinks to directories as directories
+                    dirs.remove(name)
+                    files.append(name)
+                else:
+                    os.makedirs(os.path.join(target_root, name), exist_ok=True)
+            for name in files:
+                path = os.path.join(root, name)
+                target = os.path.join(target_root, name)
+                st = os.lstat(path)
+                if stat.S_ISLNK(st.st_mode):
+                    os.symlink(os.readlink(path), target)
+                    _copy_attrs(path, target, st)
+                elif stat.S_ISREG(st.st_mode):
+                    rel = os.path.join(rel_root, name)
+                    op = link_op
+                    if method == 'hardlink' and any(rel == p or rel.startswith(p + '/') for p in copy_prefixes):
+                        op = _copy
+                    futures.append(pool.submit(op, path, target))
+                elif stat.S_ISFIFO(st.st_mode):
+                    os.mkfifo(target, stat.S_IMODE(st.st_mode))
+        for future in futures:
+            future.result()
+    for source_dir, target_dir in reversed(directories):
+        _copy_attrs(source_dir, target_dir, os.lstat(source_dir))
+    return len(futures)
+
+
+class TemplateStore:
+    """
+    Pristine rootfs trees, one per rootfs tarball.
+
+    Layout:
+        <name>/rootfs/          the extracted tarball, never modified after it is built
+        <name>/template.json    URL, sha256 and size of the tarball it came from; its mtime is the last clone
+        <name>.lock             shared while cloning, exclusive while (re)building
+
+    <name> comes from the tarball's file name, which carries distribution,
+    release and architecture. A template whose sha256 no longer matches the
+    cached tarball is rebuilt. After a build, the least recently cloned
+    templates are evicted until the store fits max_size. The directory is
+    only created when the first template is built.
+    """
+
+    def __init__(self, template_dir=None, max_size=None):
+        self.template_dir = os.path.abspath(os.path.expanduser(template_dir or DEFAULT_TEMPLATE_DIR))
+        self.max_size = TEMPLATE_MAX_SIZE if max_size is None else max_size
+
+    @contextlib.contextmanager
+    def _lock(self, name, exclusive, blocking=True):
+        os.makedirs(self.template_dir, exist_ok=True)
+        with open(os.path.join(self.template_dir, f"{name}.lock"), 'a') as lock_file:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            # Raises BlockingIOError when not blocking and the lock is held
+            fcntl.flock(lock_file, flags if blocking else flags | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta(self, name):
+        try:
+            with open(os.path.join(self.template_dir, name, TEMPLATE_META), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def lookup(self, url, sha256=None):
+        """
+        Return the rootfs directory of the template for url, or None.
+
+        With sha256 given, a template built from different content is a miss.
+        """
+        name = template_name(url)
+        meta = self._meta(name)
+        if meta is None or meta.get('url') != url or (sha256 and meta.get('sha256') != sha256):
+            return None
+        return os.path.join(self.template_dir, name, 'rootfs')
+
+    def build(self, url, sha256, extract):
+        """
+        Build (or rebuild) the template for url.
+
+        Args:
+            url: Rootfs tarball URL.
+            sha256: Digest of the tarball, recorded to detect staleness.
+            extract: Callable extracting the rootfs into the directory it is given; it may
+                return the tarball's sha256 when that was not known beforehand.
+
+        Returns:
+            str: Rootfs directory of the template.
+        """
+        name = template_name(url)
+        with self._lock(name, exclusive=True):
+            # Another process may have built it while we waited for the lock
+            existing = self.lookup(url, sha256)
+            if existing is not None:
+                return existing
+            staging = os.path.join(self.template_dir, f".{name}.{os.getpid()}.build")
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(os.path.join(staging, 'rootfs'))
+            try:
+                sha256 = extract(os.path.join(staging, 'rootfs')) or sha256
+                size = tree_size(os.path.join(staging, 'rootfs'))
+                with open(os.path.join(staging, TEMPLATE_META), 'w') as f:
+                    json.dump({'url': url, 'sha256': sha256, 'size': size, 'created': time.time()}, f, indent=1)
+                final = os.path.join(self.template_dir, name)
+                if os.path.exists(final):
+                    old = os.path.join(self.template_dir, f".{name}.{os.getpid()}.old")
+                    os.replace(final, old)
+                    shutil.rmtree(old, ignore_errors=True)
+                os.replace(staging, final)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        get_logger().info(f"Built rootfs template {name} from {url}")
+        self._evict(keep=name)
+        return os.path.join(self.template_dir, name, 'rootfs')
+
+    def _size(self, name, meta):
+        if 'size' not in meta:
+            # Built before sizes were recorded
+            meta['size'] = tree_size(os.path.join(self.template_dir, name, 'rootfs'))
+        return meta['size']
+
+    def last_used(self, name):
+        """Time the template was last built or cloned."""
+        try:
+            return os.path.getmtime(os.path.join(self.template_dir, name, TEMPLATE_META))
+        except OSError:
+            return 0
+
+    def _evict(self, keep=None):
+        """Remove least recently used templates until the store fits max_size; ones being cloned are skipped."""
+        entries = self.entries()
+        total = sum(self._size(name, meta) for name, meta in entries)
+        for name, meta in sorted(entries, key=lambda entry: self.last_used(entry[0])):
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            try:
+                with self._lock(name, exclusive=True, blocking=False):
+                    self._delete(name)
+            except BlockingIOError:
+                continue
+            total -= self._size(name, meta)
+            get_logger().info(f"Evicted rootfs template {name}")
+
+    def entries(self):
+        """Return [(name, meta), ...] for every template, sorted by name."""
+        entries = []
+        try:
+            names = sorted(os.listdir(self.template_dir))
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith('.') or not os.path.isdir(os.path.join(self.template_dir, name)):
+                continue
+            meta = self._meta(name)
+            if meta is not None:
+                entries.append((name, meta))
+        return entries
+
+    def remove(self, name):
+        """
+        Delete a template. Data directories cloned from it by reflink or copy are unaffected.
+
+        Raises:
+            ValueError: If there is no template of that name.
+        """
+        if ('/' in name or name.startswith('.') or not os.path.isdir(os.path.join(self.template_dir, name))
+                or self._meta(name) is None):
+            raise ValueError(f"No template named {name}")
+        with self._lock(name, exclusive=True):
+            self._delete(name)
+        get_logger().info(f"Removed rootfs template {name}")
+
+    def _delete(self, name):
+        """Delete a template; the caller holds its exclusive lock."""
+        old = os.path.join(self.template_dir, f".{name}.{os.getpid()}.old")
+        os.replace(os.path.join(self.template_dir, name), old)
+        shutil.rmtree(old, ignore_errors=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.template_dir, f"{name}.lock"))
+
+    def clone(self, url, dest_dir, method='auto'):
+        """
+        Materialize the template for url in dest_dir.
+
+        'auto' only reflinks (see reflink_supported); a parallel copy or a
+        hardlink farm is only made when asked for.
+
+        Returns:
+            str: The method that was used.
+        """
+        name = template_name(url)
+        methods = AUTO_CLONE_METHODS if method == 'auto' else (method,)
+        with self._lock(name, exclusive=False):
+            with contextlib.suppress(OSError):
+                # Marks it recently used for eviction
+                os.utime(os.path.join(self.template_dir, name, TEMPLATE_META))
+            src = os.path.join(self.template_dir, name, 'rootfs')
+            # Tarballs that wrap the rootfs in one top-level directory
+            entries = os.listdir(src)
+            top = entries[0] if len(entries) == 1 and os.path.isdir(os.path.join(src, entries[0])) else ''
+            copy_paths = [os.path.join(top, path) for path in TEMPLATE_COPY_PATHS]
+            for candidate in methods:
+                started = time.monotonic()
+                try:
+                    count = clone_tree(src, dest_dir, candidate, copy_paths=copy_paths)
+                except OSError as e:
+                    if candidate == methods[-1]:
+                        raise
+                    get_logger().info(f"Cloning template {name} with {candidate} failed ({e}); trying the next method")
+                    shutil.rmtree(dest_dir)
+                    continue
+                get_logger().info(f"Cloned template {name} ({count} files) into {dest_dir} "
+                                  f"with {candidate} in {time.monotonic() - started:.2f}s")
+                return candidate
+
+
+
+def setup_templates(template_dir=None, clone_method=None, max_size=None):
+    """
+    Configure the global template store.
+
+    Args:
+        template_dir: Template directory. If None, uses DEFAULT_TEMPLATE_DIR.
+        clone_method: 'auto' (reflink when the filesystem supports it, else no template),
+            'reflink', 'hardlink', 'copy', or 'off' to extract every rootfs. If None, uses TEMPLATE_CLONE.
+        max_size: Size cap of the store in bytes. If None, uses TEMPLATE_MAX_SIZE.
+
+    Returns:
+        TemplateStore instance, or None when templates are off.
+    """
+    global _store, _clone_method
+    _clone_method = TEMPLATE_CLONE if clone_method is None else clone_method
+    if _clone_method == 'hardlink':
+        print_warning("Hardlinked rootfs share files with their template: an in-place write or chmod "
+                      "outside /etc, /root, /home, /var, /tmp and /run changes the template and every "
+                      "later instance. Use --rootfs-clone copy unless you know nothing edits files in place.")
+    _store = TemplateStore(template_dir, max_size) if _clone_method != 'off' else None
+    return _store
+
+
+def get_template_store():
+    """Get the global template store, creating it if necessary. None when off."""
+    global _store, _clone_method
+    if _store is None and _clone_method != 'off':
+        try:
+            _store = TemplateStore()
+        except OSError as e:
+            get_logger().warning(f"Rootfs template store unavailable, extracting directly: {e}")
+            _clone_method = 'off'
+    return _store
+
+
+def get_clone_method():
+    """Return the configured clone method."""
+    return _clone_method
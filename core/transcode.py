@@ -0,0 +1,177 @@
+"""
+Rootfs transcoding for LCSX.
+Keeps a fast-to-decompress copy (zstd or plain tar) of cached rootfs tarballs and extracts from it.
+"""
+
+import contextlib
+import fcntl
+import lzma
+import os
+import shutil
+import subprocess
+import threading
+from lcsx.config.catalog import get_pinned_sha256
+from lcsx.core.archiver import detect_tools, find_native_extractor
+from lcsx.core.cache import get_cache
+from lcsx.core.extract import get_extraction_backend
+from lcsx.core.logger import get_logger
+from lcsx.core.xz import ParallelXZReader
+
+COPY_CHUNK_SIZE = 1024 * 1024
+ZSTD_LEVEL = 3
+
+# tarfile-style stream mode of each derived format
+FORMAT_MODES = {'zstd': 'r|zst', 'tar': 'r|'}
+
+
+def resolve_format(setting):
+    """
+    Map a transcode setting to the format produced on this host.
+
+    Returns:
+        str: 'zstd', 'tar', or None when transcoding is off or zstd is not installed.
+    """
+    tools = detect_tools()
+    if setting == 'auto':
+        return 'zstd' if 'zstd' in tools else 'tar'
+    if setting == 'zstd' and 'zstd' not in tools:
+        get_logger().warning("zstd is not installed; not transcoding cached rootfs tarballs")
+        return None
+    return setting if setting in FORMAT_MODES else None
+
+
+def _can_extract(fmt):
+    """True if this host can extract the derived format (zstd needs a native tool)."""
+    if fmt == 'tar':
+        return True
+    return get_extraction_backend() == 'auto' and find_native_extractor('zst') is not None
+
+
+def _background(command, **kwargs):
+    """Start command below the priority of the setup itself."""
+    process = subprocess.Popen(command, **kwargs)
+    with contextlib.suppress(OSError):
+        os.setpriority(os.PRIO_PROCESS, process.pid, 10)
+    return process
+
+
+def _decompress_to(blob, out):
+    """Write the decompressed contents of a .tar.xz blob to the binary file out."""
+    tools = detect_tools()
+    if 'xz' in tools:
+        with open(blob, 'rb') as source:
+            xz = _background([tools['xz'], '-d', '-c', '-T0'], stdin=source, stdout=out,
+                             stderr=subprocess.DEVNULL)
+            if xz.wait() != 0:
+                raise OSError(f"xz exited with status {xz.returncode}")
+        return
+    with open(blob, 'rb') as source, ParallelXZReader(source) as reader:
+        shutil.copyfileobj(reader, out, COPY_CHUNK_SIZE)
+
+
+def transcode_blob(cache, digest, fmt):
+    """
+    Produce the derived copy of a cached .tar.xz blob in the foreground.
+
+    The rootfs is decompressed with xz -T0 (or the built-in parallel
+    decoder) and, for zstd, recompressed with zstd -T0 at a level that
+    favours decompression speed. A host-wide lock per blob keeps concurrent
+    lcsx processes from doing the same work twice.
+
+    Returns:
+        str: Path of the derived copy, or None if another process is producing it
+        or the blob is no longer cached.
+    """
+    existing = cache.lookup_derived(digest)
+    if existing is not None and existing[1] == fmt:
+        return existing[0]
+    lock_path = os.path.join(cache.tmp_dir, f"{digest}.transcode.lock")
+    tmp_path = os.path.join(cache.tmp_dir, f"{digest}.transcode")
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            get_logger().info(f"Blob {digest} is already being transcoded by another process")
+            return None
+        try:
+            blob = cache.blob_path(digest)
+            with open(tmp_path, 'wb') as out:
+                if fmt == 'tar':
+                    _decompress_to(blob, out)
+                else:
+                    zstd = _background([detect_tools()['zstd'], '-q', '-c', '-T0', f'-{ZSTD_LEVEL}'],
+                                       stdin=subprocess.PIPE, stdout=out, stderr=subprocess.DEVNULL)
+                    try:
+                        _decompress_to(blob, zstd.stdin)
+                    finally:
+                        zstd.stdin.close()
+                        if zstd.wait() != 0:
+                            raise OSError(f"zstd exited with status {zstd.returncode}")
+            return cache.store_derived(digest, fmt, tmp_path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def schedule_transcode(url):
+    """
+    Start producing the fast copy of the cached rootfs for url in a background thread.
+
+    Does nothing when the cache is disabled, transcoding is off, the URL is
+    not cached or its copy already exists. The thread is a daemon: if lcsx
+    exits first the partial copy is discarded and the next run starts over.
+
+    Returns:
+        threading.Thread, or None if nothing was started.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    fmt = resolve_format(cache.transcode)
+    if fmt is None:
+        return None
+    blob = cache.lookup(url, sha256=get_pinned_sha256(url))
+    if blob is None:
+        return None
+    digest = os.path.basename(blob)
+    existing = cache.lookup_derived(digest)
+    if existing is not None and existing[1] == fmt:
+        return None
+
+    def run():
+        try:
+            if transcode_blob(cache, digest, fmt):
+                get_logger().info(f"Transcoded cached rootfs {url} to {fmt}")
+        except (OSError, subprocess.SubprocessError, lzma.LZMAError) as e:
+            get_logger().warning(f"Transcoding cached rootfs {url} failed: {e}")
+
+    thread = threading.Thread(target=run, name='lcsx-transcode', daemon=True)
+    thread.start()
+    get_logger().info(f"Transcoding cached rootfs {url} to {fmt} in the background")
+    return thread
+
+
+def find_fast_copy(url):
+    """
+    Return the derived copy of the cached rootfs for url, if it is current and usable.
+
+    A copy is used whatever --cache-transcode says, e.g. one made by
+    `lcsx cache transcode`. The blob is looked up (and revalidated when due)
+    exactly as for a normal cache hit, so a stale rootfs is never extracted
+    from its old copy.
+
+    Returns:
+        tuple: (path, tarfile stream mode), or None.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    blob = cache.lookup_current(url, sha256=get_pinned_sha256(url))
+    if blob is None:
+        return None
+    derived = cache.lookup_derived(os.path.basename(blob))
+    if derived is None or not _can_extract(derived[1]):
+        return None
+    return derived[0], FORMAT_MODES[derived[1]]
+
@@ -0,0 +1,83 @@
+"""
+Cache warm-up for LCSX.
+Prefetches catalog artifacts into the artifact cache in parallel, so later setups never touch the network.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.config.catalog import SHIPPED_LIBS, get_pinned_sha256
+from lcsx.core.bundle import seed_shipped_lib
+from lcsx.core.download import get_download_manager
+from lcsx.core.logger import get_logger
+from lcsx.ui.logger import print_main, print_error
+from lcsx.ui.progress import ProgressBar, format_size
+
+
+def _warm_one(cache, name, url):
+    """
+    Make sure one artifact is cached.
+
+    Returns:
+        tuple: (status, size, seconds, error) with status 'cached', 'fetched' or 'failed'.
+    """
+    started = time.monotonic()
+    sha256 = get_pinned_sha256(url)
+    try:
+        blob = cache.lookup(url, sha256=sha256)
+        if blob is None and url in SHIPPED_LIBS:
+            blob = seed_shipped_lib(cache, url)
+            if blob is not None:
+                return 'cached', os.path.getsize(blob), time.monotonic() - started, None
+        hit = blob is not None
+        with ProgressBar(name) as progress:
+            # ensure() also revalidates a hit that is due, so the burst after warming stays local
+            blob = cache.ensure(url, reporthook=progress.reporthook, segmented=name.endswith(' rootfs'),
+                                description=name, sha256=sha256)
+        return 'cached' if hit else 'fetched', os.path.getsize(blob), time.monotonic() - started, None
+    except Exception as e:
+        get_logger().error(f"Warming {url} failed: {e}")
+        return 'failed', 0, time.monotonic() - started, e
+
+
+def warm_cache(cache, artifacts, jobs):
+    """
+    Fetch every artifact into the cache concurrently and print a report.
+
+    Artifacts already cached (and, unless pinned, still current upstream) are
+    not downloaded again. Rootfs tarballs use segmented downloads on top of
+    the jobs running in parallel.
+
+    Args:
+        cache: ArtifactCache to fill.
+        artifacts: [(name, url), ...], e.g. from catalog.select_artifacts().
+        jobs: Number of artifacts fetched at the same time.
+
+    Returns:
+        bool: True if every artifact is cached.
+    """
+    manager = get_download_manager()
+    bytes_before = manager.metrics['bytes']
+    started = time.monotonic()
+    print_main(f"Warming the artifact cache with {len(artifacts)} artifacts ({jobs} at a time)...")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(lambda item: _warm_one(cache, *item), artifacts))
+    elapsed = time.monotonic() - started
+    fetched = manager.metrics['bytes'] - bytes_before
+
+    width = max(len(name) for name, _ in artifacts)
+    for (name, _), (status, size, seconds, error) in zip(artifacts, results):
+        line = f"{name.ljust(width)}  {status:<7} {format_size(size):>9} {seconds:7.1f}s"
+        if error is not None:
+            print_error(f"{line}  {error}")
+        else:
+            print_main(line)
+
+    failed = sum(1 for result in results if result[0] == 'failed')
+    hits = sum(1 for result in results if result[0] == 'cached')
+    rate = fetched / elapsed if elapsed > 0 else 0
+    summary = (f"Fetched {format_size(fetched)} in {elapsed:.1f}s ({format_size(rate)}/s); "
+               f"{len(artifacts) - hits - failed} downloaded, {hits} already cached, {failed} failed")
+    (print_error if failed else print_main)(summary)
+    manager.log_metrics()
+    return failed == 0
@@ -0,0 +1,535 @@
+"""
+Parallel xz decoding for LCSX.
+Splits multi-block .xz streams at their block boundaries and decodes the blocks on a thread pool.
+Also writes multi-block streams and reads block tables, for random access into .xz files.
+"""
+
+import lzma
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from lcsx.core.logger import get_logger
+
+STREAM_MAGIC = b'\xfd7zXZ\x00'
+FOOTER_MAGIC = b'YZ'
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Size of the integrity check for each check type (xz file format, section 3.4)
+CHECK_SIZES = (0, 4, 4, 4, 8, 8, 8, 16, 16, 16, 32, 32, 32, 64, 64, 64)
+CHECK_CRC32 = 0x01
+
+# Filter IDs that may appear in a block header, mapped to lzma filter ids
+_FILTER_IDS = {
+    0x21: lzma.FILTER_LZMA2,
+    0x03: lzma.FILTER_DELTA,
+    0x04: lzma.FILTER_X86,
+    0x05: lzma.FILTER_POWERPC,
+    0x06: lzma.FILTER_IA64,
+    0x07: lzma.FILTER_ARM,
+    0x08: lzma.FILTER_ARMTHUMB,
+    0x09: lzma.FILTER_SPARC,
+}
+
+
+class XZFormatError(lzma.LZMAError):
+    """The input is not a well-formed .xz stream."""
+
+
+def _decode_varint(data, pos):
+    """Decode an xz multibyte integer at data[pos]; return (value, next position)."""
+    value = 0
+    for i in range(9):
+        if pos >= len(data):
+            raise XZFormatError("Truncated integer in xz header")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, pos
+    raise XZFormatError("Integer in xz header is too long")
+
+
+def _encode_varint(value):
+    """Encode an xz multibyte integer."""
+    data = bytearray()
+    while value >= 0x80:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def _lzma2_dict_props(dict_size):
+    """Return (LZMA2 properties byte, dictionary size) for the smallest encodable size >= dict_size."""
+    for bits in range(40):
+        size = (2 | (bits & 1)) << (bits // 2 + 11)
+        if size >= dict_size:
+            return bits, size
+    return 40, 0xFFFFFFFF
+
+
+def _parse_filters(header, pos, count):
+    """Return the lzma filter chain described by a block header."""
+    filters = []
+    for _ in range(count):
+        filter_id, pos = _decode_varint(header, pos)
+        size, pos = _decode_varint(header, pos)
+        props = header[pos:pos + size]
+        pos += size
+        if filter_id not in _FILTER_IDS:
+            raise XZFormatError(f"Unsupported xz filter 0x{filter_id:x}")
+        spec = {'id': _FILTER_IDS[filter_id]}
+        if filter_id == 0x21:
+            bits = props[0] & 0x3F
+            spec['dict_size'] = 0xFFFFFFFF if bits == 40 else (2 | (bits & 1)) << (bits // 2 + 11)
+        elif filter_id == 0x03:
+            spec['dist'] = props[0] + 1
+        elif size == 4:
+            spec['start_offset'] = struct.unpack('<I', props)[0]
+        filters.append(spec)
+    return filters
+
+
+def _parse_block_header(header):
+    """
+    Parse a complete block header.
+
+    Returns:
+        tuple: (compressed size or None, uncompressed size or None, filter chain).
+    """
+    if zlib.crc32(header[:-4]) != struct.unpack('<I', header[-4:])[0]:
+        raise XZFormatError("Corrupt xz block header")
+    flags = header[1]
+    pos = 2
+    compressed = uncompressed = None
+    if flags & 0x40:
+        compressed, pos = _decode_varint(header, pos)
+    if flags & 0x80:
+        uncompressed, pos = _decode_varint(header, pos)
+    return compressed, uncompressed, _parse_filters(header, pos, (flags & 0x03) + 1)
+
+
+def _decode_block(stream_header, block):
+    """
+    Decode one block on a worker thread.
+
+    The block is wrapped in its stream's header, so liblzma checks the block
+    header and the block's integrity check exactly as it would in the full
+    stream; decoding stops before the index, which is not needed for that.
+    """
+    try:
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ).decompress(stream_header + block)
+    except XZFormatError:
+        raise
+    except lzma.LZMAError as e:
+        raise XZFormatError(f"Corrupt xz block: {e}") from e
+
+
+def read_block(fileobj, stream_offset, offset, size):
+    """
+    Decode one block of a seekable .xz file.
+
+    Args:
+        fileobj: The .xz file, opened in binary mode.
+        stream_offset: Offset of the header of the stream the block belongs to.
+        offset: Offset of the block header.
+        size: Size of the block in the file, padding and check included.
+
+    Returns:
+        bytes: The uncompressed contents of the block.
+    """
+    fileobj.seek(stream_offset)
+    stream_header = fileobj.read(12)
+    fileobj.seek(offset)
+    block = fileobj.read(size)
+    if len(stream_header) != 12 or len(block) != size:
+        raise XZFormatError("Truncated xz file")
+    return _decode_block(stream_header, block)
+
+
+def list_blocks(fileobj):
+    """
+    Read the block table of a seekable .xz file from its indexes.
+
+    Streams are walked back from the end of the file (stream footer, index,
+    stream header), like `xz --list` does, so nothing is decompressed.
+
+    Returns:
+        list: (stream offset, block offset, block size, uncompressed offset,
+        uncompressed size) per block, in file order. Sizes include block
+        padding and check, so blocks can be read back with read_block().
+    """
+    fileobj.seek(0, os.SEEK_END)
+    end = fileobj.tell()
+    streams = []
+    while end > 0:
+        # Stream padding
+        if end >= 4:
+            fileobj.seek(end - 4)
+            if fileobj.read(4) == b'\x00\x00\x00\x00':
+                end -= 4
+                continue
+        if end < 24:
+            raise XZFormatError("Truncated xz file")
+        fileobj.seek(end - 12)
+        footer = fileobj.read(12)
+        if footer[10:12] != FOOTER_MAGIC or zlib.crc32(footer[4:10]) != struct.unpack('<I', footer[:4])[0]:
+            raise XZFormatError("Corrupt xz stream footer")
+        index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+        index_start = end - 12 - index_size
+        if index_start < 12:
+            raise XZFormatError("Corrupt xz index")
+        fileobj.seek(index_start)
+        index = fileobj.read(index_size)
+        if index[0] != 0 or zlib.crc32(index[:-4]) != struct.unpack('<I', index[-4:])[0]:
+            raise XZFormatError("Corrupt xz index")
+        count, pos = _decode_varint(index, 1)
+        records = []
+        for _ in range(count):
+            unpadded, pos = _decode_varint(index, pos)
+            uncompressed, pos = _decode_varint(index, pos)
+            records.append((unpadded + (-unpadded) % 4, uncompressed))
+        stream_start = index_start - sum(size for size, _ in records) - 12
+        fileobj.seek(max(stream_start, 0))
+        header = fileobj.read(12)
+        if stream_start < 0 or header[:6] != STREAM_MAGIC or header[6:8] != footer[8:10]:
+            raise XZFormatError("Corrupt xz stream header")
+        streams.append((stream_start, records))
+        end = stream_start
+    blocks = []
+    uncompressed_offset = 0
+    for stream_start, records in reversed(streams):
+        offset = stream_start + 12
+        for size, uncompressed in records:
+            blocks.append((stream_start, offset, size, uncompressed_offset, uncompressed))
+            offset += size
+            uncompressed_offset += uncompressed
+    return blocks
+
+
+def _encode_block(data, preset, dict_bits, dict_size):
+    """Compress data into a complete block with a CRC32 check; return (block, unpadded size)."""
+    filters = [{'id': lzma.FILTER_LZMA2, 'preset': preset, 'dict_size': dict_size}]
+    compressed = lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+    # Block flags: one filter, compressed and uncompressed sizes present; LZMA2 with 1 property byte
+    body = (b'\xc0' + _encode_varint(len(compressed)) + _encode_varint(len(data))
+            + b'\x21\x01' + bytes([dict_bits]))
+    header_size = 1 + len(body) + (-(1 + len(body))) % 4 + 4
+    header = bytes([header_size // 4 - 1]) + body + b'\x00' * (header_size - 5 - len(body))
+    header += struct.pack('<I', zlib.crc32(header))
+    unpadded = len(header) + len(compressed) + 4
+    block = header + compressed + b'\x00' * ((-len(compressed)) % 4) + struct.pack('<I', zlib.crc32(data))
+    return block, unpadded
+
+
+class XZBlockWriter:
+    """
+    Writable file object producing a single-stream .xz file of independent blocks.
+
+    Every block_size uncompressed bytes form a block that records its sizes
+    in its header, so the result can be decoded in parallel by
+    ParallelXZReader and read at random with list_blocks() and read_block().
+    Blocks are compressed on a thread pool (liblzma releases the GIL) and
+    written in order.
+
+    Attributes:
+        blocks: The block table of what was written, as list_blocks() returns it.
+    """
+
+    def __init__(self, fileobj, block_size=1024 * 1024, preset=6, threads=None):
+        self._out = fileobj
+        self.block_size = block_size
+        self.preset = preset
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self._dict_bits, self._dict_size = _lzma2_dict_props(block_size)
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._records = []
+        self._offset = 12
+        self._uncompressed = 0
+        self.blocks = []
+        flags = bytes([0, CHECK_CRC32])
+        self._out.write(STREAM_MAGIC + flags + struct.pack('<I', zlib.crc32(flags)))
+
+    def _flush_pending(self, keep):
+        while len(self._pending) > keep:
+            future, size = self._pending.popleft()
+            block, unpadded = future.result()
+            self._out.write(block)
+            self._records.append((unpadded, size))
+            self.blocks.append((0, self._offset, len(block), self._uncompressed, size))
+            self._offset += len(block)
+            self._uncompressed += size
+
+    def _submit(self, data):
+        self._pending.append((self._pool.submit(_encode_block, data, self.preset, self._dict_bits,
+                                                self._dict_size), len(data)))
+        self._flush_pending(self.threads * 2)
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """Write the last block, the index and the stream footer. Does not close the file."""
+        if self._pool is None:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._flush_pending(0)
+        self._pool.shutdown(wait=True)
+        self._pool = None
+        index = bytearray(b'\x00' + _encode_varint(len(self._records)))
+        for unpadded, size in self._records:
+            index += _encode_varint(unpadded) + _encode_varint(size)
+        index += b'\x00' * ((-len(index)) % 4)
+        index += struct.pack('<I', zlib.crc32(bytes(index)))
+        footer = struct.pack('<I', len(index) // 4 - 1) + bytes([0, CHECK_CRC32])
+        self._out.write(bytes(index) + struct.pack('<I', zlib.crc32(footer)) + footer + FOOTER_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+class _Input:
+    """Readable file wrapper with exact reads and push-back."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._pushback = b''
+
+    def read(self, size):
+        """Read up to size bytes; fewer only at the end of the input."""
+        parts = []
+        if self._pushback:
+            parts.append(self._pushback[:size])
+            self._pushback = self._pushback[size:]
+            size -= len(parts[0])
+        while size > 0:
+            chunk = self._fileobj.read(size)
+            if not chunk:
+                break
+            parts.append(chunk)
+            size -= len(chunk)
+        return b''.join(parts)
+
+    def read_exact(self, size):
+        data = self.read(size)
+        if len(data) != size:
+            raise XZFormatError("Truncated xz stream")
+        return data
+
+    def unread(self, data):
+        self._pushback = data + self._pushback
+
+
+class ParallelXZReader:
+    """
+    Readable file object yielding the decompressed contents of an .xz stream.
+
+    Multi-threaded xz (xz -T, pixz) writes independent blocks that record
+    their compressed size in the block header. Those blocks are read ahead
+    and decoded on a thread pool, at most max_inflight uncompressed bytes
+    at a time, and handed out in order. A block without a recorded size is
+    decoded inline. An archive whose first block has no size (single-block
+    output of plain xz) is decoded serially, as lzma.open would. Input is
+    read strictly sequentially, so it may be a pipe or a download stream.
+    """
+
+    def __init__(self, fileobj, threads=None, max_inflight=512 * 1024 * 1024):
+        self._input = _Input(fileobj)
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.max_inflight = max_inflight
+        self._pool = None
+        self._pending = deque()
+        self._inflight = 0
+        self._buffer = b''
+        self._pos = 0
+        self._stream_header = None
+        self._check_size = 0
+        self._serial = None
+        self._eof = False
+        self.blocks = 0
+        self._start_stream(self._input.read_exact(12))
+        self._decide_mode()
+
+    def _start_stream(self, header):
+        if header[:6] != STREAM_MAGIC:
+            raise XZFormatError("Not an xz stream")
+        if zlib.crc32(header[6:8]) != struct.unpack('<I', header[8:12])[0]:
+            raise XZFormatError("Corrupt xz stream header")
+        self._stream_header = header
+        self._check_size = CHECK_SIZES[header[7] & 0x0F]
+
+    def _read_block_header(self):
+        """Return the next block header, or None at the index."""
+        first = self._input.read_exact(1)
+        if first == b'\x00':
+            return None
+        return first + self._input.read_exact((first[0] + 1) * 4 - 1)
+
+    def _decide_mode(self):
+        header = self._read_block_header()
+        if header is not None and _parse_block_header(header)[0] is None:
+            get_logger().info("xz archive has no block sizes; decoding it serially")
+            self._serial = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+            self._input.unread(self._stream_header + header)
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._next_header = header
+
+    def _read_varint_into(self, data):
+        while True:
+            byte = self._input.read_exact(1)
+            data += byte
+            if not byte[0] & 0x80:
+                return
+
+    def _skip_index(self):
+        """Skip the index and stream footer, then open the next concatenated stream if any."""
+        # Index: indicator, record count, (unpadded, uncompressed) size pairs, padding, CRC32
+        data = bytearray(b'\x00')
+        self._read_varint_into(data)
+        records, _ = _decode_varint(bytes(data), 1)
+        for _ in range(records * 2):
+            self._read_varint_into(data)
+        data += self._input.read_exact((-len(data)) % 4)
+        if zlib.crc32(bytes(data)) != struct.unpack('<I', self._input.read_exact(4))[0]:
+            raise XZFormatError("Corrupt xz index")
+        footer = self._input.read_exact(12)
+        if footer[10:12] != FOOTER_MAGIC:
+            raise XZFormatError("Corrupt xz stream footer")
+        # Stream padding (multiples of four zero bytes) and further streams
+        while True:
+            word = self._input.read(4)
+            if not word:
+                self._next_header = None
+                self._eof = True
+                return
+            if word == b'\x00\x00\x00\x00':
+                continue
+            self._start_stream(word + self._input.read_exact(8))
+            self._next_header = self._read_block_header()
+            return
+
+    def _decode_inline(self, header, filters):
+        """Decode a block without a recorded size with a raw decoder, in order."""
+        decoder = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=filters)
+        output = []
+        consumed = 0
+        while not decoder.eof:
+            chunk = self._input.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise XZFormatError("Truncated xz block")
+            try:
+                output.append(decoder.decompress(chunk))
+            except lzma.LZMAError as e:
+                raise XZFormatError(f"Corrupt xz block: {e}") from e
+            consumed += len(chunk)
+        unused = decoder.unused_data
+        self._input.unread(unused)
+        compressed = consumed - len(unused)
+        # Block padding and check; the check is not verified on this path
+        self._input.read_exact((-(len(header) + compressed)) % 4 + self._check_size)
+        return b''.join(output)
+
+    def _schedule(self):
+        """Read ahead and submit blocks until the pool is busy or the input ends."""
+        while (not self._eof and len(self._pending) < self.threads * 2
+               and (self._inflight < self.max_inflight or not self._pending)):
+            header = self._next_header
+            if header is None:
+                self._skip_index()
+                continue
+            compressed, uncompressed, filters = _parse_block_header(header)
+            self.blocks += 1
+            if compressed is None:
+                data = self._decode_inline(header, filters)
+                self._pending.append((data, 0))
+            else:
+                padding = (-(len(header) + compressed)) % 4
+                block = header + self._input.read_exact(compressed + padding + self._check_size)
+                estimate = uncompressed if uncompressed is not None else compressed * 8
+                self._inflight += estimate
+                self._pending.append((self._pool.submit(_decode_block, self._stream_header, block), estimate))
+            self._next_header = self._read_block_header()
+
+    def _next_chunk(self):
+        """Return the next decompressed chunk in order, or b'' at the end."""
+        if self._serial is not None:
+            return self._read_serial()
+        self._schedule()
+        if not self._pending:
+            return b''
+        item, estimate = self._pending.popleft()
+        self._inflight -= estimate
+        data = item if isinstance(item, bytes) else item.result()
+        self._schedule()
+        return data
+
+    def _read_serial(self):
+        while True:
+            if self._serial.eof:
+                rest = self._serial.unused_data.lstrip(b'\x00')
+                if not rest:
+                    rest = self._input.read(READ_CHUNK_SIZE).lstrip(b'\x00')
+                    if not rest:
+                        return b''
+                # Concatenated stream
+                self._serial = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+                self._input.unread(rest)
+            chunk = self._input.read(READ_CHUNK_SIZE)
+            if not chunk and not self._serial.eof:
+                raise XZFormatError("Truncated xz stream")
+            try:
+                data = self._serial.decompress(chunk)
+            except lzma.LZMAError as e:
+                raise XZFormatError(f"Corrupt xz stream: {e}") from e
+            if data:
+                return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self._buffer[self._pos:]]
+            self._buffer, self._pos = b'', 0
+            while True:
+                chunk = self._next_chunk()
+                if not chunk:
+                    return b''.join(parts)
+                parts.append(chunk)
+        while self._pos >= len(self._buffer):
+            self._buffer, self._pos = self._next_chunk(), 0
+            if not self._buffer:
+                return b''
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if self._pool is not None:
+            for item, _ in self._pending:
+                if not isinstance(item, bytes):
+                    item.cancel()
+            self._pending.clear()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
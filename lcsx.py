@@ -5,6 +5,7 @@ Main entry point for the LCSX tool.
 """
 
 import json
+import multiprocessing
 import os
 import shutil
 import sys
@@ -26,12 +27,22 @@ from lcsx.core.setup import setup_environment
 from lcsx.ui.cli import prompt_setup
 from lcsx.ui.auto import auto_setup
 from lcsx.ui.ascii import display_ascii
+from lcsx.ui.commands import is_subcommand, run_subcommand
 from lcsx.config.config import load_config, save_config, is_configured
 from lcsx.ui.logger import print_main, print_prompt, print_error
 from lcsx.core.gotty import setup_gotty
 from lcsx.core.sshx import setup_sshx
-from lcsx.config.constants import DEFAULT_PORT
+from lcsx.config.constants import (CACHE_REVALIDATE_INTERVAL, CACHE_SEEK_INDEX, CACHE_TRANSCODE, DEFAULT_PORT,
+                                  DOWNLOAD_SEGMENTS, EXTRACT_BACKEND, EXTRACT_DECODE_THREADS, MIRROR_PROBE_TTL,
+                                  RATE_LIMIT, ROOTFS_LAYOUT, STALL_MIN_RATE, STALL_WINDOW, TEMPLATE_CLONE)
 from lcsx.core.logger import setup_logger
+from lcsx.core.cache import setup_cache
+from lcsx.core.download import configure_downloads
+from lcsx.core.extract import configure_extraction
+from lcsx.core.layers import setup_layers
+from lcsx.core.mirrors import setup_mirrors
+from lcsx.core.ratelimit import setup_rate_limit
+from lcsx.core.templates import setup_templates
 import logging
 
 def setup_terminal_service(config, data_dir, service, port=None, credential=None, enable_auth=None):
@@ -95,6 +106,10 @@ def setup_terminal_service(config, data_dir, service, port=None, credential=None
     return config
 
 def main():
+    # Subcommands (lcsx cache ...) have their own parsers and skip the setup flow
+    if is_subcommand(sys.argv[1:]):
+        sys.exit(run_subcommand(sys.argv[1:]))
+
     parser = argparse.ArgumentParser(description="LCSX - GUI CLI for Proot Automation")
     parser.add_argument('--auto', action='store_true', help="Run automatic setup")
     parser.add_argument('--debian', action='store_true', help="Use Debian as the distribution in auto setup")
@@ -109,7 +124,65 @@ def main():
     parser.add_argument('--credential', choices=['yes', 'no'], help="Enable/disable Basic Authentication for gotty using system credentials (yes/no). Only applicable with --gotty.")
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help="Set logging level (default: INFO)")
     parser.add_argument('--log-file', help="Path to log file (default: ~/.lcsx/logs/lcsx.log)")
-    parser.add_argument('data_dir', nargs='?', help="Custom data directory")
+    parser.add_argument('--cache-dir', help="Directory for the shared artifact cache (default: ~/.cache/lcsx)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Download artifacts directly without using the artifact cache")
+    parser.add_argument('--cache-revalidate', type=float, default=CACHE_REVALIDATE_INTERVAL / 3600,
+                        help=f"Hours between upstream checks of cached artifacts with ETag/Last-Modified "
+                             f"(default: {CACHE_REVALIDATE_INTERVAL // 3600}, 0 checks on every run)")
+    parser.add_argument('--cache-transcode', choices=['off', 'auto', 'zstd', 'tar'], default=CACHE_TRANSCODE,
+                        help=f"Keep a fast-to-decompress copy of cached rootfs tarballs, made in the background "
+                             f"after the first download: zstd, uncompressed tar, or auto (zstd when installed) "
+                             f"(default: {CACHE_TRANSCODE})")
+    parser.add_argument('--cache-seek-index', action='store_true', default=CACHE_SEEK_INDEX,
+                        help="Index the members of cached rootfs tarballs in the background after the first "
+                             "download, re-chunking single-block ones, so repairs and lcsx cache extract decode "
+                             "only the blocks they need")
+    parser.add_argument('--rootfs-clone', choices=['auto', 'reflink', 'hardlink', 'copy', 'off'],
+                        default=TEMPLATE_CLONE,
+                        help=f"How a new data directory gets its rootfs from the pristine template of its "
+                             f"distribution release: auto (reflink when the filesystem supports it, else extract "
+                             f"without a template), reflink, copy (keeps a template even without reflink, at the "
+                             f"cost of writing every rootfs twice), hardlink (shares files with the template, "
+                             f"mutable paths copied; only safe if nothing edits files in place), or off to extract "
+                             f"every time (default: {TEMPLATE_CLONE})")
+    parser.add_argument('--template-dir',
+                        help="Directory of the pristine rootfs templates (default: ~/.cache/lcsx/templates)")
+    parser.add_argument('--rootfs-layout', choices=['copy', 'layered'], default=ROOTFS_LAYOUT,
+                        help=f"Rootfs of a new instance: copy gives it a full rootfs, layered runs it on a "
+                             f"read-only base shared by all instances of the distribution release with only "
+                             f"/etc, /root, /home, /var and /tmp in its data directory (default: {ROOTFS_LAYOUT})")
+    parser.add_argument('--base-dir',
+                        help="Directory of the shared base rootfs versions used by --rootfs-layout layered "
+                             "(default: ~/.cache/lcsx/bases)")
+    parser.add_argument('--no-stream-extract', action='store_true',
+                        help="Download the rootfs tarball to disk before extracting it instead of extracting "
+                             "while downloading")
+    parser.add_argument('--extractor', choices=['auto', 'python'], default=EXTRACT_BACKEND,
+                        help=f"Archive extractor: auto uses GNU tar or bsdtar with xz -T0/pixz/pigz when "
+                             f"installed, python always uses the built-in one (default: {EXTRACT_BACKEND})")
+    parser.add_argument('--extract-threads', type=int, default=EXTRACT_DECODE_THREADS,
+                        help="Threads decoding the blocks of a multi-block rootfs .tar.xz "
+                             "(default: one per CPU, 1 decodes serially)")
+    parser.add_argument('--download-segments', type=int, default=DOWNLOAD_SEGMENTS,
+                        help=f"Parallel byte ranges used to download the rootfs "
+                             f"(default: {DOWNLOAD_SEGMENTS}, 1 disables)")
+    parser.add_argument('--stall-rate', type=int, default=STALL_MIN_RATE // 1024,
+                        help=f"Abort and resume a download that stays below this many KB/s "
+                             f"(default: {STALL_MIN_RATE // 1024}, 0 disables)")
+    parser.add_argument('--stall-timeout', type=int, default=STALL_WINDOW,
+                        help=f"Seconds a download may stay below --stall-rate before it is aborted "
+                             f"(default: {STALL_WINDOW})")
+    parser.add_argument('--rate-limit', type=int, default=RATE_LIMIT // 1024,
+                        help="Maximum download rate in KB/s, shared evenly by all lcsx processes downloading "
+                             "on this host (default: unlimited)")
+    parser.add_argument('--mirrors-file',
+                        help="JSON file mapping origin URL prefixes to mirror lists (default: ~/.lcsx/mirrors.json)")
+    parser.add_argument('--reprobe-mirrors', action='store_true',
+                        help="Ignore cached mirror probe results and measure the mirrors again")
+    parser.add_argument('data_dir', nargs='?',
+                        help="Custom data directory (use -- DATA_DIR when it is named like a subcommand "
+                             "and does not exist yet)")
 
     args = parser.parse_args()
     
@@ -117,6 +190,18 @@ def main():
     log_level = getattr(logging, args.log_level.upper(), logging.INFO)
     setup_logger(log_level=log_level, log_file=args.log_file, enable_console=False)
 
+    # Shared artifact cache for rootfs, proot, gotty and sshx downloads
+    setup_cache(cache_dir=args.cache_dir, enabled=not args.no_cache,
+                revalidate_interval=args.cache_revalidate * 3600, transcode=args.cache_transcode,
+                seek_index=args.cache_seek_index)
+    configure_downloads(segments=args.download_segments, stream_extract=not args.no_stream_extract,
+                        stall_rate=args.stall_rate * 1024, stall_window=args.stall_timeout)
+    setup_templates(template_dir=args.template_dir, clone_method=args.rootfs_clone)
+    setup_layers(base_dir=args.base_dir, layout=args.rootfs_layout)
+    configure_extraction(backend=args.extractor, decode_threads=args.extract_threads)
+    setup_mirrors(mirrors_file=args.mirrors_file, ttl=0 if args.reprobe_mirrors else MIRROR_PROBE_TTL)
+    setup_rate_limit(args.rate_limit * 1024)
+
     # Validate --port usage
     if args.port != DEFAULT_PORT and not args.gotty:
         print_main("Error: --port can only be used with --gotty.")
@@ -268,4 +353,5 @@ def main():
         start_proot_shell(config)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
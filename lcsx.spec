@@ -5,7 +5,7 @@ a = Analysis(
     ['__main__.py'],
     pathex=['.'],
     binaries=[],
-    datas=[('config', 'config'), ('core', 'core'), ('ui', 'ui')],
+    datas=[('config', 'config'), ('core', 'core'), ('ui', 'ui'), ('libs', 'libs')],
     hiddenimports=['psutil'],
     hookspath=[],
     hooksconfig={},
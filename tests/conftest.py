@@ -0,0 +1,163 @@
+"""
+Test setup for LCSX.
+Makes the checkout importable as the lcsx package, whatever its directory is called,
+and provides a small rootfs tree, tarballs of it and a local HTTP server.
+"""
+
+import atexit
+import http.server
+import io
+import lzma
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix='lcsx-tests-')
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+
+
+def _import_root():
+    """Return a directory that, on sys.path, makes `import lcsx` load this checkout."""
+    if os.path.basename(REPO_ROOT) == 'lcsx':
+        return os.path.dirname(REPO_ROOT)
+    os.symlink(REPO_ROOT, os.path.join(SCRATCH_DIR, 'lcsx'))
+    return SCRATCH_DIR
+
+
+IMPORT_ROOT = _import_root()
+if IMPORT_ROOT not in sys.path:
+    sys.path.insert(0, IMPORT_ROOT)
+# Subprocesses started by the tests (python -m lcsx.lcsx ...) find the package the same way
+os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, (IMPORT_ROOT, os.environ.get('PYTHONPATH'))))
+
+from lcsx.core.cache import setup_cache  # noqa: E402
+from lcsx.core.logger import setup_logger  # noqa: E402
+from lcsx.core.mirrors import setup_mirrors  # noqa: E402
+from lcsx.core.templates import setup_templates  # noqa: E402
+
+# Keep the test run out of ~/.lcsx/logs
+setup_logger(log_file=os.path.join(SCRATCH_DIR, 'lcsx.log'))
+
+# Regular files of the test rootfs: path -> (content, mode)
+ROOTFS_FILES = {
+    'bin/sh': (b'#!/bin/sh\n' + bytes(range(256)) * 256, 0o755),
+    'etc/os-release': (b'NAME="LCSX Test"\nID=lcsx\n', 0o644),
+    'etc/resolv.conf': (b'nameserver 192.0.2.1\n', 0o644),
+    'root/.bashrc': (b'# ~/.bashrc\n', 0o644),
+    'root/.profile': (b'# ~/.profile\n', 0o644),
+    'usr/share/doc/big.bin': (bytes(range(251)) * 2048, 0o644),
+    'usr/lib/ro/libtest.so': (b'\x7fELF' + bytes(4096), 0o644),
+}
+# Directories whose mode matters: path -> mode
+ROOTFS_DIRS = {'usr/lib/ro': 0o555}
+ROOTFS_SYMLINKS = {'usr/bin/env': '../../bin/sh', 'bin/bash': 'sh'}
+ROOTFS_HARDLINKS = {'bin/busybox': 'bin/sh'}
+
+
+def make_rootfs_tree(root):
+    """Write the test rootfs under root: files, symlinks, a hard link and a 555 directory."""
+    for path, (content, mode) in ROOTFS_FILES.items():
+        full = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as f:
+            f.write(content)
+        os.chmod(full, mode)
+    for path, target in ROOTFS_SYMLINKS.items():
+        os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+        os.symlink(target, os.path.join(root, path))
+    for path, target in ROOTFS_HARDLINKS.items():
+        os.link(os.path.join(root, target), os.path.join(root, path))
+    os.makedirs(os.path.join(root, 'dev'), exist_ok=True)
+    for path, mode in ROOTFS_DIRS.items():
+        os.chmod(os.path.join(root, path), mode)
+    return root
+
+
+def tar_bytes(root):
+    """Uncompressed tarball of the tree at root, members in sorted order, as bytes."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for name in sorted(dirnames + filenames):
+                full = os.path.join(dirpath, name)
+                tar.add(full, os.path.relpath(full, root), recursive=False)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def rootfs_tree(tmp_path):
+    """Path of a freshly written test rootfs."""
+    return make_rootfs_tree(str(tmp_path / 'tree'))
+
+
+@pytest.fixture
+def rootfs_tarball(tmp_path, rootfs_tree):
+    """Path of a single-block .tar.xz of the test rootfs."""
+    path = str(tmp_path / 'rootfs.tar.xz')
+    with open(path, 'wb') as f:
+        f.write(lzma.compress(tar_bytes(rootfs_tree)))
+    return path
+
+
+@pytest.fixture
+def lcsx_env(tmp_path):
+    """Point the artifact cache, mirrors and template store of this process into tmp_path."""
+    setup_mirrors(mirrors_file=str(tmp_path / 'mirrors.json'), probe_file=str(tmp_path / 'mirror-probes.json'))
+    setup_templates(template_dir=str(tmp_path / 'templates'), clone_method='off')
+    return setup_cache(cache_dir=str(tmp_path / 'cache'), transcode='off', seek_index=False)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves server.files (URL path -> bytes) with an ETag, answering
+    'bytes=START-[END]' ranges with 206 while server.ranges is set.
+    Every request is logged to server.requests.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        requested = self.headers.get('Range')
+        server.requests.append({'path': self.path, 'range': requested})
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        start, end = 0, len(body) - 1
+        partial = bool(server.ranges and requested)
+        if partial:
+            first, _, last = requested[len('bytes='):].partition('-')
+            start, end = int(first), min(int(last), end) if last else end
+        self.send_response(206 if partial else 200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(end - start + 1))
+        if partial:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        self.end_headers()
+        self.wfile.write(body[start:end + 1])
+
+
+@pytest.fixture
+def http_server():
+    """A local HTTP server with Range support; put files in .files, get URLs from .url(path)."""
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.files = {}
+    httpd.etag = '"v1"'
+    httpd.ranges = True
+    httpd.requests = []
+    httpd.url = lambda path: f'http://127.0.0.1:{httpd.server_address[1]}{path}'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,102 @@
+"""
+Tests for the LAN cache server.
+`lcsx cache serve` runs as its own process; this process fetches from it as a mirror, with Range.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from lcsx.core.cache import ArtifactCache
+from lcsx.core.download import DownloadManager, download_file, get_download_manager
+from lcsx.core.mirrors import setup_mirrors
+
+# Nothing listens on the origin, so every byte has to come from the cache server
+ORIGIN_URL = 'http://127.0.0.1:9/lcsx-test/rootfs.tar.xz'
+BODY = os.urandom(1024 * 1024)
+DIGEST = hashlib.sha256(BODY).hexdigest()
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def cache_server(tmp_path):
+    """Seed a cache with ORIGIN_URL and serve it from a separate lcsx process."""
+    cache_dir = str(tmp_path / 'server-cache')
+    seed = tmp_path / 'seed'
+    seed.write_bytes(BODY)
+    ArtifactCache(cache_dir).store(ORIGIN_URL, str(seed))
+
+    log_file = str(tmp_path / 'server.log')
+    env = dict(os.environ, HOME=str(tmp_path), PYTHONUNBUFFERED='1')
+    # Run outside the checkout so `-m lcsx.lcsx` does not pick up lcsx.py as the lcsx module
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'lcsx.lcsx', 'cache', 'serve', '--cache-dir', cache_dir,
+         '--host', '127.0.0.1', '--port', '0', '--no-pull', '--log-file', log_file],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env, cwd=str(tmp_path))
+    try:
+        output = []
+        for line in proc.stdout:
+            output.append(line)
+            match = re.search(r'http://127\.0\.0\.1:(\d+)', line)
+            if match:
+                break
+        else:
+            pytest.fail(f"cache server did not start:\n{''.join(output)}")
+        proc.url = f'http://127.0.0.1:{match.group(1)}'
+        proc.log_file = log_file
+        yield proc
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        proc.stdout.close()
+
+
+def test_serves_byte_ranges(cache_server):
+    source = f"{cache_server.url}/{ORIGIN_URL.split('://', 1)[1]}"
+    manager = get_download_manager()
+
+    with manager.open(source, {'Range': 'bytes=1000-1999'}) as response:
+        assert response.status == 206
+        assert response.headers['Content-Range'] == f'bytes 1000-1999/{len(BODY)}'
+        assert response.read() == BODY[1000:2000]
+        etag = response.headers['ETag']
+    assert etag == f'"{DIGEST}"'
+
+    # A stale If-Range validator gets the whole file
+    with manager.open(source, {'Range': 'bytes=1000-', 'If-Range': '"stale"'}) as response:
+        assert response.status == 200
+        assert response.read() == BODY
+
+
+def test_resumes_download_from_cache_server(cache_server, tmp_path):
+    mirrors_file = tmp_path / 'mirrors.json'
+    mirrors_file.write_text(json.dumps({'*': [cache_server.url]}))
+    setup_mirrors(mirrors_file=str(mirrors_file), probe_file=str(tmp_path / 'probes.json'))
+    source = f"{cache_server.url}/{ORIGIN_URL.split('://', 1)[1]}"
+    dest = str(tmp_path / 'rootfs.tar.xz')
+
+    def stop_after_first_chunk(received, block_size, total):
+        if received:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        download_file(ORIGIN_URL, dest, reporthook=stop_after_first_chunk, source=source)
+    kept = os.path.getsize(dest + '.part')
+    assert 0 < kept < len(BODY)
+
+    digest = DownloadManager(retry_delay=0).download(ORIGIN_URL, dest, sha256=DIGEST)
+
+    assert digest == DIGEST
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    with open(cache_server.log_file) as f:
+        log = f.read()
+    assert re.search(r'"GET /127\.0\.0\.1:9/lcsx-test/rootfs\.tar\.xz HTTP/1\.1" 206', log)
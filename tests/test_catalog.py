@@ -0,0 +1,40 @@
+"""
+Tests for the artifact catalog.
+Pins must be well formed, match the shipped binaries, and leave only sshx unpinned.
+"""
+
+import hashlib
+import os
+import re
+
+import pytest
+
+from lcsx.config.catalog import (ARCHITECTURES, ARTIFACT_SHA256, SHIPPED_LIBS, UNPINNED_URLS, missing_pins,
+                                 select_artifacts)
+
+LIBS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'libs')
+
+
+def test_pins_are_sha256_digests():
+    for url, digest in ARTIFACT_SHA256.items():
+        assert re.fullmatch(r'[0-9a-f]{64}', digest), url
+
+
+@pytest.mark.parametrize('url, name', sorted(SHIPPED_LIBS.items()))
+def test_shipped_libs_match_their_pins(url, name):
+    with open(os.path.join(LIBS_DIR, name), 'rb') as f:
+        assert hashlib.sha256(f.read()).hexdigest() == ARTIFACT_SHA256[url]
+
+
+def test_only_sshx_is_never_pinned():
+    catalog = dict(select_artifacts(list(ARCHITECTURES)))
+    unpinned = sorted(name for name, url in catalog.items() if url in UNPINNED_URLS)
+
+    assert unpinned == [f"{arch} sshx" for arch in sorted(ARCHITECTURES)]
+    assert not UNPINNED_URLS & set(ARTIFACT_SHA256)
+
+
+@pytest.mark.xfail(strict=True, reason="rootfs, gotty and apk-tools-static digests need `lcsx cache pins` "
+                                       "run with network access")
+def test_every_versioned_artifact_is_pinned():
+    assert missing_pins() == []
@@ -0,0 +1,50 @@
+"""
+Tests for the command line.
+A data directory named like a subcommand must still be usable.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+from lcsx.ui.commands import is_subcommand
+
+
+@pytest.mark.parametrize('argv, expected', [
+    ([], False),
+    (['/data/web1'], False),
+    (['--auto', 'cache'], False),
+    (['--', 'cache'], False),
+    (['cache'], True),
+    (['cache', 'serve', '--port', '8730'], True),
+    (['base', 'promote', '/data/web1', '--', 'true'], True),
+])
+def test_subcommands_without_a_directory_of_that_name(tmp_path, monkeypatch, argv, expected):
+    monkeypatch.chdir(tmp_path)
+    assert is_subcommand(argv) is expected
+
+
+@pytest.mark.parametrize('argv, expected', [
+    (['cache'], False),
+    (['cache', '--auto', '--native'], False),
+    (['cache', 'serve'], True),
+    (['cache', 'list', '--cache-dir', '/tmp/cache'], True),
+    (['base'], True),
+])
+def test_existing_directory_named_like_a_subcommand(tmp_path, monkeypatch, argv, expected):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'cache').mkdir()
+    assert is_subcommand(argv) is expected
+
+
+def run_help(cwd, *argv):
+    return subprocess.run([sys.executable, '-m', 'lcsx.lcsx', *argv, '--help'], cwd=str(cwd),
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_dispatch(tmp_path):
+    assert run_help(tmp_path, 'cache').startswith('usage: lcsx cache')
+    (tmp_path / 'cache').mkdir()
+    # The setup flow's help: ./cache is the data directory
+    assert '--auto' in run_help(tmp_path, 'cache')
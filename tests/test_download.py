@@ -0,0 +1,177 @@
+"""
+Tests for resumable and segmented downloads.
+A local http.server drops the connection mid-body; the next attempt must resume with Range/If-Range.
+"""
+
+import hashlib
+import http.server
+import os
+import threading
+import urllib.error
+
+import pytest
+
+from lcsx.core import download as lcsx_download
+from lcsx.core.download import DownloadManager, download_file, download_segmented
+from lcsx.core.mirrors import setup_mirrors
+
+BODY = os.urandom(300 * 1024)
+CUT = 100 * 1024
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves server.body, cutting the first server.drops responses after CUT
+    bytes. Range is honoured only when server.ranges is set and If-Range,
+    if sent, matches the current ETag.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append({'range': self.headers.get('Range'), 'if_range': self.headers.get('If-Range')})
+        body = server.body
+        start = 0
+        requested = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if server.ranges and requested and if_range in (None, server.etag):
+            start = int(requested[len('bytes='):].split('-')[0])
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body) - start))
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.end_headers()
+        if server.drops:
+            server.drops -= 1
+            # HTTP/1.0: the connection closes when the handler returns, short of Content-Length
+            self.wfile.write(body[start:start + CUT])
+            return
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    httpd.daemon_threads = True
+    httpd.body = BODY
+    httpd.etag = '"v1"'
+    httpd.ranges = True
+    httpd.drops = 1
+    httpd.requests = []
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/rootfs.tar.xz'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def interrupted(server, dest):
+    """Make the first attempt, which the server cuts short."""
+    with pytest.raises(urllib.error.ContentTooShortError):
+        download_file(server.url, dest)
+    assert os.path.getsize(dest + '.part') == CUT
+    assert not os.path.exists(dest)
+
+
+def test_resumes_with_range_and_if_range(server, tmp_path):
+    dest = str(tmp_path / 'rootfs.tar.xz')
+    interrupted(server, dest)
+
+    digest = download_file(server.url, dest)
+
+    assert server.requests[1] == {'range': f'bytes={CUT}-', 'if_range': '"v1"'}
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+    assert not os.path.exists(dest + '.part')
+    assert not os.path.exists(dest + '.part.json')
+
+
+def test_changed_file_is_fetched_in_full(server, tmp_path):
+    dest = str(tmp_path / 'rootfs.tar.xz')
+    interrupted(server, dest)
+    server.body = os.urandom(len(BODY))
+    server.etag = '"v2"'
+
+    digest = download_file(server.url, dest)
+
+    # If-Range carried the old ETag, so the server answered 200 with the new file
+    assert server.requests[1]['if_range'] == '"v1"'
+    assert digest == hashlib.sha256(server.body).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == server.body
+
+
+def test_restarts_when_range_is_ignored(server, tmp_path):
+    dest = str(tmp_path / 'rootfs.tar.xz')
+    server.ranges = False
+    interrupted(server, dest)
+
+    digest = download_file(server.url, dest)
+
+    assert server.requests[1]['range'] == f'bytes={CUT}-'
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_retries_resume_until_complete(server, tmp_path):
+    setup_mirrors(mirrors_file=str(tmp_path / 'mirrors.json'), probe_file=str(tmp_path / 'probes.json'))
+    server.drops = 2
+    dest = str(tmp_path / 'rootfs.tar.xz')
+
+    digest = DownloadManager(retry_delay=0).download(server.url, dest, sha256=hashlib.sha256(BODY).hexdigest())
+
+    assert [r['range'] for r in server.requests] == [None, f'bytes={CUT}-', f'bytes={2 * CUT}-']
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_segmented_download_writes_ranges_in_place(lcsx_env, http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(lcsx_download, 'MIN_SEGMENT_SIZE', 64 * 1024)
+    body = os.urandom(1024 * 1024 + 3)
+    http_server.files['/rootfs.tar.xz'] = body
+    writes = []
+    pwrite = os.pwrite
+
+    def spy(fd, data, offset):
+        writes.append((offset, len(data)))
+        return pwrite(fd, data, offset)
+
+    monkeypatch.setattr(os, 'pwrite', spy)
+    dest = str(tmp_path / 'rootfs.tar.xz')
+
+    digest = download_segmented(http_server.url('/rootfs.tar.xz'), dest, segments=4)
+
+    assert digest == hashlib.sha256(body).hexdigest()
+    with open(dest, 'rb') as f:
+        assert f.read() == body
+    ranges = [request['range'] for request in http_server.requests]
+    assert ranges[0] == 'bytes=0-0'
+    assert sorted(ranges[1:]) == ['bytes=0-262143', 'bytes=262144-524287', 'bytes=524288-786431',
+                                  'bytes=786432-1048578']
+    # Every byte was written once, at its own offset
+    assert sorted(writes) == sorted(set(writes))
+    assert sum(size for _, size in writes) == len(body)
+    assert not os.path.exists(dest + '.part.json')
+
+
+def test_segmented_download_falls_back_without_range_support(lcsx_env, http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(lcsx_download, 'MIN_SEGMENT_SIZE', 64 * 1024)
+    body = os.urandom(512 * 1024)
+    http_server.files['/rootfs.tar.xz'] = body
+    http_server.ranges = False
+    dest = str(tmp_path / 'rootfs.tar.xz')
+
+    digest = download_segmented(http_server.url('/rootfs.tar.xz'), dest, segments=4)
+
+    assert digest == hashlib.sha256(body).hexdigest()
+    # The probe got the whole file back with a 200, so one plain request follows
+    assert [request['range'] for request in http_server.requests] == ['bytes=0-0', None]
+    with open(dest, 'rb') as f:
+        assert f.read() == body
@@ -0,0 +1,185 @@
+"""
+Tests for archive extraction.
+The native archivers and the in-process extractor must leave the same tree on disk.
+"""
+
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import urllib.request
+
+import pytest
+
+from conftest import tar_bytes
+from lcsx.core import archiver
+from lcsx.core import extract as lcsx_extract
+from lcsx.core.archiver import NativeExtractError, NativeExtractor, list_native_extractors
+from lcsx.core.extract import extract_archive, extract_tar_stream
+
+
+def native_extractors():
+    return [pytest.param(extractor, id=extractor.name) for extractor in list_native_extractors('xz')]
+
+
+@pytest.fixture
+def archive(rootfs_tree, tmp_path):
+    """The test rootfs with a dev/null device node added, as a .tar.xz."""
+    with tarfile.open(fileobj=io.BytesIO(tar_bytes(rootfs_tree)), mode='r') as source:
+        members = [(member, source.extractfile(member).read() if member.isreg() else None)
+                   for member in source.getmembers()]
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        for member, data in members:
+            tar.addfile(member, io.BytesIO(data) if data is not None else None)
+        null = tarfile.TarInfo('dev/null')
+        null.type, null.mode, null.devmajor, null.devminor = tarfile.CHRTYPE, 0o666, 1, 3
+        tar.addfile(null)
+    path = str(tmp_path / 'rootfs.tar.xz')
+    with open(path, 'wb') as f:
+        f.write(lzma.compress(out.getvalue()))
+    return path
+
+
+def snapshot(root):
+    """Type, mode, owner, mtime and content of every entry under root, plus the hard link groups."""
+    entries = {}
+    inodes = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            full = os.path.join(dirpath, name)
+            path = os.path.relpath(full, root)
+            st = os.lstat(full)
+            if stat.S_ISLNK(st.st_mode):
+                content = os.readlink(full)
+            elif stat.S_ISREG(st.st_mode):
+                with open(full, 'rb') as f:
+                    content = hashlib.sha256(f.read()).hexdigest()
+                inodes.setdefault(st.st_ino, set()).add(path)
+            else:
+                content = None
+            mtime = None if stat.S_ISLNK(st.st_mode) else int(st.st_mtime)
+            entries[path] = (stat.S_IFMT(st.st_mode), stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid, mtime, content)
+    links = sorted(sorted(paths) for paths in inodes.values() if len(paths) > 1)
+    return entries, links
+
+
+@pytest.mark.parametrize('extractor', native_extractors())
+def test_native_and_python_extraction_match(archive, tmp_path, extractor):
+    python_dir = str(tmp_path / 'python')
+    native_dir = str(tmp_path / 'native')
+    extract_tar_stream(archive, python_dir)
+    extractor.extract(archive, native_dir)
+
+    entries, links = snapshot(python_dir)
+
+    assert snapshot(native_dir) == (entries, links)
+    assert links == [['bin/busybox', 'bin/sh']]
+    assert entries['usr/lib/ro'][1] == 0o555
+    assert entries['usr/bin/env'][5] == '../../bin/sh'
+    assert 'dev/null' not in entries and 'dev' in entries
+
+
+def test_extracts_a_download_in_one_pass(archive, http_server, tmp_path, monkeypatch):
+    with open(archive, 'rb') as f:
+        http_server.files['/rootfs.tar.xz'] = f.read()
+    opened = []
+    tarfile_open = tarfile.open
+
+    def track(*args, **kwargs):
+        opened.append(tarfile_open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(tarfile, 'open', track)
+    # Random access would decode the xz stream a second time
+    monkeypatch.setattr(tarfile.TarFile, 'getmembers', None)
+    monkeypatch.setattr(tarfile.TarFile, 'extractall', None)
+    dest = str(tmp_path / 'out')
+
+    with urllib.request.urlopen(http_server.url('/rootfs.tar.xz')) as response:
+        count = extract_tar_stream(response, dest)
+
+    monkeypatch.undo()
+    python_dir = str(tmp_path / 'from-file')
+    extract_tar_stream(archive, python_dir)
+    assert snapshot(dest) == snapshot(python_dir)
+    assert count == len(snapshot(dest)[0])
+    # No TarInfo is kept once its member is on disk
+    assert opened[0].members == []
+    assert len(http_server.requests) == 1
+
+
+@pytest.mark.skipif(os.geteuid() != 0 or shutil.which('setpriv') is None,
+                    reason="needs root and setpriv to run tar as an unprivileged user")
+@pytest.mark.parametrize('extractor', native_extractors())
+def test_unprivileged_native_extraction_skips_device_nodes(extractor):
+    """Device nodes outside dev/ cannot be excluded by name; tar failing only on them is not an error."""
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w', format=tarfile.GNU_FORMAT) as tar:
+        data = b'#!/bin/sh\n'
+        sh = tarfile.TarInfo('bin/sh')
+        sh.size, sh.mode = len(data), 0o755
+        tar.addfile(sh, io.BytesIO(data))
+        null = tarfile.TarInfo('lib/udev/null')
+        null.type, null.mode, null.devmajor, null.devminor = tarfile.CHRTYPE, 0o666, 1, 3
+        tar.addfile(null)
+    scratch = tempfile.mkdtemp(prefix='lcsx-unprivileged-')
+    try:
+        dest_dir = os.path.join(scratch, 'out')
+        os.mkdir(dest_dir)
+        # The nobody user must be able to read the archive and write the tree
+        os.chmod(scratch, 0o755)
+        os.chmod(dest_dir, 0o777)
+        path = os.path.join(scratch, 'rootfs.tar.xz')
+        with open(path, 'wb') as f:
+            f.write(lzma.compress(out.getvalue()))
+        tar_command = ['setpriv', '--reuid=65534', '--regid=65534', '--clear-groups'] + extractor.tar_command
+        NativeExtractor(extractor.name, tar_command, extractor.decompress_command, skip_devices=True).extract(
+            path, dest_dir)
+
+        assert os.path.isfile(os.path.join(dest_dir, 'bin', 'sh'))
+        assert not os.path.lexists(os.path.join(dest_dir, 'lib', 'udev', 'null'))
+    finally:
+        shutil.rmtree(scratch)
+
+
+def test_python_backend_when_no_tar_is_installed(archive, tmp_path, monkeypatch):
+    monkeypatch.setattr(archiver, '_detected', {})
+    assert list_native_extractors('xz') == []
+
+    assert extract_archive(archive, str(tmp_path / 'out')) == 'python'
+    assert os.path.islink(str(tmp_path / 'out' / 'bin' / 'bash'))
+
+
+def test_failing_native_extractor_falls_back_for_files_only(archive, tmp_path, monkeypatch):
+    broken = NativeExtractor('broken tar', ['false'])
+    monkeypatch.setattr(lcsx_extract, 'find_native_extractor', lambda compression, exclude_dev=True: broken)
+
+    assert extract_archive(archive, str(tmp_path / 'out')) == 'python'
+    assert snapshot(str(tmp_path / 'out'))[1] == [['bin/busybox', 'bin/sh']]
+    # A stream cannot be read a second time
+    with open(archive, 'rb') as f, pytest.raises(NativeExtractError, match='broken tar'):
+        extract_archive(f, str(tmp_path / 'stream'))
+
+
+@pytest.mark.parametrize('lines, expected', [
+    (["tar: lib/udev/null: Cannot mknod: Operation not permitted",
+      "tar: Exiting with failure status due to previous errors"], True),
+    (["lib/udev/null: Can't create 'lib/udev/null': Operation not permitted",
+      "bsdtar: Error exit delayed from previous errors."], True),
+    (["tar: lib/udev/null: Cannot mknod: Operation not permitted",
+      "tar: usr/bin/env: Cannot create symlink to '../../bin/sh': No space left on device",
+      "tar: Exiting with failure status due to previous errors"], False),
+    (["bsdtar: lib/null: Can't create 'lib/null': No space left on device"], False),
+    (["tar: Exiting with failure status due to previous errors"], False),
+])
+def test_device_errors_are_recognised(lines, expected):
+    extractor = NativeExtractor('tar', ['tar'], skip_devices=True)
+    assert extractor._only_device_errors([2], lines) is expected
+    # The decompressor failing, or device nodes not being skipped, is always an error
+    assert extractor._only_device_errors([1, 2], lines) is False
+    assert NativeExtractor('tar', ['tar'])._only_device_errors([2], lines) is False
@@ -0,0 +1,103 @@
+"""
+Tests for layered rootfs bases.
+Base versions that instances still run on must not be removed.
+"""
+
+import json
+import os
+import shutil
+
+import pytest
+
+from lcsx.core.layers import BaseStore, LayerError, base_root, create_layer
+from lcsx.ui.commands import base_command
+
+URL = 'https://example.invalid/lcsx-test/rootfs.tar.xz'
+NAME = 'rootfs'
+
+
+@pytest.fixture
+def store(tmp_path, rootfs_tree):
+    def extract(rootfs_dir):
+        shutil.copytree(rootfs_tree, rootfs_dir, symlinks=True, dirs_exist_ok=True)
+
+    store = BaseStore(str(tmp_path / 'bases'))
+    store.build(URL, 'sha', extract)
+    return store
+
+
+def set_up_instance(store, version_dir, data_dir):
+    """Create a layered instance on version_dir the way setup does."""
+    create_layer(base_root(version_dir), os.path.join(data_dir, 'rootfs'))
+    store.register(version_dir, data_dir)
+    with open(os.path.join(data_dir, 'config.json'), 'w') as f:
+        json.dump({'rootfs': os.path.join(data_dir, 'rootfs'), 'rootfs_base': base_root(version_dir)}, f)
+
+
+def move_instance(store, version_dir, data_dir):
+    store.register(version_dir, data_dir)
+    with open(os.path.join(data_dir, 'config.json'), 'w') as f:
+        json.dump({'rootfs': os.path.join(data_dir, 'rootfs'), 'rootfs_base': base_root(version_dir)}, f)
+
+
+@pytest.fixture
+def promoted(store, tmp_path):
+    """An instance left on v1 after v2 was promoted."""
+    v1 = store.current(URL)
+    data_dir = str(tmp_path / 'web1')
+    set_up_instance(store, v1, data_dir)
+    v2 = store.promote(v1, lambda root: 0, command='true')
+    return v1, v2, data_dir
+
+
+def test_build_publishes_v1(store):
+    assert [(name, version) for name, version, _, _ in store.entries()] == [(NAME, 'v1')]
+
+
+def test_remove_refuses_a_version_in_use(store, promoted):
+    v1, v2, data_dir = promoted
+    assert store.users(NAME, 'v1') == [data_dir]
+
+    with pytest.raises(LayerError, match='web1'):
+        store.remove(NAME, 'v1')
+    assert os.path.isdir(v1)
+    assert base_command(['remove', NAME, 'v1', '--base-dir', store.base_dir]) == 1
+    assert os.path.isdir(v1)
+
+
+def test_remove_after_rebase(store, promoted):
+    v1, v2, data_dir = promoted
+    move_instance(store, v2, data_dir)
+
+    assert store.users(NAME, 'v1') == []
+    assert store.remove(NAME, 'v1') == []
+    assert not os.path.exists(v1)
+    assert store.users(NAME, 'v2') == [data_dir]
+
+
+def test_remove_ignores_deleted_instances(store, promoted):
+    v1, v2, data_dir = promoted
+    shutil.rmtree(data_dir)
+
+    assert base_command(['remove', NAME, 'v1', '--base-dir', store.base_dir]) == 0
+    assert not os.path.exists(v1)
+
+
+def test_force_removes_a_version_in_use(store, promoted):
+    v1, v2, data_dir = promoted
+
+    assert store.remove(NAME, 'v1', force=True) == [data_dir]
+    assert not os.path.exists(v1)
+    with pytest.raises(LayerError):
+        store.register(v1, data_dir)
+
+
+def test_instance_being_set_up_counts(store, promoted, tmp_path):
+    v1, v2, data_dir = promoted
+    move_instance(store, v2, data_dir)
+    # Registered on v1 but its config is not written yet
+    other = str(tmp_path / 'web2')
+    create_layer(base_root(v1), os.path.join(other, 'rootfs'))
+    store.register(v1, other)
+
+    assert store.users(NAME, 'v1') == [other]
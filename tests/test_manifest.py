@@ -0,0 +1,104 @@
+"""
+Tests for rootfs manifests.
+A manifest is built from the test rootfs, written, loaded back and used to find damage.
+"""
+
+import os
+import stat
+
+import pytest
+
+from lcsx.core import manifest as lcsx_manifest
+from lcsx.core.manifest import (Manifest, build_manifest, load_manifest, manifest_path, record_manifest,
+                                verify_rootfs)
+
+SHA256 = 'ab' * 32
+
+
+def verify(rootfs, hash_mode='none'):
+    report = verify_rootfs(rootfs, hash_mode=hash_mode, workers=1)
+    return report['missing'], report['modified']
+
+
+@pytest.fixture
+def recorded(rootfs_tree):
+    record_manifest(rootfs_tree, workers=1, source_sha256=SHA256)
+    return rootfs_tree
+
+
+def test_build_write_load_round_trip(rootfs_tree, tmp_path):
+    manifest = build_manifest(rootfs_tree, workers=1, source_sha256=SHA256)
+    path = str(tmp_path / 'rootfs.manifest')
+    manifest.write(path)
+
+    loaded = Manifest.load(path)
+
+    assert loaded.paths == sorted(loaded.paths)
+    assert [loaded.entry(i) for i in range(len(loaded))] == [manifest.entry(i) for i in range(len(manifest))]
+    assert loaded.source_sha256 == SHA256
+    index = loaded.find('usr/bin/env')
+    assert stat.S_ISLNK(loaded.modes[index])
+    assert loaded.find('usr/share/doc/big.bin') is not None and loaded.find('nope') is None
+    # Hard links are listed once per path, with the same content hash
+    assert loaded.entry(loaded.find('bin/busybox'))[4] == loaded.entry(loaded.find('bin/sh'))[4]
+
+
+def test_load_rejects_damaged_files(recorded):
+    path = manifest_path(recorded)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+    with pytest.raises(ValueError, match='Truncated'):
+        Manifest.load(path)
+    # setup and verify treat an unreadable manifest as no manifest
+    assert load_manifest(recorded) is None
+    assert verify_rootfs(recorded) is None
+
+
+def test_clean_tree_verifies(recorded):
+    assert verify(recorded, 'full') == ([], [])
+
+
+def test_pool_and_in_process_agree(recorded, monkeypatch):
+    # The test tree fits one chunk; split it so that both workers get some
+    monkeypatch.setattr(lcsx_manifest, '_chunks', lambda items: [items[i:i + 4] for i in range(0, len(items), 4)])
+    os.remove(os.path.join(recorded, 'etc', 'os-release'))
+    report = verify_rootfs(recorded, hash_mode='full', workers=2)
+    assert (report['missing'], report['modified']) == verify(recorded, 'full')
+
+
+def test_detects_missing_size_and_mode_changes(recorded):
+    os.remove(os.path.join(recorded, 'etc', 'os-release'))
+    with open(os.path.join(recorded, 'usr', 'share', 'doc', 'big.bin'), 'ab') as f:
+        f.write(b'more')
+    os.chmod(os.path.join(recorded, 'bin', 'sh'), 0o700)
+    os.chmod(os.path.join(recorded, 'usr', 'lib', 'ro'), 0o755)
+
+    missing, modified = verify(recorded)
+
+    assert missing == ['etc/os-release']
+    # bin/busybox is a hard link to bin/sh and shares its mode
+    assert sorted(modified) == ['bin/busybox', 'bin/sh', 'usr/lib/ro', 'usr/share/doc/big.bin']
+
+
+def test_same_size_and_mtime_change_needs_a_full_hash(recorded):
+    path = os.path.join(recorded, 'usr', 'share', 'doc', 'big.bin')
+    st = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.seek(1000)
+        f.write(b'\0\0\0\0')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    assert verify(recorded, 'none') == ([], [])
+    assert verify(recorded, 'full') == ([], ['usr/share/doc/big.bin'])
+
+
+def test_instance_state_is_reported_separately(recorded):
+    with open(os.path.join(recorded, 'etc', 'resolv.conf'), 'w') as f:
+        f.write('nameserver 8.8.8.8\n')
+
+    report = verify_rootfs(recorded, hash_mode='none', workers=1)
+
+    assert report['modified'] == []
+    assert report['state'] == ['etc/resolv.conf']
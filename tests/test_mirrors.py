@@ -0,0 +1,138 @@
+"""
+Tests for mirror selection.
+Candidates come from a temporary mirrors.json and are ranked with a fake probe.
+"""
+
+import json
+import time
+
+import pytest
+
+from lcsx.core.mirrors import MirrorSelector
+
+ORIGIN = 'https://origin.invalid/releases'
+URL = f'{ORIGIN}/v1/rootfs.tar.xz'
+SERVER = 'http://cache.lan:8730'
+SERVER_URL = f'{SERVER}/origin.invalid/releases/v1/rootfs.tar.xz'
+
+
+class FakeProbe:
+    """Probe returning fixed (latency, rate) per candidate URL; None means unreachable."""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def __call__(self, candidate):
+        self.calls.append(candidate)
+        result = self.results[candidate]
+        if result is None:
+            raise OSError("connection refused")
+        return result
+
+
+@pytest.fixture
+def selector(tmp_path):
+    def make(mirrors, ttl=3600):
+        mirrors_file = tmp_path / 'mirrors.json'
+        mirrors_file.write_text(json.dumps(mirrors))
+        return MirrorSelector(str(mirrors_file), str(tmp_path / 'probes.json'), ttl)
+    return make
+
+
+def test_candidates_use_the_longest_prefix(selector):
+    mirrors = selector({
+        'https://origin.invalid': ['http://wide.lan'],
+        ORIGIN + '/': ['file:///srv/releases/', 'http://near.lan/releases'],
+    })
+
+    assert mirrors.candidates(URL) == [
+        ('file:///srv/releases', 'file:///srv/releases/v1/rootfs.tar.xz'),
+        ('http://near.lan/releases', 'http://near.lan/releases/v1/rootfs.tar.xz'),
+        (ORIGIN, URL),
+    ]
+    # A prefix only matches whole path components
+    assert mirrors.candidates('https://origin.invalid/releases-old/x') == [
+        ('http://wide.lan', 'http://wide.lan/releases-old/x'),
+        ('https://origin.invalid', 'https://origin.invalid/releases-old/x'),
+    ]
+    assert mirrors.candidates('https://elsewhere.invalid/x') == [('https://elsewhere.invalid/x',) * 2]
+
+
+def test_origin_comes_last_unless_listed(selector):
+    mirrors = selector({ORIGIN: [ORIGIN, 'http://near.lan/releases']})
+
+    assert [base for base, _ in mirrors.candidates(URL)] == [ORIGIN, 'http://near.lan/releases']
+
+
+def test_cache_servers_come_first(selector):
+    mirrors = selector({'*': [SERVER], ORIGIN: ['http://near.lan/releases']})
+
+    assert [candidate for _, candidate in mirrors.candidates(URL)] == [
+        SERVER_URL, 'http://near.lan/releases/v1/rootfs.tar.xz', URL]
+    # file:// artifacts are never served by a cache server
+    assert mirrors.candidates('file:///srv/rootfs.tar.xz') == [('file:///srv/rootfs.tar.xz',) * 2]
+
+
+def test_rank_prefers_cache_servers_then_speed(selector):
+    mirrors = selector({'*': [SERVER], ORIGIN: ['http://near.lan/releases', 'http://far.lan/releases']})
+    probe = FakeProbe({
+        SERVER_URL: (0.2, 1024 * 1024),
+        'http://near.lan/releases/v1/rootfs.tar.xz': (0.01, 50 * 1024 * 1024),
+        'http://far.lan/releases/v1/rootfs.tar.xz': (0.1, 10 * 1024 * 1024),
+        URL: (0.05, 20 * 1024 * 1024),
+    })
+
+    assert mirrors.rank(URL, probe) == [SERVER_URL, 'http://near.lan/releases/v1/rootfs.tar.xz', URL,
+                                        'http://far.lan/releases/v1/rootfs.tar.xz']
+
+
+def test_unreachable_candidates_keep_configured_order(selector):
+    mirrors = selector({ORIGIN: ['http://a.lan/releases', 'http://b.lan/releases', 'http://c.lan/releases']})
+    probe = FakeProbe({
+        'http://a.lan/releases/v1/rootfs.tar.xz': None,
+        'http://b.lan/releases/v1/rootfs.tar.xz': (0.5, 1024 * 1024),
+        'http://c.lan/releases/v1/rootfs.tar.xz': None,
+        URL: None,
+    })
+
+    assert mirrors.rank(URL, probe) == ['http://b.lan/releases/v1/rootfs.tar.xz',
+                                        'http://a.lan/releases/v1/rootfs.tar.xz',
+                                        'http://c.lan/releases/v1/rootfs.tar.xz', URL]
+
+
+def test_probe_results_are_kept_for_the_ttl(selector, tmp_path):
+    mirrors = selector({ORIGIN: ['http://near.lan/releases']}, ttl=3600)
+    probe = FakeProbe({'http://near.lan/releases/v1/rootfs.tar.xz': (0.01, 1e8), URL: (0.1, 1e6)})
+
+    first = mirrors.rank(URL, probe)
+    assert len(probe.calls) == 2
+    # Another artifact under the same mirror reuses the result
+    assert mirrors.rank(URL, probe) == first
+    assert mirrors.rank(f'{ORIGIN}/v2/rootfs.tar.xz', probe)[0] == 'http://near.lan/releases/v2/rootfs.tar.xz'
+    assert len(probe.calls) == 2
+
+    probes_file = tmp_path / 'probes.json'
+    probes = json.loads(probes_file.read_text())
+    probes[ORIGIN]['checked'] = time.time() - 7200
+    probes_file.write_text(json.dumps(probes))
+    mirrors.rank(URL, probe)
+    assert probe.calls[2:] == [URL]
+
+
+def test_single_candidate_is_not_probed(selector):
+    probe = FakeProbe({})
+    assert selector({}).rank(URL, probe) == [URL]
+    assert probe.calls == []
+
+
+def test_mark_failed_ranks_a_mirror_last(selector):
+    mirrors = selector({ORIGIN: ['http://near.lan/releases']})
+    near = 'http://near.lan/releases/v1/rootfs.tar.xz'
+    probe = FakeProbe({near: (0.01, 1e8), URL: (0.1, 1e6)})
+    assert mirrors.rank(URL, probe) == [near, URL]
+
+    mirrors.mark_failed(URL, near)
+
+    assert mirrors.rank(URL, probe) == [URL, near]
+    assert len(probe.calls) == 2
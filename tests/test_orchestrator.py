@@ -0,0 +1,148 @@
+"""
+Tests for setup orchestration.
+Phases must start only after their dependencies, and a failure must stop whatever depends on it.
+"""
+
+import threading
+import time
+
+import pytest
+
+from lcsx.core import setup as lcsx_setup
+from lcsx.core.orchestrator import SetupScheduler
+
+
+class Recorder:
+    """Phase callables that log when they start and finish."""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _log(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def phase(self, name, seconds=0.0, error=None):
+        def run():
+            self._log(('start', name))
+            time.sleep(seconds)
+            if error is not None:
+                raise error
+            self._log(('end', name))
+            return name
+        return run
+
+    def started(self):
+        return [name for event, name in self.events if event == 'start']
+
+    def position(self, event, name):
+        return self.events.index((event, name))
+
+
+def test_phases_wait_for_their_dependencies():
+    recorder = Recorder()
+    scheduler = SetupScheduler()
+    # proot finishes well before the rootfs, so the packages must wait for the slower one
+    scheduler.add_phase('rootfs', recorder.phase('rootfs', 0.2), priority=10)
+    scheduler.add_phase('proot', recorder.phase('proot', 0.05))
+    scheduler.add_phase('terminal', recorder.phase('terminal'))
+    scheduler.add_phase('alpine-packages', recorder.phase('alpine-packages'), deps=['rootfs', 'proot'])
+    scheduler.add_phase('prompt', recorder.phase('prompt'), deps=['rootfs', 'alpine-packages'])
+
+    results = scheduler.run()
+
+    assert results == {name: name for name in scheduler.phases}
+    assert set(recorder.started()[:3]) == {'rootfs', 'proot', 'terminal'}
+    assert recorder.position('end', 'rootfs') < recorder.position('start', 'alpine-packages')
+    assert recorder.position('end', 'proot') < recorder.position('start', 'alpine-packages')
+    assert recorder.position('end', 'alpine-packages') < recorder.position('start', 'prompt')
+    assert set(scheduler.timings) == set(scheduler.phases)
+
+
+def test_higher_priority_starts_first():
+    recorder = Recorder()
+    scheduler = SetupScheduler(max_workers=1)
+    scheduler.add_phase('proot', recorder.phase('proot'))
+    scheduler.add_phase('rootfs', recorder.phase('rootfs'), priority=10)
+    scheduler.add_phase('terminal', recorder.phase('terminal'), priority=5)
+
+    scheduler.run()
+
+    assert recorder.started() == ['rootfs', 'terminal', 'proot']
+
+
+def test_failure_cancels_dependents():
+    recorder = Recorder()
+    scheduler = SetupScheduler()
+    scheduler.add_phase('rootfs', recorder.phase('rootfs', error=OSError("disk full")))
+    # Already running when the rootfs fails, so it is allowed to finish
+    scheduler.add_phase('proot', recorder.phase('proot', 0.1))
+    scheduler.add_phase('alpine-packages', recorder.phase('alpine-packages'), deps=['rootfs', 'proot'])
+    scheduler.add_phase('prompt', recorder.phase('prompt'), deps=['rootfs'])
+
+    with pytest.raises(OSError, match='disk full'):
+        scheduler.run()
+
+    assert sorted(recorder.started()) == ['proot', 'rootfs']
+    assert ('end', 'proot') in recorder.events
+
+
+def test_independent_phase_is_not_started_after_a_failure():
+    recorder = Recorder()
+    scheduler = SetupScheduler(max_workers=1)
+    scheduler.add_phase('rootfs', recorder.phase('rootfs', error=ValueError("bad tarball")), priority=10)
+    scheduler.add_phase('terminal', recorder.phase('terminal'))
+
+    with pytest.raises(ValueError):
+        scheduler.run()
+
+    assert recorder.started() == ['rootfs']
+
+
+def test_cycle_and_unknown_dependency_are_rejected():
+    recorder = Recorder()
+    scheduler = SetupScheduler()
+    scheduler.add_phase('a', recorder.phase('a'), deps=['c'])
+    scheduler.add_phase('b', recorder.phase('b'), deps=['a'])
+    scheduler.add_phase('c', recorder.phase('c'), deps=['b'])
+    scheduler.add_phase('d', recorder.phase('d'))
+    with pytest.raises(ValueError, match='cycle: a, b, c'):
+        scheduler.run()
+
+    scheduler = SetupScheduler()
+    scheduler.add_phase('prompt', recorder.phase('prompt'), deps=['rootfs'])
+    with pytest.raises(ValueError, match="unknown phase.*rootfs"):
+        scheduler.run()
+    with pytest.raises(ValueError, match='Duplicate'):
+        scheduler.add_phase('prompt', recorder.phase('prompt'))
+
+    assert recorder.events == []
+
+
+def test_setup_environment_orders_alpine_phases(tmp_path, monkeypatch):
+    recorder = Recorder()
+    rootfs = str(tmp_path / 'data' / 'rootfs')
+
+    def prepare_rootfs(url, data_dir, shell):
+        recorder.phase('rootfs', 0.1)()
+        return rootfs
+
+    monkeypatch.setattr(lcsx_setup, 'get_rootfs_layout', lambda: 'copy')
+    monkeypatch.setattr(lcsx_setup, 'prepare_rootfs', prepare_rootfs)
+    monkeypatch.setattr(lcsx_setup, 'setup_proot_binary', lambda data_dir, proot_bin: recorder.phase('proot')())
+    monkeypatch.setattr(lcsx_setup, 'setup_terminal_binary', lambda config: recorder.phase('terminal')())
+    monkeypatch.setattr(lcsx_setup, 'install_alpine_packages',
+                        lambda path, proot_bin, data_dir: recorder.phase('alpine-packages')())
+    monkeypatch.setattr(lcsx_setup, 'set_shell_prompt',
+                        lambda path, user, hostname, shell: recorder.phase('prompt')())
+    config = {'distro_url': 'https://example.invalid/alpine-minirootfs.tar.gz', 'proot_bin': 'proot',
+              'data_dir': str(tmp_path / 'data'), 'shell': '/bin/sh', 'user': 'root', 'hostname': 'lcsx'}
+
+    lcsx_setup.setup_environment(config)
+
+    assert config['rootfs'] == rootfs
+    assert recorder.started()[0] == 'rootfs'
+    assert recorder.position('end', 'rootfs') < recorder.position('start', 'alpine-packages')
+    assert recorder.position('end', 'proot') < recorder.position('start', 'alpine-packages')
+    assert recorder.position('end', 'alpine-packages') < recorder.position('start', 'prompt')
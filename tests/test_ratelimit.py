@@ -0,0 +1,99 @@
+"""
+Tests for download rate limiting.
+Peers are simulated with heartbeat files in a temporary coordination directory.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from lcsx.config.constants import RATE_LIMIT_PEER_TIMEOUT
+from lcsx.core import ratelimit
+from lcsx.core.ratelimit import RateLimiter
+
+KB = 1024
+
+
+@pytest.fixture
+def coord_dir(tmp_path):
+    return str(tmp_path / 'ratelimit')
+
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_peer(coord_dir, pid, rate, age=0.0):
+    os.makedirs(coord_dir, exist_ok=True)
+    path = os.path.join(coord_dir, f'{pid}.json')
+    with open(path, 'w') as f:
+        json.dump({'pid': pid, 'rate': rate, 'updated': time.time() - age}, f)
+    return path
+
+
+def test_consume_keeps_to_the_rate(coord_dir):
+    rate = 400 * KB
+    limiter = RateLimiter(rate, coord_dir)
+    total = 200 * KB
+    started = time.monotonic()
+
+    waited = sum(limiter.consume(8 * KB) for _ in range(total // (8 * KB)))
+
+    elapsed = time.monotonic() - started
+    # The bucket starts full with a quarter second of burst
+    expected = (total - rate / 4) / rate
+    assert expected * 0.9 <= elapsed < expected + 0.25
+    assert waited == pytest.approx(elapsed, abs=0.05)
+    limiter.close()
+
+
+def test_share_is_split_between_active_peers(coord_dir):
+    # Our parent process is alive; its heartbeat says it downloads at 100 KB/s
+    write_peer(coord_dir, os.getppid(), 100 * KB)
+    limiter = RateLimiter(300 * KB, coord_dir)
+
+    limiter.consume(0)
+
+    assert limiter.peers == 2
+    assert limiter.share == 50 * KB
+    with open(os.path.join(coord_dir, f'{os.getpid()}.json')) as f:
+        assert json.load(f)['rate'] == 300 * KB
+    limiter.close()
+    assert not os.path.exists(os.path.join(coord_dir, f'{os.getpid()}.json'))
+
+
+def test_stale_and_dead_peers_are_not_counted(coord_dir, dead_pid):
+    stale = write_peer(coord_dir, os.getppid(), 100 * KB, age=RATE_LIMIT_PEER_TIMEOUT + 5)
+    dead = write_peer(coord_dir, dead_pid, 100 * KB)
+    with open(os.path.join(coord_dir, 'garbage.json'), 'w') as f:
+        f.write('{not json')
+    limiter = RateLimiter(300 * KB, coord_dir)
+
+    limiter.consume(0)
+
+    assert (limiter.peers, limiter.share) == (1, 300 * KB)
+    # A dead peer's file is cleaned up; an idle live peer may resume and keeps its file
+    assert not os.path.exists(dead)
+    assert os.path.exists(stale)
+    limiter.close()
+
+
+def test_share_returns_when_a_peer_leaves(coord_dir, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_HEARTBEAT', 0)
+    peer = write_peer(coord_dir, os.getppid(), 300 * KB)
+    limiter = RateLimiter(300 * KB, coord_dir)
+    limiter.consume(0)
+    assert limiter.share == 150 * KB
+
+    os.remove(peer)
+    limiter.consume(0)
+
+    assert (limiter.peers, limiter.share) == (1, 300 * KB)
+    limiter.close()
@@ -0,0 +1,119 @@
+"""
+Tests for rootfs repair.
+An instance is set up from a local tarball, damaged and repaired from each kind of cached source.
+"""
+
+import os
+import stat
+
+import pytest
+
+from conftest import ROOTFS_FILES
+from lcsx.core.manifest import build_manifest, load_manifest
+from lcsx.core.repair import _clear, _writable_parents, find_repair_source, repair_rootfs
+from lcsx.core.seekable import build_seek_index
+from lcsx.core.setup import prepare_rootfs
+from lcsx.core.transcode import transcode_blob
+
+
+def mode_of(path):
+    return stat.S_IMODE(os.lstat(path).st_mode)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def instance(lcsx_env, rootfs_tarball, tmp_path):
+    """Rootfs directory of an instance set up from the test tarball, and the sha256 of that tarball."""
+    data_dir = str(tmp_path / 'data')
+    prepare_rootfs('file://' + rootfs_tarball, data_dir, shell='/bin/sh')
+    rootfs_dir = os.path.join(data_dir, 'rootfs')
+    return rootfs_dir, load_manifest(rootfs_dir).source_sha256
+
+
+def make_source(cache, digest, source):
+    if source == 'index':
+        assert build_seek_index(cache, digest, threads=1)
+    elif source == 'r:':
+        assert transcode_blob(cache, digest, 'tar')
+
+
+@pytest.mark.parametrize('source', ['index', 'r:', 'r|xz'])
+def test_repair_from_each_source(lcsx_env, instance, source):
+    rootfs_dir, digest = instance
+    make_source(lcsx_env, digest, source)
+    assert find_repair_source(digest)[1] == source
+    # bin/sh is a hard link to bin/busybox in the tarball; libtest.so sits in a 555 directory
+    os.remove(os.path.join(rootfs_dir, 'bin', 'sh'))
+    os.remove(os.path.join(rootfs_dir, 'usr', 'lib', 'ro', 'libtest.so'))
+
+    result = repair_rootfs(rootfs_dir)
+
+    assert result['damaged'] == ['bin/sh', 'usr/lib/ro/libtest.so']
+    assert result['remaining'] == []
+    for path in ('bin/sh', 'usr/lib/ro/libtest.so'):
+        full = os.path.join(rootfs_dir, path)
+        assert read(full) == ROOTFS_FILES[path][0]
+        assert mode_of(full) == ROOTFS_FILES[path][1]
+    assert mode_of(os.path.join(rootfs_dir, 'usr', 'lib', 'ro')) == 0o555
+
+
+def test_repair_without_cached_tarball(lcsx_env, instance):
+    rootfs_dir, digest = instance
+    os.remove(lcsx_env.blob_path(digest))
+    os.remove(os.path.join(rootfs_dir, 'bin', 'sh'))
+
+    assert find_repair_source(digest) is None
+    assert repair_rootfs(rootfs_dir) is None
+
+
+def test_instance_state_is_kept_unless_asked(instance):
+    rootfs_dir, _ = instance
+    profile = os.path.join(rootfs_dir, 'root', '.profile')
+    with open(profile, 'w') as f:
+        f.write('export EDITOR=vi\n')
+
+    assert repair_rootfs(rootfs_dir)['damaged'] == []
+    assert read(profile) == b'export EDITOR=vi\n'
+
+    result = repair_rootfs(rootfs_dir, restore_modified=True)
+
+    # resolv.conf is the instance's own too, and is written again after the restore
+    assert result['damaged'] == ['etc/resolv.conf', 'root/.profile']
+    assert result['remaining'] == []
+    assert read(profile) == ROOTFS_FILES['root/.profile'][0]
+    assert read(os.path.join(rootfs_dir, 'etc', 'resolv.conf')) != ROOTFS_FILES['etc/resolv.conf'][0]
+
+
+def test_writable_parents_restores_read_only_directories(rootfs_tree):
+    ro = os.path.join(rootfs_tree, 'usr', 'lib', 'ro')
+    os.makedirs(os.path.join(rootfs_tree, 'sealed'))
+    sealed = os.path.join(rootfs_tree, 'sealed')
+    os.chmod(sealed, 0o555)
+
+    with _writable_parents(rootfs_tree, ['usr/lib/ro/libtest.so', 'usr/lib/ro/new.so', 'sealed/file', 'sealed']):
+        assert mode_of(ro) == 0o755
+        assert mode_of(sealed) == 0o755
+
+    assert mode_of(ro) == 0o555
+    # sealed is itself damaged: extraction sets its mode, not the context manager
+    assert mode_of(sealed) == 0o755
+
+
+def test_clear_keeps_directories_whose_mode_changed(rootfs_tree):
+    manifest = build_manifest(rootfs_tree, workers=1)
+    ro = os.path.join(rootfs_tree, 'usr', 'lib', 'ro')
+    os.chmod(ro, 0o700)
+    os.remove(os.path.join(rootfs_tree, 'etc', 'os-release'))
+    os.makedirs(os.path.join(rootfs_tree, 'etc', 'os-release', 'nested'))
+
+    _clear(rootfs_tree, manifest, ['usr/lib/ro', 'etc/os-release', 'bin/sh'])
+
+    assert os.path.exists(os.path.join(ro, 'libtest.so'))
+    assert not os.path.lexists(os.path.join(rootfs_tree, 'etc', 'os-release'))
+    # The hard link is unlinked, not truncated: bin/busybox keeps its data
+    assert not os.path.lexists(os.path.join(rootfs_tree, 'bin', 'sh'))
+    assert read(os.path.join(rootfs_tree, 'bin', 'busybox')) == ROOTFS_FILES['bin/sh'][0]
@@ -0,0 +1,108 @@
+"""
+Tests for seekable rootfs archives.
+Members extracted through a member index must match a full extraction of the archive.
+"""
+
+import filecmp
+import io
+import lzma
+import os
+
+import pytest
+
+from conftest import tar_bytes
+from lcsx.core import seekable
+from lcsx.core.extract import extract_tar_stream
+from lcsx.core.seekable import SeekIndex, build_seek_index, extract_members, load_seek_index
+from lcsx.core.xz import XZBlockWriter
+
+URL = 'https://example.invalid/lcsx-test/rootfs.tar.xz'
+BLOCK_SIZE = 64 * 1024
+BIG = 'usr/share/doc/big.bin'
+
+
+def cache_archive(cache, tmp_path, data):
+    path = str(tmp_path / 'download')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return os.path.basename(cache.store(URL, path))
+
+
+def multi_block(tar):
+    buf = io.BytesIO()
+    with XZBlockWriter(buf, block_size=BLOCK_SIZE, preset=1, threads=1) as writer:
+        writer.write(tar)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def full_tree(lcsx_env, rootfs_tree, tmp_path):
+    """The test rootfs as a full extraction of its tarball puts it on disk, and the tarball."""
+    tar = tar_bytes(rootfs_tree)
+    dest = str(tmp_path / 'full')
+    extract_tar_stream(io.BytesIO(tar), dest, mode='r|')
+    return dest, tar
+
+
+def test_index_write_load_round_trip(tmp_path):
+    blocks = [(0, 12, 100, 0, 4096), (0, 112, 80, 4096, 4096), (300, 312, 50, 8192, 1000)]
+    members = [('usr/bin/env', 4096, 512), ('bin/sh', 0, 4096), ('etc/os-release', 8192, 1024)]
+    path = str(tmp_path / 'index')
+    SeekIndex(blocks, members, archive_size=362, rechunked=True).write(path)
+
+    index = SeekIndex.load(path)
+
+    assert list(index.streams) == [0, 0, 300]
+    assert list(index.offsets) == [12, 112, 312]
+    assert list(index.sizes) == [100, 80, 50]
+    assert list(index.starts) == [0, 4096, 8192]
+    assert index.paths == ['bin/sh', 'etc/os-release', 'usr/bin/env']
+    assert index.find('usr/bin/env') == (4096, 512) and index.find('nope') is None
+    assert (index.archive_size, index.rechunked) == (362, True)
+    assert [index.block_at(offset) for offset in (0, 4095, 4096, 9000)] == [0, 0, 1, 2]
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-3])
+    with pytest.raises(ValueError, match='Truncated'):
+        SeekIndex.load(path)
+
+
+@pytest.mark.parametrize('rechunked', [False, True])
+def test_member_spanning_blocks_matches_full_extraction(lcsx_env, full_tree, tmp_path, monkeypatch, rechunked):
+    full, tar = full_tree
+    if rechunked:
+        # A single-block archive is copied into small blocks while it is indexed
+        monkeypatch.setattr(seekable, 'SEEK_MAX_BLOCK', BLOCK_SIZE)
+        monkeypatch.setattr(seekable, 'SEEK_BLOCK_SIZE', BLOCK_SIZE)
+        digest = cache_archive(lcsx_env, tmp_path, lzma.compress(tar))
+    else:
+        digest = cache_archive(lcsx_env, tmp_path, multi_block(tar))
+    assert build_seek_index(lcsx_env, digest, threads=1)
+    index, _ = load_seek_index(lcsx_env, digest)
+    assert index.rechunked == rechunked
+    offset, span = index.find(BIG)
+    assert index.block_at(offset + span - 1) - index.block_at(offset) >= 2
+
+    dest = str(tmp_path / 'some')
+    # bin/sh is a hard link to bin/busybox in the tarball, so it needs its target
+    count, unknown = extract_members(lcsx_env, digest, [BIG, 'bin/sh', 'bin/busybox', 'usr/lib/ro', 'missing'], dest)
+
+    assert (count, unknown) == (4, ['missing'])
+    assert os.path.samefile(os.path.join(dest, 'bin', 'sh'), os.path.join(dest, 'bin', 'busybox'))
+    for path in (BIG, 'bin/sh'):
+        assert filecmp.cmp(os.path.join(full, path), os.path.join(dest, path), shallow=False)
+    assert os.stat(os.path.join(dest, BIG)).st_mtime_ns == os.stat(os.path.join(full, BIG)).st_mtime_ns
+    # A directory member comes without its contents
+    assert os.listdir(os.path.join(dest, 'usr', 'lib', 'ro')) == []
+
+
+def test_index_of_a_replaced_archive_is_ignored(lcsx_env, full_tree, tmp_path):
+    _, tar = full_tree
+    digest = cache_archive(lcsx_env, tmp_path, multi_block(tar))
+    build_seek_index(lcsx_env, digest, threads=1)
+    with open(lcsx_env.blob_path(digest), 'ab') as f:
+        f.write(bytes(4))
+
+    assert load_seek_index(lcsx_env, digest) is None
+    assert extract_members(lcsx_env, digest, [BIG], str(tmp_path / 'some')) is None
@@ -0,0 +1,134 @@
+"""
+Tests for rootfs setup.
+A rootfs is set up from a local tarball the way lcsx sets up an instance, then checked.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+import pytest
+
+from conftest import ROOTFS_FILES
+from lcsx.core import cache as lcsx_cache
+from lcsx.core import setup as lcsx_setup
+from lcsx.core.cache import setup_cache
+from lcsx.core.download import DownloadStream, IntegrityError
+from lcsx.core.setup import extract_rootfs, prepare_rootfs, set_shell_prompt, stream_and_extract
+from lcsx.ui.commands import rootfs_command
+
+
+def file_url(path):
+    return 'file://' + os.path.abspath(path)
+
+
+def test_verify_passes_on_a_fresh_setup(lcsx_env, rootfs_tarball, tmp_path):
+    data_dir = str(tmp_path / 'data')
+    rootfs = prepare_rootfs(file_url(rootfs_tarball), data_dir, shell='/bin/sh')
+    # The prompt phase runs after the manifest is recorded, like set_resolv_conf
+    set_shell_prompt(rootfs, 'root', 'lcsx', '/bin/bash')
+
+    assert rootfs_command(['verify', data_dir, '--hash', 'full']) == 0
+
+
+def test_verify_fails_on_damage_outside_instance_state(lcsx_env, rootfs_tarball, tmp_path):
+    data_dir = str(tmp_path / 'data')
+    rootfs = prepare_rootfs(file_url(rootfs_tarball), data_dir, shell='/bin/sh')
+    os.remove(os.path.join(rootfs, 'usr', 'share', 'doc', 'big.bin'))
+
+    assert rootfs_command(['verify', data_dir, '--hash', 'none']) == 1
+
+
+@pytest.fixture
+def served_rootfs(http_server, rootfs_tarball):
+    """URL of the test rootfs tarball on the local HTTP server, and its bytes."""
+    with open(rootfs_tarball, 'rb') as f:
+        body = f.read()
+    http_server.files['/rootfs.tar.xz'] = body
+    return http_server.url('/rootfs.tar.xz'), body
+
+
+def assert_rootfs(dest_dir):
+    for path, (content, _) in ROOTFS_FILES.items():
+        with open(os.path.join(dest_dir, path), 'rb') as f:
+            assert f.read() == content
+    assert os.path.islink(os.path.join(dest_dir, 'usr', 'bin', 'env'))
+
+
+def test_stream_extract_keeps_the_download_only_in_the_cache(lcsx_env, served_rootfs, http_server, tmp_path):
+    url, body = served_rootfs
+    dest_dir = str(tmp_path / 'rootfs')
+
+    assert stream_and_extract(url, dest_dir)
+
+    assert_rootfs(dest_dir)
+    assert 'rootfs.tar.xz' not in os.listdir(dest_dir)
+    assert os.path.basename(lcsx_env.lookup(url)) == hashlib.sha256(body).hexdigest()
+    # The body was fetched once: a one-byte range probe, then the stream itself
+    assert [request['range'] for request in http_server.requests] == ['bytes=0-0', None]
+    assert not [name for name in os.listdir(lcsx_env.tmp_dir) if name.endswith('.stream')]
+
+
+def test_stream_extract_in_prefetched_chunks(lcsx_env, served_rootfs, http_server, tmp_path, monkeypatch):
+    url, body = served_rootfs
+    monkeypatch.setattr(DownloadStream, 'STREAM_CHUNK_SIZE', 4096)
+
+    assert stream_and_extract(url, str(tmp_path / 'rootfs'))
+
+    assert_rootfs(str(tmp_path / 'rootfs'))
+    assert len(http_server.requests) == 1 + -(-len(body) // 4096)
+
+
+def test_stream_extract_without_cache_writes_no_tarball(served_rootfs, tmp_path, monkeypatch):
+    monkeypatch.setattr(lcsx_cache, '_cache', None)
+    monkeypatch.setattr(lcsx_cache, '_cache_enabled', False)
+    url, _ = served_rootfs
+    dest_dir = str(tmp_path / 'rootfs')
+
+    assert stream_and_extract(url, dest_dir)
+
+    assert_rootfs(dest_dir)
+    assert sorted(os.listdir(dest_dir)) == sorted({path.split('/')[0] for path in ROOTFS_FILES} | {'dev'})
+
+
+def test_stream_extract_checksum_mismatch_discards_the_tree(lcsx_env, served_rootfs, tmp_path, monkeypatch):
+    url, _ = served_rootfs
+    monkeypatch.setattr(lcsx_cache, 'get_pinned_sha256', lambda url: '0' * 64)
+    dest_dir = str(tmp_path / 'rootfs')
+
+    with pytest.raises(IntegrityError):
+        stream_and_extract(url, dest_dir)
+
+    assert os.listdir(dest_dir) == []
+    assert lcsx_env.lookup(url) is None
+
+
+@pytest.mark.parametrize('fmt, mode', [
+    pytest.param('zstd', 'r|zst', marks=pytest.mark.skipif(shutil.which('zstd') is None, reason="zstd is not installed")),
+    ('tar', 'r|'),
+])
+def test_later_setups_extract_the_fast_copy(lcsx_env, served_rootfs, http_server, tmp_path, monkeypatch, fmt, mode):
+    url, _ = served_rootfs
+    cache = setup_cache(cache_dir=lcsx_env.cache_dir, transcode=fmt, seek_index=False)
+    modes = []
+    extract_archive = lcsx_setup.extract_archive
+
+    def spy(source, dest_dir, mode='r|xz', **kwargs):
+        modes.append(mode)
+        return extract_archive(source, dest_dir, mode=mode, **kwargs)
+
+    monkeypatch.setattr(lcsx_setup, 'extract_archive', spy)
+
+    extract_rootfs(url, str(tmp_path / 'first'))
+    for thread in threading.enumerate():
+        if thread.name == 'lcsx-transcode':
+            thread.join()
+    assert cache.lookup_derived(os.path.basename(cache.lookup(url)))[1] == fmt
+    requests = len(http_server.requests)
+
+    extract_rootfs(url, str(tmp_path / 'second'))
+
+    assert modes == ['r|xz', mode]
+    assert len(http_server.requests) == requests
+    assert_rootfs(str(tmp_path / 'second'))
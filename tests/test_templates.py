@@ -0,0 +1,94 @@
+"""
+Tests for the rootfs template store.
+Covers eviction under the size cap, lazy creation and when setup uses a template at all.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from lcsx.core import setup as lcsx_setup
+from lcsx.core.setup import ROOTFS_REQUIRED_SPACE, prepare_rootfs, required_space, template_clone_plan
+from lcsx.core.templates import TemplateStore, setup_templates, tree_size
+
+
+def url_for(name):
+    return f'https://example.invalid/lcsx-test/{name}.tar.xz'
+
+
+def build(store, name, tree):
+    def extract(rootfs_dir):
+        shutil.copytree(tree, rootfs_dir, symlinks=True, dirs_exist_ok=True)
+
+    return store.build(url_for(name), name, extract)
+
+
+def test_store_directory_is_created_lazily(tmp_path):
+    template_dir = tmp_path / 'templates'
+    store = setup_templates(template_dir=str(template_dir), clone_method='auto')
+
+    assert store.entries() == []
+    assert not template_dir.exists()
+
+
+def test_build_evicts_least_recently_used(tmp_path, rootfs_tree):
+    size = tree_size(rootfs_tree)
+    store = TemplateStore(str(tmp_path / 'templates'), max_size=2 * size)
+    build(store, 'one', rootfs_tree)
+    build(store, 'two', rootfs_tree)
+    os.utime(os.path.join(store.template_dir, 'one', 'template.json'), (1, 1))
+    os.utime(os.path.join(store.template_dir, 'two', 'template.json'), (2, 2))
+    # Cloning marks a template as recently used
+    store.clone(url_for('one'), str(tmp_path / 'data'), 'copy')
+
+    build(store, 'three', rootfs_tree)
+
+    assert [name for name, _ in store.entries()] == ['one', 'three']
+    assert store.entries()[0][1]['size'] == size
+
+
+def test_eviction_skips_templates_being_cloned(tmp_path, rootfs_tree):
+    size = tree_size(rootfs_tree)
+    store = TemplateStore(str(tmp_path / 'templates'), max_size=size)
+    build(store, 'one', rootfs_tree)
+    with store._lock('one', exclusive=False):
+        build(store, 'two', rootfs_tree)
+
+    assert [name for name, _ in store.entries()] == ['one', 'two']
+
+
+def test_auto_skips_the_template_without_reflink(lcsx_env, tmp_path, monkeypatch):
+    setup_templates(template_dir=str(tmp_path / 'templates'), clone_method='auto')
+    monkeypatch.setattr(lcsx_setup, 'reflink_supported', lambda src, dst: False)
+    assert template_clone_plan(str(tmp_path)) is None
+
+    monkeypatch.setattr(lcsx_setup, 'reflink_supported', lambda src, dst: True)
+    store, method = template_clone_plan(str(tmp_path))
+    assert method == 'reflink'
+
+
+def test_required_space_counts_the_template(lcsx_env, tmp_path):
+    dest_dir = str(tmp_path / 'rootfs')
+    os.makedirs(dest_dir)
+    store = setup_templates(template_dir=str(tmp_path / 'templates'), clone_method='copy')
+    url = url_for('one')
+
+    assert required_space(url, dest_dir, None) == [(dest_dir, ROOTFS_REQUIRED_SPACE)]
+    # The template and a copied clone land on the same filesystem here
+    assert required_space(url, dest_dir, (store, 'copy')) == [(dest_dir, 2 * ROOTFS_REQUIRED_SPACE)]
+    assert required_space(url, dest_dir, (store, 'reflink')) == [(dest_dir, ROOTFS_REQUIRED_SPACE)]
+
+
+@pytest.mark.parametrize('method, templated', [('copy', True), ('off', False)])
+def test_setup_from_template(lcsx_env, rootfs_tarball, tmp_path, method, templated):
+    template_dir = tmp_path / 'templates'
+    setup_templates(template_dir=str(template_dir), clone_method=method)
+    url = 'file://' + rootfs_tarball
+
+    for data_dir in ('web1', 'web2'):
+        rootfs = prepare_rootfs(url, str(tmp_path / data_dir), shell='/bin/sh')
+        with open(os.path.join(rootfs, 'bin', 'sh'), 'rb') as f:
+            assert f.read().startswith(b'#!/bin/sh')
+        assert oct(os.stat(os.path.join(rootfs, 'usr', 'lib', 'ro')).st_mode & 0o777) == oct(0o555)
+    assert template_dir.exists() == templated
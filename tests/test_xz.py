@@ -0,0 +1,163 @@
+"""
+Tests for the xz container code.
+ParallelXZReader, XZBlockWriter and list_blocks are checked against lzma.decompress.
+"""
+
+import io
+import lzma
+import os
+import random
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from lcsx.core.xz import ParallelXZReader, XZBlockWriter, XZFormatError, list_blocks, read_block
+
+BLOCK_SIZE = 64 * 1024
+
+
+def sample_data(size, seed=0):
+    """Data that compresses about 8:1, so decoding does real work."""
+    rng = random.Random(seed)
+    return b''.join(rng.randbytes(256) * 8 for _ in range(size // 2048))
+
+
+DATA = sample_data(1024 * 1024)
+OTHER = sample_data(300 * 1024, seed=1)
+
+
+def write_blocks(data, block_size=BLOCK_SIZE, threads=2):
+    buf = io.BytesIO()
+    with XZBlockWriter(buf, block_size=block_size, preset=1, threads=threads) as writer:
+        writer.write(data)
+    return buf.getvalue(), writer.blocks
+
+
+def decode(data, threads=4, read_size=None):
+    with ParallelXZReader(io.BytesIO(data), threads=threads) as reader:
+        if read_size is None:
+            return reader.read()
+        parts = []
+        while True:
+            chunk = reader.read(read_size)
+            if not chunk:
+                return b''.join(parts)
+            parts.append(chunk)
+
+
+def corrupt(data, offset):
+    damaged = bytearray(data)
+    damaged[offset] ^= 0xFF
+    return bytes(damaged)
+
+
+def test_single_block():
+    archive = lzma.compress(DATA, preset=1)
+    assert decode(archive) == lzma.decompress(archive) == DATA
+    assert decode(archive, read_size=1000) == DATA
+
+
+def test_multi_block():
+    archive, blocks = write_blocks(DATA)
+    assert len(blocks) == len(DATA) // BLOCK_SIZE
+    assert lzma.decompress(archive) == DATA
+    assert decode(archive) == DATA
+    assert decode(archive, threads=1, read_size=4096) == DATA
+
+
+@pytest.mark.skipif(shutil.which('xz') is None, reason="xz is not installed")
+def test_multi_block_from_xz_tool():
+    archive = subprocess.run(['xz', '-1', '-T2', f'--block-size={BLOCK_SIZE}', '-c'], input=DATA,
+                             stdout=subprocess.PIPE, check=True).stdout
+    assert decode(archive) == lzma.decompress(archive) == DATA
+    assert len(list_blocks(io.BytesIO(archive))) == len(DATA) // BLOCK_SIZE
+
+
+def test_concatenated_streams():
+    archive = write_blocks(DATA)[0] + lzma.compress(OTHER) + write_blocks(OTHER)[0]
+    assert decode(archive) == lzma.decompress(archive) == DATA + OTHER + OTHER
+
+
+@pytest.mark.parametrize('archive', [
+    pytest.param(lambda: write_blocks(DATA)[0] + bytes(8) + write_blocks(OTHER)[0] + bytes(4), id='multi-block'),
+    pytest.param(lambda: lzma.compress(DATA) + bytes(4) + lzma.compress(OTHER) + bytes(12), id='single-block'),
+])
+def test_padded_streams(archive):
+    archive = archive()
+    assert decode(archive) == DATA + OTHER
+    # lzma.decompress stops at the first stream padding, as if it were trailing garbage
+    assert lzma.decompress(archive) == DATA
+    if shutil.which('xz'):
+        assert subprocess.run(['xz', '-dc'], input=archive, stdout=subprocess.PIPE,
+                              check=True).stdout == DATA + OTHER
+
+
+def test_list_blocks_matches_writer_and_reads_back():
+    first, written = write_blocks(DATA)
+    second = write_blocks(OTHER)[0]
+    archive = first + bytes(4) + second
+    f = io.BytesIO(archive)
+
+    blocks = list_blocks(f)
+
+    assert blocks[:len(written)] == written
+    assert sum(size for _, _, _, _, size in blocks) == len(DATA) + len(OTHER)
+    assert {stream for stream, _, _, _, _ in blocks} == {0, len(first) + 4}
+    expected = DATA + OTHER
+    for stream_offset, offset, size, start, length in blocks:
+        assert read_block(f, stream_offset, offset, size) == expected[start:start + length]
+
+
+@pytest.mark.parametrize('archive', [
+    pytest.param(lambda: write_blocks(DATA)[0], id='multi-block'),
+    pytest.param(lambda: lzma.compress(DATA), id='single-block'),
+])
+def test_corrupt_streams_raise(archive):
+    archive = archive()
+    cases = {
+        'bad magic': corrupt(archive, 0),
+        'stream header': corrupt(archive, 7),
+        'block header': corrupt(archive, 13),
+        'block data': corrupt(archive, len(archive) // 2),
+        'truncated': archive[:len(archive) // 2],
+        'trailing garbage': archive + b'garbage!',
+    }
+    for name, data in cases.items():
+        with pytest.raises(XZFormatError):
+            decode(data)
+            pytest.fail(f"{name} was decoded")
+
+
+def test_corrupt_index_raises():
+    archive, _ = write_blocks(DATA)
+    with pytest.raises(XZFormatError):
+        list_blocks(io.BytesIO(corrupt(archive, len(archive) - 14)))
+    with pytest.raises(XZFormatError):
+        list_blocks(io.BytesIO(corrupt(archive, len(archive) - 1)))
+    with pytest.raises(XZFormatError):
+        decode(corrupt(archive, len(archive) - 14))
+
+
+def best_time(func, runs=3):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="parallel decoding needs at least two CPUs")
+def test_parallel_decoding_is_faster():
+    data = sample_data(16 * 1024 * 1024)
+    archive, _ = write_blocks(data, block_size=1024 * 1024, threads=os.cpu_count())
+    threads = min(4, os.cpu_count())
+
+    serial = best_time(lambda: decode(archive, threads=1))
+    parallel = best_time(lambda: decode(archive, threads=threads))
+
+    assert decode(archive, threads=threads) == data
+    # Decoding scales with the blocks in flight; ask for a clear win, not a perfect one
+    assert parallel < serial / 1.3, f"{threads} threads: {parallel:.3f}s, serial: {serial:.3f}s"
@@ -3,12 +3,11 @@ import os
 import urllib.request
 import subprocess
 from lcsx.ui.logger import print_main
-from lcsx.core.gotty import setup_gotty
-from lcsx.core.sshx import setup_sshx
 from lcsx.config.constants import (
     DEFAULT_USER, DEFAULT_HOSTNAME, DEFAULT_PASSWORD,
-    DEFAULT_PORT, PROOT_DISTRO_VERSION, PROOT_DISTRO_BASE_URL, ALPINE_DISTRO_BASE_URL
+    DEFAULT_PORT
 )
+from lcsx.config.catalog import get_distros
 
 def auto_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_native=False, force_port=None, enable_auth=None, distro_name=None):
     """Automatic setup with predefined values."""
@@ -34,29 +33,8 @@ def auto_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_nat
         elif arch == 'aarch64':
             proot_bin = 'prootarm64'
 
-        # Define available distros with compatibility levels and shells
-        distros = {
-            'Debian': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/debian-trixie-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Stable',
-                'shell': '/bin/bash'
-            },
-            'Arch Linux': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/archlinux-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Bleeding',
-                'shell': '/bin/bash'
-            },
-            'Void': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/void-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Balanced',
-                'shell': '/bin/bash'
-            },
-            'Alpine': {
-                'url': f"{ALPINE_DISTRO_BASE_URL}/alpine-{arch}-pd-v4.30.1.tar.xz",
-                'compat': 'Balanced',
-                'shell': '/bin/sh'
-            },
-        }
+        # Available distros with compatibility levels and shells
+        distros = get_distros(arch)
 
         # Select distro
         if distro_name and distro_name in distros:
@@ -102,14 +80,10 @@ def auto_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_nat
             # Auto setup: authentication disabled by default
             gotty_credential = None
             print_main("GoTTY will run without authentication.")
-        print_main("Setting up gotty...")
-        gotty_path = setup_gotty(data_dir)
     elif force_sshx:
         terminal_service = 'sshx'
         terminal_port = None
         print_main("Terminal service forced to sshx.")
-        print_main("Setting up sshx...")
-        sshx_path = setup_sshx(data_dir)
     elif force_native:
         terminal_service = 'native'
         terminal_port = None
@@ -118,8 +92,6 @@ def auto_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_nat
         # Default to sshx for auto setup if no force flag is provided
         terminal_service = 'sshx'
         terminal_port = None
-        print_main("Setting up sshx...")
-        sshx_path = setup_sshx(data_dir)
 
     return {
         'user': user,
@@ -9,12 +9,9 @@ import urllib.request
 import subprocess
 import sys
 from lcsx.ui.logger import print_main, print_prompt, print_error, print_warning
-from lcsx.core.gotty import setup_gotty
-from lcsx.core.sshx import setup_sshx
 from .auto import auto_setup
-from lcsx.config.constants import (
-    DEFAULT_PORT, PROOT_DISTRO_VERSION, PROOT_DISTRO_BASE_URL, ALPINE_DISTRO_BASE_URL
-)
+from lcsx.config.constants import DEFAULT_PORT
+from lcsx.config.catalog import get_distros
 from lcsx.core.validation import (
     validate_username, validate_password, validate_port,
     validate_directory_path, validate_hostname, sanitize_input
@@ -95,29 +92,8 @@ def prompt_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_n
         elif arch == 'aarch64':
             proot_bin = 'prootarm64'
 
-        # Define available distros with compatibility levels and shells
-        distros = {
-            'Debian': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/debian-trixie-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Stable',
-                'shell': '/bin/bash'
-            },
-            'Arch Linux': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/archlinux-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Bleeding',
-                'shell': '/bin/bash'
-            },
-            'Void': {
-                'url': f"{PROOT_DISTRO_BASE_URL}/void-{arch}-pd-{PROOT_DISTRO_VERSION}.tar.xz",
-                'compat': 'Balanced',
-                'shell': '/bin/bash'
-            },
-            'Alpine': {
-                'url': f"{ALPINE_DISTRO_BASE_URL}/alpine-{arch}-pd-v4.30.1.tar.xz",
-                'compat': 'Balanced',
-                'shell': '/bin/sh'
-            },
-        }
+        # Available distros with compatibility levels and shells
+        distros = get_distros(arch)
 
         def get_compat_color(compat):
             if compat == 'Stable':
@@ -165,14 +141,10 @@ def prompt_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_n
         terminal_service = 'gotty'
         terminal_port = force_port
         print_main(f"Terminal service forced to gotty on port {terminal_port}.")
-        print_main("Setting up gotty...")
-        gotty_path = setup_gotty(data_dir)
     elif force_sshx:
         terminal_service = 'sshx'
         terminal_port = None
         print_main("Terminal service forced to sshx.")
-        print_main("Setting up sshx...")
-        sshx_path = setup_sshx(data_dir)
     elif force_native:
         terminal_service = 'native'
         terminal_port = None
@@ -226,9 +198,6 @@ def prompt_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_n
                 else:
                     gotty_credential = None
                     print_main("GoTTY will run without authentication.")
-            
-            print_main("Setting up gotty...")
-            gotty_path = setup_gotty(data_dir)
         elif service_choice == '3':
             terminal_service = 'native'
             terminal_port = None
@@ -238,8 +207,6 @@ def prompt_setup(pre_data_dir=None, force_gotty=False, force_sshx=False, force_n
         else:
             terminal_service = 'sshx'
             terminal_port = None # sshx doesn't use a fixed port in this context
-            print_main("Setting up sshx...")
-            sshx_path = setup_sshx(data_dir)
 
     return {
         'user': user,
@@ -0,0 +1,645 @@
+"""
+Subcommands for LCSX.
+Maintenance commands that run instead of the interactive setup, e.g. `lcsx cache serve`.
+"""
+
+import argparse
+import logging
+import lzma
+import os
+import subprocess
+import tarfile
+import time
+import urllib.error
+from lcsx.config.catalog import ARCHITECTURES, UNPINNED_URLS, get_pinned_sha256, select_artifacts
+from lcsx.config.config import is_configured, load_config, save_config
+from lcsx.config.constants import CACHE_SERVER_HOST, CACHE_SERVER_PORT, CACHE_WARM_JOBS, VERIFY_SAMPLE_RATE
+from lcsx.core.bundle import BundleError, create_bundle, import_bundle
+from lcsx.core.logger import setup_logger
+from lcsx.core.cache import setup_cache
+from lcsx.core.cacheserver import serve_cache
+from lcsx.core.download import IntegrityError, get_download_manager
+from lcsx.core.extract import benchmark_extractors, configure_extraction
+from lcsx.core.layers import BaseStore, LayerError, base_root, find_version_dir, sync_layer
+from lcsx.core.manifest import HASH_MODES, verify_rootfs
+from lcsx.core.repair import repair_rootfs
+from lcsx.core.seekable import build_seek_index, extract_members
+from lcsx.core.templates import TemplateStore
+from lcsx.core.mirrors import setup_mirrors
+from lcsx.core.proot import GUEST_PATH, build_proot_command, setup_proot_binary
+from lcsx.core.transcode import resolve_format, transcode_blob
+from lcsx.core.xz import STREAM_MAGIC
+from lcsx.core.warm import warm_cache
+from lcsx.ui.logger import print_main, print_error
+from lcsx.ui.progress import format_size
+
+# Names that are dispatched here instead of being taken as a data directory
+SUBCOMMANDS = ('cache', 'bundle', 'bench', 'base', 'rootfs', 'template')
+
+
+def is_subcommand(argv):
+    """
+    Tell whether argv (the arguments after the program name) runs a subcommand.
+
+    A data directory may share a subcommand's name. An existing directory of
+    that name is taken as the data directory unless an action follows it
+    (`lcsx cache serve`), since every subcommand starts with one. Arguments
+    after `--` are never a subcommand, so `lcsx -- cache` sets up in ./cache
+    whether or not it exists yet.
+    """
+    if not argv or argv[0] not in SUBCOMMANDS:
+        return False
+    if not os.path.isdir(argv[0]):
+        return True
+    return len(argv) > 1 and not argv[1].startswith('-')
+
+
+def _common_parser():
+    """Options shared by every subcommand."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--cache-dir', help="Directory of the shared artifact cache (default: ~/.cache/lcsx)")
+    parser.add_argument('--mirrors-file',
+                        help="JSON file mapping origin URL prefixes to mirror lists (default: "
+                             "~/.lcsx/mirrors.json)")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="Set logging level (default: INFO)")
+    parser.add_argument('--log-file', help="Path to log file (default: ~/.lcsx/logs/lcsx.log)")
+    return parser
+
+
+def _setup(args):
+    """Configure logging, mirrors and the artifact cache from the common options."""
+    setup_logger(log_level=getattr(logging, args.log_level.upper(), logging.INFO), log_file=args.log_file,
+                 enable_console=False)
+    setup_mirrors(mirrors_file=args.mirrors_file)
+    try:
+        return setup_cache(cache_dir=args.cache_dir)
+    except OSError as e:
+        print_error(f"Cannot open artifact cache: {e}")
+        return None
+
+
+def cache_command(argv):
+    """
+    Run `lcsx cache <action>`.
+
+    Args:
+        argv: Arguments after 'cache'.
+
+    Returns:
+        int: Exit status.
+    """
+    common = _common_parser()
+    parser = argparse.ArgumentParser(prog='lcsx cache', description="Manage the shared artifact cache")
+    actions = parser.add_subparsers(dest='action', required=True)
+    serve = actions.add_parser('serve', parents=[common],
+                               help="Serve the cache over HTTP as a mirror for other lcsx nodes")
+    serve.add_argument('--host', default=CACHE_SERVER_HOST,
+                       help=f"Address to listen on (default: {CACHE_SERVER_HOST})")
+    serve.add_argument('--port', type=int, default=CACHE_SERVER_PORT,
+                       help=f"Port to listen on (default: {CACHE_SERVER_PORT})")
+    serve.add_argument('--no-pull', action='store_true',
+                       help="Only serve what is cached; do not download requested catalog artifacts")
+    warm = actions.add_parser('warm', parents=[common],
+                              help="Prefetch catalog artifacts so later setups run without downloads")
+    warm.add_argument('--arch', action='append', choices=ARCHITECTURES,
+                      help="Architecture to fetch; repeat for several (default: this host's)")
+    warm.add_argument('--distro', action='append',
+                      help="Distribution rootfs to fetch, e.g. debian or alpine; repeat for several (default: "
+                           "all)")
+    warm.add_argument('--jobs', type=int, default=CACHE_WARM_JOBS,
+                      help=f"Artifacts fetched at the same time (default: {CACHE_WARM_JOBS})")
+    transcode = actions.add_parser('transcode', parents=[common],
+                                   help="Make the fast-to-decompress copy of every cached rootfs tarball now")
+    transcode.add_argument('--format', choices=['auto', 'zstd', 'tar'], default='auto',
+                           help="zstd, uncompressed tar, or auto (zstd when installed) (default: auto)")
+    pins = actions.add_parser('pins', parents=[common],
+                              help="Download the catalog and print the sha256 pins for config/catalog.py")
+    pins.add_argument('--arch', action='append', choices=ARCHITECTURES,
+                      help="Architecture to pin; repeat for several (default: all)")
+    pins.add_argument('--jobs', type=int, default=CACHE_WARM_JOBS,
+                      help=f"Artifacts fetched at the same time (default: {CACHE_WARM_JOBS})")
+    actions.add_parser('index', parents=[common],
+                       help="Index the members of every cached rootfs tarball now, re-chunking single-block ones")
+    extract = actions.add_parser('extract', parents=[common],
+                                 help="Extract single files from an indexed cached rootfs tarball")
+    extract.add_argument('artifact', help="URL or sha256 of the cached tarball")
+    extract.add_argument('paths', nargs='+', help="Member paths, e.g. etc/os-release")
+    extract.add_argument('-C', '--directory', default='.',
+                         help="Directory to extract into (default: current directory)")
+    args = parser.parse_args(argv)
+
+    cache = _setup(args)
+    if cache is None:
+        return 1
+    if args.action == 'serve':
+        try:
+            serve_cache(cache, args.host, args.port, pull=not args.no_pull)
+        except OSError as e:
+            print_error(f"Cannot listen on {args.host}:{args.port}: {e}")
+            return 1
+    elif args.action == 'warm':
+        try:
+            artifacts = select_artifacts(args.arch, args.distro)
+        except ValueError as e:
+            print_error(str(e))
+            return 1
+        return 0 if warm_cache(cache, artifacts, args.jobs) else 1
+    elif args.action == 'transcode':
+        return transcode_cache(cache, args.format)
+    elif args.action == 'pins':
+        return print_pins(cache, args.arch or list(ARCHITECTURES), args.jobs)
+    elif args.action == 'index':
+        return index_cache(cache)
+    elif args.action == 'extract':
+        return _extract_cached(cache, args.artifact, args.paths, args.directory)
+    return 0
+
+
+def transcode_cache(cache, setting):
+    """
+    Transcode every cached xz tarball in the foreground.
+
+    Returns:
+        int: Exit status.
+    """
+    fmt = resolve_format(setting)
+    if fmt is None:
+        print_error("zstd is not installed; use --format tar")
+        return 1
+    status = 0
+    for url, digest, size in cache.entries():
+        with open(cache.blob_path(digest), 'rb') as f:
+            if f.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+                continue
+        print_main(f"Transcoding {url} ({format_size(size)}) to {fmt}...")
+        try:
+            path = transcode_blob(cache, digest, fmt)
+        except (OSError, subprocess.SubprocessError, lzma.LZMAError) as e:
+            print_error(f"Transcoding {url} failed: {e}")
+            status = 1
+            continue
+        if path is None:
+            print_main("Skipped: another lcsx process is transcoding it.")
+        else:
+            print_main(f"Wrote {path} ({format_size(os.path.getsize(path))})")
+    return status
+
+
+def print_pins(cache, arches, jobs):
+    """
+    Fetch every pinnable catalog artifact and print its ARTIFACT_SHA256 entry.
+
+    sshx (UNPINNED_URLS) is left out. Entries that differ from the current
+    pin are marked, since the download was then checked against the old one
+    and failed.
+
+    Returns:
+        int: Exit status.
+    """
+    artifacts = [(name, url) for name, url in select_artifacts(arches) if url not in UNPINNED_URLS]
+    ok = warm_cache(cache, artifacts, jobs)
+    digests = {url: digest for url, digest, _ in cache.entries()}
+    print_main("Entries for ARTIFACT_SHA256 in config/catalog.py:")
+    for name, url in artifacts:
+        if url not in digests:
+            print_error(f"    # {name}: not cached, no digest for {url}")
+            continue
+        pinned = get_pinned_sha256(url)
+        note = '' if pinned in (None, digests[url]) else f"  # was {pinned}"
+        print(f"    '{url}': '{digests[url]}',{note}")
+    return 0 if ok else 1
+
+
+def index_cache(cache):
+    """
+    Build the member index of every cached xz tarball in the foreground.
+
+    Returns:
+        int: Exit status.
+    """
+    status = 0
+    for url, digest, size in cache.entries():
+        with open(cache.blob_path(digest), 'rb') as f:
+            if f.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+                continue
+        print_main(f"Indexing {url} ({format_size(size)})...")
+        try:
+            path = build_seek_index(cache, digest)
+        except (OSError, tarfile.TarError, lzma.LZMAError) as e:
+            print_error(f"Indexing {url} failed: {e}")
+            status = 1
+            continue
+        if path is None:
+            print_main("Skipped: another lcsx process is indexing it.")
+        else:
+            _, archive = cache.lookup_seek_index(digest)
+            if archive == cache.blob_path(digest):
+                print_main(f"Wrote {path} ({format_size(os.path.getsize(path))})")
+            else:
+                print_main(f"Wrote {path} ({format_size(os.path.getsize(path))}) and re-chunked copy "
+                           f"{archive} ({format_size(os.path.getsize(archive))})")
+    return status
+
+
+def _extract_cached(cache, artifact, paths, directory):
+    """Run `lcsx cache extract`; returns the exit status."""
+    digest = next((d for url, d, _ in cache.entries() if artifact in (url, d)), None)
+    if digest is None:
+        print_error(f"{artifact} is not cached")
+        return 1
+    try:
+        os.makedirs(directory, exist_ok=True)
+        result = extract_members(cache, digest, paths, directory)
+    except (OSError, tarfile.TarError, lzma.LZMAError) as e:
+        print_error(f"Extraction failed: {e}")
+        return 1
+    if result is None:
+        print_error(f"{artifact} has no member index; run `lcsx cache index` first")
+        return 1
+    count, unknown = result
+    for path in unknown:
+        print_error(f"Not in the archive: {path}")
+    print_main(f"Extracted {count} member(s) into {directory}")
+    return 1 if unknown else 0
+
+
+def bundle_command(argv):
+    """
+    Run `lcsx bundle create|import`.
+
+    Args:
+        argv: Arguments after 'bundle'.
+
+    Returns:
+        int: Exit status.
+    """
+    common = _common_parser()
+    parser = argparse.ArgumentParser(prog='lcsx bundle', description="Offline provisioning bundles")
+    actions = parser.add_subparsers(dest='action', required=True)
+    create = actions.add_parser('create', parents=[common],
+                                help="Pack proot, gotty, sshx and rootfs tarballs into one bundle file")
+    create.add_argument('output', help="Bundle file to write")
+    create.add_argument('--arch', action='append', choices=ARCHITECTURES,
+                        help="Architecture to include; repeat for several (default: this host's)")
+    create.add_argument('--distro', action='append',
+                        help="Distribution rootfs to include, e.g. debian or alpine; repeat for several "
+                             "(default: all)")
+    load = actions.add_parser('import', parents=[common], help="Seed the artifact cache from a bundle file")
+    load.add_argument('bundle', help="Bundle file to read")
+    args = parser.parse_args(argv)
+
+    cache = _setup(args)
+    if cache is None:
+        return 1
+    try:
+        if args.action == 'create':
+            create_bundle(cache, args.output, select_artifacts(args.arch, args.distro))
+            get_download_manager().log_metrics()
+        else:
+            import_bundle(cache, args.bundle)
+    except (BundleError, IntegrityError, ValueError, OSError, urllib.error.URLError) as e:
+        print_error(f"Bundle {args.action} failed: {e}")
+        return 1
+    return 0
+
+
+def _archive_mode(path):
+    """tarfile stream mode for an archive name."""
+    if path.endswith(('.tar.xz', '.txz')):
+        return 'r|xz'
+    if path.endswith(('.tar.gz', '.tgz')):
+        return 'r|gz'
+    return 'r|'
+
+
+def bench_command(argv):
+    """
+    Run `lcsx bench extract ARCHIVE`.
+
+    Args:
+        argv: Arguments after 'bench'.
+
+    Returns:
+        int: Exit status.
+    """
+    common = _common_parser()
+    parser = argparse.ArgumentParser(prog='lcsx bench', description="Measure lcsx components on this host")
+    actions = parser.add_subparsers(dest='action', required=True)
+    extract = actions.add_parser('extract', parents=[common],
+                                 help="Extract an archive with every available backend and compare throughput")
+    extract.add_argument('archive', help="Archive to extract, e.g. a cached rootfs .tar.xz")
+    extract.add_argument('--scratch-dir', help="Directory for the throwaway extractions (default: system temp)")
+    extract.add_argument('--extract-threads', type=int,
+                         help="Threads decoding xz blocks in the built-in extractor (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    setup_logger(log_level=getattr(logging, args.log_level.upper(), logging.INFO), log_file=args.log_file,
+                 enable_console=False)
+    configure_extraction(decode_threads=args.extract_threads)
+    print_main(f"Extracting {args.archive} ({format_size(os.path.getsize(args.archive))}) with each backend...")
+    results = benchmark_extractors(args.archive, _archive_mode(args.archive), args.scratch_dir)
+    chosen = next((name for name, _, _, error in results if error is None), None)
+    width = max(len(name) for name, _, _, _ in results)
+    for name, seconds, rate, error in results:
+        marker = '*' if name == chosen else ' '
+        if error is not None:
+            print_error(f"{marker} {name.ljust(width)}  failed: {error}")
+        else:
+            print_main(f"{marker} {name.ljust(width)}  {seconds:7.2f}s  {format_size(rate):>9}/s")
+    print_main("* = backend lcsx uses on this host with --extractor auto")
+    return 0 if chosen else 1
+
+
+def _load_layered_instance(data_dir):
+    """Load the config of a layered instance; returns (config, version directory of its base)."""
+    data_dir = os.path.abspath(data_dir)
+    if not is_configured(data_dir):
+        raise LayerError(f"No lcsx instance in {data_dir}")
+    config = load_config(data_dir, data_dir)
+    version_dir = find_version_dir(config['rootfs_base']) if config.get('rootfs_base') else None
+    if version_dir is None:
+        raise LayerError(f"{data_dir} does not use a layered rootfs")
+    return config, version_dir
+
+
+def _move_instance(store, config, version_dir):
+    """Point a layered instance at another base version."""
+    store.register(version_dir, config['data_dir'])
+    config['rootfs_base'] = base_root(version_dir)
+    save_config(config, config['data_dir'])
+
+
+def promote_instance(data_dir, command):
+    """
+    Run command (e.g. a package install) into a new base version and move the instance onto it.
+
+    The command runs as root in a writable copy of the instance's base,
+    with the instance's resolv.conf bound so it can reach package mirrors.
+    Other instances stay on their version until `lcsx base rebase`.
+
+    Returns:
+        str: The new version directory.
+    """
+    config, version_dir = _load_layered_instance(data_dir)
+    store = BaseStore(os.path.dirname(os.path.dirname(version_dir)))
+    setup_proot_binary(config['data_dir'], config['proot_bin'])
+    binds = []
+    resolv = os.path.join(config['rootfs'], 'etc', 'resolv.conf')
+    if os.path.isfile(resolv):
+        binds = ['-b', f"{os.path.abspath(resolv)}:/etc/resolv.conf"]
+
+    def run(root):
+        guest_command = ['env', 'HOME=/root', f'PATH={GUEST_PATH}'] + command
+        return subprocess.run(build_proot_command(config['data_dir'], root, guest_command,
+                                                  config['proot_bin'], binds)).returncode
+
+    new_version_dir = store.promote(version_dir, run, layer_dir=config['rootfs'], command=' '.join(command))
+    _move_instance(store, config, new_version_dir)
+    return new_version_dir
+
+
+def rebase_instance(data_dir):
+    """
+    Move a layered instance onto the current version of its base.
+
+    Returns:
+        str: The version directory it now uses, or None if it was already current.
+    """
+    config, version_dir = _load_layered_instance(data_dir)
+    store = BaseStore(os.path.dirname(os.path.dirname(version_dir)))
+    name = os.path.basename(os.path.dirname(version_dir))
+    current = store.current_version(name)
+    if current is None or current == os.path.basename(version_dir):
+        return None
+    new_version_dir = os.path.join(store.base_dir, name, current)
+    sync_layer(base_root(version_dir), base_root(new_version_dir), config['rootfs'])
+    _move_instance(store, config, new_version_dir)
+    return new_version_dir
+
+
+def base_command(argv):
+    """
+    Run `lcsx base list|promote|rebase|remove`.
+
+    Args:
+        argv: Arguments after 'base'.
+
+    Returns:
+        int: Exit status.
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="Set logging level (default: INFO)")
+    common.add_argument('--log-file', help="Path to log file (default: ~/.lcsx/logs/lcsx.log)")
+    parser = argparse.ArgumentParser(prog='lcsx base',
+                                     description="Manage the shared base rootfs of layered instances")
+    actions = parser.add_subparsers(dest='action', required=True)
+    listing = actions.add_parser('list', parents=[common], help="List the base versions")
+    listing.add_argument('--base-dir', help="Directory of the base versions (default: ~/.cache/lcsx/bases)")
+    promote = actions.add_parser('promote', parents=[common],
+                                 help="Run a command (e.g. a package install) into a new base version and move "
+                                      "the instance onto it")
+    promote.add_argument('data_dir', help="Data directory of a layered instance")
+    promote.add_argument('guest_command', nargs=argparse.REMAINDER,
+                         help="Command to run as root in the base, e.g. apt-get install -y vim")
+    rebase = actions.add_parser('rebase', parents=[common],
+                                help="Move a layered instance onto the current version of its base")
+    rebase.add_argument('data_dir', help="Data directory of a layered instance")
+    remove = actions.add_parser('remove', parents=[common],
+                                help="Delete a base version that is not current and no instance uses")
+    remove.add_argument('name', help="Base name, as shown by lcsx base list")
+    remove.add_argument('version', help="Version to delete, e.g. v1")
+    remove.add_argument('--force', action='store_true',
+                        help="Delete it even if instances still use it; they will no longer start")
+    remove.add_argument('--base-dir', help="Directory of the base versions (default: ~/.cache/lcsx/bases)")
+    args = parser.parse_args(argv)
+
+    setup_logger(log_level=getattr(logging, args.log_level.upper(), logging.INFO), log_file=args.log_file,
+                 enable_console=False)
+    try:
+        if args.action == 'list':
+            store = BaseStore(args.base_dir)
+            entries = store.entries()
+            if not entries:
+                print_main("No base versions.")
+            for name, version, meta, is_current in entries:
+                created = time.strftime('%Y-%m-%d %H:%M', time.localtime(meta.get('created', 0)))
+                origin = f"from {meta['parent']}: {meta.get('command')}" if meta.get('parent') else meta.get('url', '')
+                users = len(store.users(name, version))
+                print_main(f"{'*' if is_current else ' '} {name}/{version}  {created}  {users} instance(s)  {origin}")
+        elif args.action == 'promote':
+            command = args.guest_command[1:] if args.guest_command[:1] == ['--'] else args.guest_command
+            if not command:
+                parser.error("promote needs a command to run")
+            print_main(f"Running '{' '.join(command)}' in a copy of the base...")
+            new_version_dir = promote_instance(args.data_dir, command)
+            print_main(f"Promoted to {os.path.basename(new_version_dir)}; new instances start from it. "
+                       f"Move other instances with 'lcsx base rebase DATA_DIR'.")
+        elif args.action == 'rebase':
+            new_version_dir = rebase_instance(args.data_dir)
+            if new_version_dir is None:
+                print_main("Already on the current base version.")
+            else:
+                print_main(f"Now on {os.path.basename(new_version_dir)}.")
+        else:
+            users = BaseStore(args.base_dir).remove(args.name, args.version, force=args.force)
+            print_main(f"Removed {args.name}/{args.version}.")
+            for data_dir in users:
+                print_error(f"{data_dir} was still on it and will no longer start; set it up again.")
+    except (LayerError, OSError, ValueError) as e:
+        print_error(f"Base {args.action} failed: {e}")
+        return 1
+    return 0
+
+
+def template_command(argv):
+    """
+    Run `lcsx template list|remove`.
+
+    Args:
+        argv: Arguments after 'template'.
+
+    Returns:
+        int: Exit status.
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="Set logging level (default: INFO)")
+    common.add_argument('--log-file', help="Path to log file (default: ~/.lcsx/logs/lcsx.log)")
+    common.add_argument('--template-dir',
+                        help="Directory of the pristine rootfs templates (default: ~/.cache/lcsx/templates)")
+    parser = argparse.ArgumentParser(prog='lcsx template', description="Manage the pristine rootfs templates")
+    actions = parser.add_subparsers(dest='action', required=True)
+    actions.add_parser('list', parents=[common], help="List the rootfs templates")
+    remove = actions.add_parser('remove', parents=[common],
+                                help="Delete rootfs templates; the next setup of their release builds them again")
+    remove.add_argument('names', nargs='+', help="Template names, as shown by lcsx template list")
+    args = parser.parse_args(argv)
+
+    setup_logger(log_level=getattr(logging, args.log_level.upper(), logging.INFO), log_file=args.log_file,
+                 enable_console=False)
+    try:
+        store = TemplateStore(args.template_dir)
+        if args.action == 'list':
+            entries = store.entries()
+            if not entries:
+                print_main("No rootfs templates.")
+            for name, meta in entries:
+                last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(store.last_used(name)))
+                size = format_size(meta['size']) if 'size' in meta else '?'
+                print_main(f"{name}  {size}  last used {last_used}  {meta.get('url', '')}")
+        else:
+            for name in args.names:
+                store.remove(name)
+                print_main(f"Removed template {name}.")
+    except (OSError, ValueError) as e:
+        print_error(f"Template {args.action} failed: {e}")
+        return 1
+    return 0
+
+
+def _print_paths(label, paths, limit=20, printer=print_error):
+    """Print up to limit paths of a verify report."""
+    for path in paths[:limit]:
+        printer(f"{label}: {path}")
+    if len(paths) > limit:
+        printer(f"... and {len(paths) - limit} more {label} entries")
+
+
+def rootfs_command(argv):
+    """
+    Run `lcsx rootfs verify|repair DATA_DIR`.
+
+    Args:
+        argv: Arguments after 'rootfs'.
+
+    Returns:
+        int: Exit status (1 if the rootfs is damaged or cannot be checked).
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="Set logging level (default: INFO)")
+    common.add_argument('--log-file', help="Path to log file (default: ~/.lcsx/logs/lcsx.log)")
+    parser = argparse.ArgumentParser(prog='lcsx rootfs', description="Check the rootfs of a data directory")
+    actions = parser.add_subparsers(dest='action', required=True)
+    verify = actions.add_parser('verify', parents=[common],
+                                help="Compare the rootfs with the manifest recorded when it was extracted")
+    verify.add_argument('data_dir', help="Data directory of an lcsx instance")
+    verify.add_argument('--hash', choices=HASH_MODES, default='sample',
+                        help="Re-hash no files, a random sample, or every file (default: sample)")
+    verify.add_argument('--sample-rate', type=float,
+                        help=f"Fraction of files re-hashed with --hash sample (default: {VERIFY_SAMPLE_RATE})")
+    verify.add_argument('--workers', type=int, help="Checking processes (default: one per CPU)")
+    repair = actions.add_parser('repair', parents=[common],
+                                help="Re-extract only the missing or modified files from the cached rootfs tarball")
+    repair.add_argument('data_dir', help="Data directory of an lcsx instance")
+    repair.add_argument('--hash', choices=HASH_MODES, default='none',
+                        help="How files are checked before repairing: metadata only, plus a random sample "
+                             "re-hashed, or every file re-hashed (default: none)")
+    repair.add_argument('--all', action='store_true',
+                        help="Also restore modified files under /etc, /root, /home, /var, /tmp and /run, which "
+                             "normally hold the instance's own changes")
+    repair.add_argument('--cache-dir', help="Directory of the shared artifact cache (default: ~/.cache/lcsx)")
+    args = parser.parse_args(argv)
+
+    setup_logger(log_level=getattr(logging, args.log_level.upper(), logging.INFO), log_file=args.log_file,
+                 enable_console=False)
+    rootfs_dir = os.path.join(os.path.abspath(args.data_dir), 'rootfs')
+    if args.action == 'repair':
+        return _repair_rootfs(rootfs_dir, args)
+    report = verify_rootfs(rootfs_dir, hash_mode=args.hash, sample_rate=args.sample_rate, workers=args.workers)
+    if report is None:
+        print_error(f"No manifest for {rootfs_dir}: it was set up before manifests were recorded, "
+                    f"or it is a layered instance")
+        return 1
+    _print_paths('missing', report['missing'])
+    _print_paths('modified', report['modified'])
+    # resolv.conf, the prompt in .bashrc, packages: changed by setup and use, not damage
+    _print_paths('changed by the instance', report['state'], printer=print_main)
+    print_main(f"Checked {report['checked']} entries ({report['hashed']} re-hashed) in {report['seconds']:.1f}s: "
+               f"{len(report['missing'])} missing, {len(report['modified'])} modified, "
+               f"{len(report['state'])} changed by the instance under /etc, /root, /home, /var, /tmp or /run.")
+    return 1 if report['missing'] or report['modified'] else 0
+
+
+def _repair_rootfs(rootfs_dir, args):
+    """Run `lcsx rootfs repair`; returns the exit status."""
+    try:
+        setup_cache(cache_dir=args.cache_dir)
+        result = repair_rootfs(rootfs_dir, hash_mode=args.hash, restore_modified=args.all)
+    except (OSError, tarfile.TarError, lzma.LZMAError) as e:
+        print_error(f"Repair failed: {e}")
+        return 1
+    if result is None:
+        print_error(f"Cannot repair {rootfs_dir}: it has no manifest, or its rootfs tarball is no longer cached")
+        return 1
+    if not result['damaged']:
+        print_main("Nothing to repair.")
+        return 0
+    _print_paths('still damaged', result['remaining'])
+    print_main(f"Restored {len(result['damaged']) - len(result['remaining'])} of {len(result['damaged'])} "
+               f"damaged entries in {result['seconds']:.1f}s.")
+    return 1 if result['remaining'] else 0
+
+
+def run_subcommand(argv):
+    """
+    Dispatch argv[0] to its subcommand.
+
+    Returns:
+        int: Exit status.
+    """
+    if argv[0] == 'cache':
+        return cache_command(argv[1:])
+    if argv[0] == 'bundle':
+        return bundle_command(argv[1:])
+    if argv[0] == 'bench':
+        return bench_command(argv[1:])
+    if argv[0] == 'base':
+        return base_command(argv[1:])
+    if argv[0] == 'rootfs':
+        return rootfs_command(argv[1:])
+    if argv[0] == 'template':
+        return template_command(argv[1:])
+    raise ValueError(f"Unknown subcommand: {argv[0]}")
@@ -6,6 +6,7 @@ Provides backward compatibility with old print functions while supporting struct
 
 import logging
 from lcsx.core.logger import get_logger, setup_logger
+from lcsx.ui.progress import clear_progress_line
 
 # Initialize logger if not already done
 _logger = None
@@ -20,12 +21,14 @@ def _get_logger():
 def print_main(msg):
     """Print a main message with [!] prefix."""
     prefix = "\033[94m[\033[97m!\033[94m]\033[0m"
+    clear_progress_line()
     print(f"{prefix} \033[97m{msg}\033[0m")
     _get_logger().info(msg)
 
 def print_error(msg):
     """Print an error message with [⨯] prefix."""
     prefix = "\033[1;91m[\033[97m⨯\033[91m]\033[0m"
+    clear_progress_line()
     print(f"{prefix} \033[1m{msg}\033[0m")
     _get_logger().error(msg)
 
@@ -38,15 +41,6 @@ def print_prompt(msg):
 def print_warning(msg):
     """Print a warning message."""
     prefix = "\033[93m[\033[97m⚠\033[93m]\033[0m"
+    clear_progress_line()
     print(f"{prefix} \033[93m{msg}\033[0m")
     _get_logger().warning(msg)
-
-def download_progress(block_num, block_size, total_size):
-    """Progress callback for download."""
-    if total_size > 0:
-        percent = (block_num * block_size / total_size) * 100
-        prefix = "\033[94m[\033[97m!\033[94m]\033[0m"
-        print(f"\r{prefix} \033[97mDownloading rootfs... {percent:.2f}%\033[0m", end='', flush=True)
-        # Log progress every 10%
-        if int(percent) % 10 == 0:
-            _get_logger().debug(f"Download progress: {percent:.2f}%")
@@ -0,0 +1,182 @@
+"""
+Progress display for LCSX.
+Throttled progress lines with rate and ETA for downloads, extraction and package installs.
+"""
+
+import shutil
+import sys
+import threading
+import time
+from lcsx.config.constants import PROGRESS_REFRESH_RATE, PROGRESS_LOG_INTERVAL
+from lcsx.core.logger import get_logger
+
+PREFIX = "\033[94m[\033[97m!\033[94m]\033[0m"
+
+# Bars currently shown; every bar shares one status line on a TTY
+_active = []
+_lock = threading.RLock()
+_last_draw = 0.0
+_line_drawn = False
+
+
+def format_size(num):
+    """Format a byte count as B/KB/MB/GB."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024 or unit == 'GB':
+            return f"{num:.0f} {unit}" if unit == 'B' else f"{num:.1f} {unit}"
+        num /= 1024
+
+
+def format_duration(seconds):
+    """Format seconds as M:SS or H:MM:SS."""
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def _is_tty():
+    try:
+        return sys.stdout.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def clear_progress_line():
+    """Erase the status line so a regular message can be printed; it is redrawn on the next update."""
+    global _line_drawn
+    with _lock:
+        if _line_drawn:
+            sys.stdout.write("\r\033[K")
+            sys.stdout.flush()
+            _line_drawn = False
+
+
+def _draw(force=False):
+    """Redraw the shared status line, at most PROGRESS_REFRESH_RATE times per second."""
+    global _last_draw, _line_drawn
+    now = time.monotonic()
+    if not force and now - _last_draw < 1.0 / PROGRESS_REFRESH_RATE:
+        return
+    _last_draw = now
+    if not _active:
+        return
+    width = shutil.get_terminal_size((80, 24)).columns
+    text = '  |  '.join(bar.describe(now) for bar in _active)
+    if len(text) + 4 > width:
+        text = text[:max(width - 5, 0)]
+    sys.stdout.write(f"\r\033[K{PREFIX} \033[97m{text}\033[0m")
+    sys.stdout.flush()
+    _line_drawn = True
+
+
+class ProgressBar:
+    """
+    Progress of one task, in bytes or items.
+
+    Updates are cheap: on a TTY the shared status line is redrawn at a fixed
+    frame rate no matter how often update() is called, showing the rate and
+    ETA. When stdout is not a TTY, a single log line is emitted every
+    PROGRESS_LOG_INTERVAL seconds instead. Use as a context manager, and pass
+    reporthook to download functions expecting a urlretrieve-style callback.
+    """
+
+    def __init__(self, label, total=None, unit='bytes'):
+        self.label = label
+        self.total = total if total and total > 0 else None
+        self.unit = unit
+        self.current = 0
+        self.started = time.monotonic()
+        self._rate = 0.0
+        self._rate_sample = (self.started, 0)
+        self._last_log = self.started
+        self._tty = _is_tty()
+        self._closed = False
+        with _lock:
+            _active.append(self)
+
+    def _format_amount(self, amount):
+        return format_size(amount) if self.unit == 'bytes' else f"{amount:.0f}"
+
+    def _update_rate(self, now):
+        sample_time, sample_value = self._rate_sample
+        elapsed = now - sample_time
+        if elapsed >= 0.5:
+            instant = (self.current - sample_value) / elapsed
+            # Exponential smoothing keeps the ETA from jumping around
+            self._rate = instant if not self._rate else 0.3 * instant + 0.7 * self._rate
+            self._rate_sample = (now, self.current)
+
+    def describe(self, now=None):
+        """Return the one-line status text for this bar."""
+        now = now or time.monotonic()
+        self._update_rate(now)
+        parts = [self.label]
+        if self.total:
+            parts.append(f"{min(self.current / self.total, 1.0) * 100:5.1f}%")
+            parts.append(f"{self._format_amount(self.current)}/{self._format_amount(self.total)}")
+        else:
+            parts.append(self._format_amount(self.current))
+        if self._rate > 0:
+            rate = format_size(self._rate) if self.unit == 'bytes' else f"{self._rate:.1f} {self.unit}"
+            parts.append(f"{rate}/s")
+            if self.total and self.current < self.total:
+                parts.append(f"ETA {format_duration((self.total - self.current) / self._rate)}")
+        return ' '.join(parts)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._tty:
+            _draw()
+        if now - self._last_log >= PROGRESS_LOG_INTERVAL:
+            self._last_log = now
+            text = self.describe(now)
+            get_logger().info(text)
+            if not self._tty:
+                print(f"{PREFIX} \033[97m{text}\033[0m", flush=True)
+
+    def set_total(self, total):
+        """Set or change the expected total."""
+        self.total = total if total and total > 0 else None
+
+    def update(self, amount=1):
+        """Add amount to the progress."""
+        with _lock:
+            self.current += amount
+            self._refresh()
+
+    def set(self, current):
+        """Set the absolute progress."""
+        with _lock:
+            self.current = current
+            self._refresh()
+
+    def reporthook(self, block_num, block_size, total_size):
+        """urlretrieve-style callback: (blocks so far, block size, total size or -1)."""
+        if total_size and total_size > 0:
+            self.total = total_size
+        current = block_num * block_size
+        self.set(min(current, self.total) if self.total else current)
+
+    def finish(self):
+        """Remove the bar from the status line and log a summary."""
+        with _lock:
+            if self._closed:
+                return
+            self._closed = True
+            _active.remove(self)
+            if self._tty:
+                clear_progress_line()
+                if _active:
+                    _draw(force=True)
+        elapsed = time.monotonic() - self.started
+        rate = self.current / elapsed if elapsed > 0 else 0
+        amount = self._format_amount(self.current)
+        speed = f"{format_size(rate)}/s" if self.unit == 'bytes' else f"{rate:.1f} {self.unit}/s"
+        get_logger().info(f"{self.label}: {amount} in {format_duration(elapsed)} ({speed})")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()